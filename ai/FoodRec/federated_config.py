@@ -92,3 +92,91 @@ GLOBAL_MODEL_SAVE_PATH = os.path.join(
     BASE_DIR, "global_shanghai_food_model.pth")
 PREPROCESSOR_SAVE_PATH = os.path.join(
     BASE_DIR, "global_shanghai_preprocessor.joblib")
+# BatchNorm-folded, frozen TorchScript export of GLOBAL_MODEL_SAVE_PATH (python food_serving_model.py)
+TORCHSCRIPT_MODEL_SAVE_PATH = os.path.join(
+    BASE_DIR, "global_shanghai_food_model_folded.pt")
+# Folded weights + preprocessor statistics for the NumPy backend (also written by food_serving_model.py)
+NUMPY_BUNDLE_SAVE_PATH = os.path.join(
+    BASE_DIR, "global_shanghai_serving_bundle.npz")
+# Versioned, memory-mapped artifact: the above plus the encoded catalog and its IDs (python food_serving_bundle.py)
+SERVING_BUNDLE_SAVE_PATH = os.path.join(
+    BASE_DIR, "global_shanghai_serving.bundle")
+# Directory of the catalog display store file (RestaurantCatalog responses, memory-mapped rather than kept on
+# the heap; unlinked once mapped). None = the system temp dir; point it at disk where that is a RAM tmpfs.
+CATALOG_DISPLAY_STORE_DIR = None
+# Two-tower candidate retrieval model distilled from the reco model (python food_retrieval.py)
+RETRIEVAL_MODEL_SAVE_PATH = os.path.join(
+    BASE_DIR, "global_shanghai_retrieval.pt")
+# Optional; any change to it (e.g. a training run writing its round/tag) also triggers a hot reload
+MODEL_VERSION_FILE = os.path.join(
+    BASE_DIR, "global_shanghai_model.version")
+
+# --- Recommendation Serving ---
+RECO_BATCH_MAX_CONTEXTS = 1024        # Max user contexts per /recommend_batch call
+RECO_TOP_N = 20                       # /recommend results per request (coalesced or not)
+RECO_BATCH_MAX_TOP_N = 100            # Largest accepted /recommend_batch per-entry top_n (default RECO_TOP_N)
+RECO_GROUP_TOP_K = 5                  # /recommend?group_by=cuisine|adname: results per group (default of per_group)
+RECO_GROUP_MAX_K = 50                 # Largest accepted per_group
+RECO_BATCH_MAX_SCORE_ROWS = 262144    # Max (users x restaurants) rows per batched forward chunk
+RECO_CACHE_MAX_ENTRIES = 4096         # /recommend result cache size (LRU); 0 disables caching
+RECO_CACHE_TTL_SECONDS = 300
+# Off: the cache key is the exact context and results are those of the unbucketed model inputs.
+# On: numeric context values are snapped to RECO_CACHE_NUMERIC_BUCKETS before keying *and* scoring, so
+# more requests hit the cache but rankings change (every request in a bucket gets the bucket's answer).
+RECO_CACHE_QUANTIZE = False
+# Bucket size per numeric context column when RECO_CACHE_QUANTIZE is on.
+# Columns not listed (or bucket 0) are matched exactly.
+RECO_CACHE_NUMERIC_BUCKETS = {
+    'heart_rate_bpm': 5, 'blood_sugar_mmol_L': 0.5, 'sleep_hours_last_night': 0.5,
+    'weather_temp_celsius': 2, 'weather_humidity_percent': 10, 'steps_today_before_meal': 1000,
+}
+RECO_INT8_QUANTIZATION = False        # Serve the reco model with dynamic int8 Linear layers (CPU)
+RECO_INT8_OVERLAP_TOP_K = 20          # k for the startup fp32-vs-int8 top-k overlap check
+RECO_INT8_MIN_TOP_K_OVERLAP = 0.9     # Int8 is refused below this mean overlap
+RECO_TORCHSCRIPT_SERVING = True       # Serve the reco model as a BatchNorm-folded, frozen TorchScript graph
+RECO_INFERENCE_BACKEND = 'torch'      # inference_api engine backend: 'torch', 'int8', 'numpy' (needs NUMPY_BUNDLE_SAVE_PATH) or 'bundle' (SERVING_BUNDLE_SAVE_PATH)
+INFERENCE_HOT_RELOAD_INTERVAL_SECONDS = 10  # inference_api polls the model files this often; 0 disables
+INFERENCE_WORKERS = 1                 # inference_api --workers default; >1 pre-forks workers sharing one load
+RECO_SERVER_TIMING_ENABLED = True     # /recommend(_batch): per-phase Server-Timing header (?debug=timing adds it to the body)
+METRICS_ENABLED = True                # food_server /metrics (Prometheus text): per-route counts, latency, sizes
+METRICS_LATENCY_BUCKETS_SECONDS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+METRICS_SIZE_BUCKETS_BYTES = [256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+RECO_COALESCE_ENABLED = False         # food_server /recommend: queue concurrent requests into one batched pass
+RECO_COALESCE_MAX_WAIT_MS = 5         # A batch closes this long after its first request arrived...
+RECO_COALESCE_MAX_BATCH = 32          # ...or once this many requests are queued
+RECO_SHARDED_SCORING = False          # food_server: score the full catalog in worker processes started once
+RECO_SCORING_SHARDS = 8               # Contiguous catalog row shards, each merged as a local top-k
+RECO_SCORING_WORKERS = 0              # Worker processes owning the shards; 0 = one per CPU core
+RECO_SHARDED_MIN_ROWS = 200000        # Smaller catalogs score in process: the IPC round trip outweighs the split
+RECO_RETRIEVAL_ENABLED = False        # Re-rank only two-tower ANN candidates instead of the whole catalog
+RECO_RETRIEVAL_CANDIDATES = 300       # Candidates retrieved per request
+RECO_RETRIEVAL_NUM_PROBES = 8         # Minimum IVF lists scanned per query
+RETRIEVAL_EMBED_DIM = 32
+RETRIEVAL_TRAIN_EPOCHS = 30
+# Hard exclusions before scoring: every value in a context's food_allergies / diseases ("海鲜; 花生") drops the
+# restaurants whose dish tags or cuisine contain one of its keywords (substring match, see CatalogIndex.tags)
+RECO_HEALTH_EXCLUSIONS_ENABLED = True
+SEAFOOD_KEYWORDS = ["海鲜", "虾", "蟹", "贝", "蚝", "蛤", "蚬", "螺", "鲍", "鱿", "墨鱼", "章鱼", "海胆", "海参",
+                    "刺身", "三文鱼", "金枪鱼", "鳕鱼", "鱼子"]
+ALLERGY_EXCLUSION_KEYWORDS = {
+    "海鲜": SEAFOOD_KEYWORDS,
+    "花生": ["花生"],
+    "坚果": ["坚果", "核桃", "杏仁", "腰果", "榛子", "开心果", "碧根果", "松子", "夏威夷果"],
+    "乳制品": ["奶", "芝士", "乳酪", "黄油", "拿铁", "卡布奇诺", "提拉米苏", "冰淇淋", "雪糕"],
+    "鸡蛋": ["蛋"],
+    "大豆": ["豆腐", "豆浆", "豆花", "腐竹", "豆皮", "豆干", "毛豆", "黄豆", "纳豆", "味噌", "腐乳"],
+    "谷蛋白(小麦)": ["面", "包子", "饺", "馒头", "饼", "披萨", "比萨", "汉堡", "油条", "蛋糕", "吐司", "三明治",
+                 "烧麦", "烧卖", "馄饨", "云吞", "生煎", "小笼", "锅贴", "意粉"],
+    "芒果": ["芒果", "杨枝甘露"],
+}
+DISEASE_EXCLUSION_KEYWORDS = {
+    "痛风": SEAFOOD_KEYWORDS + ["啤酒", "肝", "肥肠", "腰花"],
+    "糖尿病": ["甜品", "甜点", "蛋糕", "奶茶", "冰淇淋", "糖水", "红糖", "拔丝", "甘露", "星冰乐"],
+    "高血糖": ["甜品", "甜点", "蛋糕", "奶茶", "冰淇淋", "糖水", "红糖", "拔丝", "甘露", "星冰乐"],
+    "高血脂": ["肥肠", "五花肉", "红烧肉", "扣肉", "蹄髈", "炸鸡", "鹅肝"],
+    "冠心病": ["肥肠", "五花肉", "红烧肉", "扣肉", "蹄髈", "炸鸡", "鹅肝"],
+    "脂肪肝": ["酒", "肥肠", "五花肉", "红烧肉", "炸鸡", "鹅肝"],
+    "高血压": ["腊肉", "腊肠", "咸鱼", "咸肉", "腌", "榨菜"],
+    "胃病": ["麻辣", "香辣", "酸辣", "冰"],
+    "失眠": ["咖啡", "coffee", "拿铁", "卡布奇诺"],
+}
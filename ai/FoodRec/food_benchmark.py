@@ -0,0 +1,232 @@
+# food_benchmark.py
+# Reproducible benchmark of the /recommend scoring path over synthetic catalogs of growing size.
+# Usage: python food_benchmark.py [--sizes 5000,50000,500000,2000000] [--shards 16 --scoring-workers 1,2,4]
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import federated_config as config
+
+DEFAULT_SIZES = [5000, 50000, 500000, 2000000]
+TOP_K = 20  # As served by /recommend
+
+
+def synthesize_catalog(num_rows, seed=0):
+    """num_rows restaurants in the shanghai_restaurants.csv schema, resampled from the real catalog.
+
+    Ids are made unique and cost/rating are jittered, so no two rows are exact duplicates.
+    """
+    from food_data_generator import load_csv_to_dataframe
+    base_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
+    base_df = base_df.rename(columns={'id': 'restaurant_id', 'rating': 'rating_biz'})
+    rng = np.random.default_rng(seed)
+    df = base_df.iloc[rng.integers(0, len(base_df), size=num_rows)].reset_index(drop=True)
+    df['restaurant_id'] = [f"BENCH{i:08d}" for i in range(num_rows)]
+    for col, scale, low, high in (('cost', 0.15, 0.0, None), ('rating_biz', 0.05, 0.0, 5.0)):
+        if col in df.columns:
+            values = df[col].astype(float)
+            df[col] = np.clip(values * (1 + rng.normal(0, scale, num_rows)), low, high).round(1)
+    return df
+
+
+def synthetic_user_contexts(count, seed=0):
+    """Varied user contexts with every user-side request field filled."""
+    rng = np.random.default_rng(seed)
+    contexts = []
+    for _ in range(count):
+        contexts.append({
+            'gender': str(rng.choice(config.GENDERS)), 'activity_level': str(rng.choice(config.ACTIVITY_LEVELS)),
+            'hometown': 'Unknown', 'occupation': 'Unknown', 'education_level': 'Unknown',
+            'marital_status': 'Unknown', 'cooking_skills': 'Unknown', 'diseases': 'Unknown',
+            'dietary_preferences': 'Unknown', 'food_allergies': 'Unknown',
+            'age': int(rng.integers(18, 70)), 'height_cm': float(rng.normal(168, 8)),
+            'weight_kg': float(rng.normal(62, 10)), 'daily_food_budget_cny': float(rng.integers(30, 300)),
+            'heart_rate_bpm': float(rng.integers(55, 110)), 'blood_sugar_mmol_L': float(rng.normal(5.2, 0.6)),
+            'sleep_hours_last_night': float(rng.normal(7, 1)), 'weather_temp_celsius': float(rng.integers(0, 36)),
+            'weather_humidity_percent': float(rng.integers(30, 95)),
+            'steps_today_before_meal': float(rng.integers(0, 15000)),
+        })
+    return contexts
+
+
+def latency_stats(seconds):
+    ms = np.asarray(seconds) * 1000.0
+    return {"n": len(ms), "mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)), "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max())}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == 'Darwin' else peak / 1024
+
+
+def _timed(timings, stage, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    timings.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def benchmark_sharded(engine, contexts, iterations, num_shards, worker_counts):
+    """Single-context top-k through a ShardedScoringPool for each worker count; speedup is vs the first count."""
+    from food_sharded_scoring import ShardedScoringPool
+    results = {}
+    for num_workers in worker_counts:
+        pool = ShardedScoringPool(engine.candidate_encoder, num_shards, num_workers)
+        timings = {}
+        try:
+            sharded = pool.load_model(engine)
+            for i in range(iterations + 1):
+                _timed(timings if i else {}, 'total', sharded.top_k, [contexts[i % len(contexts)]], TOP_K)
+        finally:
+            pool.close()
+        results[str(num_workers)] = latency_stats(timings['total'])
+    baseline = results[str(worker_counts[0])]['p50_ms']
+    for stats in results.values():
+        stats['speedup_p50'] = baseline / stats['p50_ms']
+    return results
+
+
+def benchmark_catalog_size(num_rows, iterations, batch_size, batch_iterations, seed=0,
+                           num_shards=0, scoring_worker_counts=()):
+    """Benchmarks one catalog size; meant to run in a fresh process so peak RSS is per size."""
+    import joblib
+    import torch
+    from flask import Flask
+    from food_catalog import RestaurantCatalog
+    from food_features import build_candidate_encoder
+    from food_scoring import batched_top_k
+    from food_reco_engine import RecommendationEngine, load_reco_model
+    from food_reco_output import RecommendationRecordStore, recommendations_response, batch_recommendations_response
+
+    setup = {}
+    start = time.perf_counter()
+    catalog_df = synthesize_catalog(num_rows, seed)
+    setup['synthesize_catalog_s'] = time.perf_counter() - start
+    start = time.perf_counter()
+    catalog = RestaurantCatalog(catalog_df)  # Includes the display store the record store renders from
+    setup['build_catalog_s'] = time.perf_counter() - start
+    del catalog_df
+    preprocessor = joblib.load(config.PREPROCESSOR_SAVE_PATH)
+    start = time.perf_counter()
+    encoder = build_candidate_encoder(preprocessor, catalog.feature_frame(), log_prefix="Benchmark: ")
+    setup['encode_catalog_s'] = time.perf_counter() - start
+    if encoder is None:
+        raise RuntimeError("Candidate encoder could not be built for the synthetic catalog.")
+    model = load_reco_model(torch.load(config.GLOBAL_MODEL_SAVE_PATH, map_location='cpu'), encoder.num_features)
+    start = time.perf_counter()
+    # Stages are timed on the engine's factorized scoring directly, so no sharding or retrieval here
+    engine = RecommendationEngine(catalog, preprocessor, model, backend='torch', candidate_encoder=encoder,
+                                  log_prefix="Benchmark: ").scoring_engine
+    setup['build_scoring_engine_s'] = time.perf_counter() - start
+    record_store = RecommendationRecordStore(catalog)
+    app = Flask(__name__)
+    app.config['JSON_AS_ASCII'] = False
+
+    contexts = synthetic_user_contexts(max(iterations, batch_size * batch_iterations), seed + 1)
+    single, batched = {}, {}
+    with app.app_context(), torch.no_grad():
+        # Single context, as /recommend: encode the user row, factorized forward, top-k, render JSON
+        for i in range(iterations + 1):
+            timings = {} if i == 0 else single  # First pass warms up allocators and caches
+            request_start = time.perf_counter()
+            user_vector = _timed(timings, 'preprocess', encoder.encode_user, contexts[i % len(contexts)])
+            scores = _timed(timings, 'forward', lambda: torch.softmax(
+                engine.logits_for_user_vector(user_vector), dim=1)[:, 2])
+            top_scores, top_indices = _timed(timings, 'top_k', torch.topk, scores, k=min(TOP_K, len(scores)))
+            _timed(timings, 'serialize', lambda: recommendations_response(
+                record_store, top_indices.tolist(), top_scores, None).get_data())
+            timings.setdefault('total', []).append(time.perf_counter() - request_start)
+        # batch_size contexts per call, as /recommend_batch
+        for i in range(batch_iterations + 1):
+            timings = {} if i == 0 else batched
+            batch = [contexts[(i * batch_size + j) % len(contexts)] for j in range(batch_size)]
+            request_start = time.perf_counter()
+            user_vectors = _timed(timings, 'preprocess', encoder.encode_users, batch)
+            scores = _timed(timings, 'forward', lambda: torch.softmax(
+                engine.logits_for_user_vectors(user_vectors), dim=-1)[..., 2])
+            top_per_entry = _timed(timings, 'top_k', batched_top_k, scores, [TOP_K] * batch_size)
+            _timed(timings, 'serialize', lambda: batch_recommendations_response(
+                record_store, [(top_indices.tolist(), top_scores) for top_scores, top_indices in top_per_entry],
+                None).get_data())
+            timings.setdefault('total', []).append(time.perf_counter() - request_start)
+
+    result = {"catalog_rows": num_rows, "setup": setup,
+              "single": {stage: latency_stats(values) for stage, values in single.items()},
+              "batched": {stage: latency_stats(values) for stage, values in batched.items()},
+              "batch_size": batch_size}
+    if num_shards > 0 and scoring_worker_counts:
+        # Per worker count; only meaningful with at least that many free cores
+        result['sharded'] = benchmark_sharded(engine, contexts, iterations, num_shards, scoring_worker_counts)
+        result['sharded_shards'] = num_shards
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_benchmarks(sizes, iterations, batch_size, batch_iterations, seed=0, num_shards=0, scoring_worker_counts=()):
+    results = []
+    spawn = multiprocessing.get_context('spawn')
+    for num_rows in sizes:
+        print(f"--- Benchmarking catalog of {num_rows} restaurants ---")
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            try:
+                result = pool.submit(benchmark_catalog_size, num_rows, iterations, batch_size,
+                                     batch_iterations, seed, num_shards, scoring_worker_counts).result()
+            except BrokenProcessPool:
+                result = {"catalog_rows": num_rows, "error": "Benchmark process died (out of memory?)."}
+            except Exception as e:
+                result = {"catalog_rows": num_rows, "error": str(e)}
+        if 'error' in result:
+            print(f"Catalog {num_rows}: FAILED ({result['error']})")
+        else:
+            print(f"Catalog {num_rows}: single p50 {result['single']['total']['p50_ms']:.2f}ms "
+                  f"p99 {result['single']['total']['p99_ms']:.2f}ms; batch of {batch_size} p50 "
+                  f"{result['batched']['total']['p50_ms']:.2f}ms; peak RSS {result['peak_rss_mb']:.0f} MB")
+            for num_workers, stats in result.get('sharded', {}).items():
+                print(f"  sharded, {num_workers} workers: p50 {stats['p50_ms']:.2f}ms "
+                      f"(speedup {stats['speedup_p50']:.2f}x)")
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation path across catalog sizes.")
+    parser.add_argument('--sizes', type=str, default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="Comma-separated catalog sizes (rows).")
+    parser.add_argument('--iterations', type=int, default=50, help="Timed single-context requests per size.")
+    parser.add_argument('--batch-size', type=int, default=16, help="Contexts per batched request.")
+    parser.add_argument('--batch-iterations', type=int, default=10, help="Timed batched requests per size.")
+    parser.add_argument('--shards', type=int, default=0,
+                        help="Also benchmark sharded scoring with this many catalog shards (0 = skip).")
+    parser.add_argument('--scoring-workers', type=str, default="1,2,4",
+                        help="Comma-separated worker counts for the sharded benchmark.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default="reco_benchmark_results.json")
+    args = parser.parse_args()
+
+    import torch
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    scoring_worker_counts = [int(w) for w in args.scoring_workers.split(",") if w.strip()]
+    results = run_benchmarks(sizes, args.iterations, args.batch_size, args.batch_iterations, args.seed,
+                             args.shards, scoring_worker_counts)
+    report = {"meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                       "torch": torch.__version__, "platform": platform.platform(), "cpu_count": os.cpu_count(),
+                       "torch_threads": torch.get_num_threads(), "iterations": args.iterations,
+                       "batch_size": args.batch_size, "batch_iterations": args.batch_iterations, "seed": args.seed,
+                       "top_k": TOP_K, "torchscript_serving": config.RECO_TORCHSCRIPT_SERVING,
+                       "int8_quantization": config.RECO_INT8_QUANTIZATION, "shards": args.shards,
+                       "scoring_workers": scoring_worker_counts if args.shards > 0 else []},
+              "results": results}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results written to {args.output}")
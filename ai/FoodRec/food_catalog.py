@@ -0,0 +1,272 @@
+# food_catalog.py
+# Column-oriented restaurant catalog shared by the servers, the engine and the clients. Scoring and filter
+# columns are category codes and float32 arrays; the display columns (addresses, tags, photo URLs...) are
+# kept as their response JSON in one packed UTF-8 buffer, memory-mapped from a file and decoded only for
+# the final top-k.
+# pandas is imported where a catalog is built or a frame is returned, not at import: food_reco_output imports
+# this module, and the inference API imports that before its readiness probe (see inference_api.py).
+import atexit
+import json
+import os
+import re
+import sys
+import tempfile
+
+import numpy as np
+
+import federated_config as config
+
+SCORE_FIELD = 'recommendation_score'
+TAG_SEPARATOR = re.compile(r'[,，]')  # The tag column is a comma-separated dish list
+# One encoder for every fragment: json.dumps with options builds a new JSONEncoder per call
+_json = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def _row_fragments(records, cols):
+    """Per row, the '"col":value' fragments of cols joined by commas, as UTF-8 bytes."""
+    if not cols:
+        return [b''] * len(records)
+    per_col = [[f"{key}:{_json(value)}" for value in records[col].tolist()]
+               for col, key in zip(cols, map(_json, cols))]
+    return [','.join(fragments).encode('utf-8') for fragments in zip(*per_col)]
+
+
+def _remove_mapped_file(path):
+    # POSIX keeps a mapping valid after unlink, so the file disappears with the process; where an open
+    # mapping blocks removal (Windows) it is retried at exit
+    try:
+        os.remove(path)
+    except OSError:
+        atexit.register(lambda: os.path.exists(path) and os.remove(path))
+
+
+class DisplayStore:
+    """Response JSON of every catalog row, packed into one UTF-8 buffer with a row offset array.
+
+    Each value is rendered once as a '"col":value' fragment (missing -> "N/A", keys sorted the way
+    jsonify sorts them). A row holds its fragments for keys before SCORE_FIELD, then those after, so a
+    full record is two slices around the score.
+
+    Once rendered, the buffer and offsets are written to a file in directory (CATALOG_DISPLAY_STORE_DIR,
+    by default the temp dir) in the serving bundle format and read back through a read-only memory map:
+    they live in the page cache rather than on the heap, pages no request touches can be dropped by the
+    OS, and pre-forked workers share them.
+    """
+    CHUNK_ROWS = 50000  # Rows rendered at a time, bounding the temporary per-value strings
+
+    def __init__(self, all_restaurants_df, directory=None):
+        from food_serving_bundle import ServingBundle, write_serving_bundle
+        self.columns = sorted(all_restaurants_df.columns)
+        self.num_rows = len(all_restaurants_df)
+        before = [col for col in self.columns if col < SCORE_FIELD]
+        after = [col for col in self.columns if col > SCORE_FIELD]
+        chunks, row_lengths, split_lengths = [], [], []
+        for start in range(0, self.num_rows, self.CHUNK_ROWS):
+            records = all_restaurants_df.iloc[start:start + self.CHUNK_ROWS].astype(object).fillna('N/A')
+            rows = list(zip(_row_fragments(records, before), _row_fragments(records, after)))
+            chunks.append(b''.join(head + tail for head, tail in rows))
+            row_lengths.extend(len(head) + len(tail) for head, tail in rows)
+            split_lengths.extend(len(head) for head, _ in rows)
+        arrays = {'buffer': np.frombuffer(b''.join(chunks), dtype=np.uint8),
+                  'row_offsets': np.concatenate([[0], np.cumsum(row_lengths, dtype=np.int64)]),
+                  'split_lengths': np.asarray(split_lengths, dtype=np.uint32)}
+        del chunks
+        directory = config.CATALOG_DISPLAY_STORE_DIR if directory is None else directory
+        fd, path = tempfile.mkstemp(prefix='food_display_', suffix='.bundle', dir=directory)
+        os.close(fd)
+        try:
+            write_serving_bundle(path, arrays, {"num_rows": self.num_rows, "columns": self.columns})
+            mapped = ServingBundle(path)
+        finally:
+            _remove_mapped_file(path)
+        self._buffer, self._row_offsets, self._split_lengths = (
+            mapped['buffer'], mapped['row_offsets'], mapped['split_lengths'])
+
+    @property
+    def nbytes(self):
+        """Bytes of the memory-mapped file's arrays (page cache, not heap)."""
+        return self._buffer.nbytes + self._row_offsets.nbytes + self._split_lengths.nbytes
+
+    def record_parts(self, row):
+        """(before, after): the row's comma-joined fragments for keys sorted before / after SCORE_FIELD."""
+        start, end = int(self._row_offsets[row]), int(self._row_offsets[row + 1])
+        split = start + int(self._split_lengths[row])
+        return self._buffer[start:split].tobytes().decode('utf-8'), self._buffer[split:end].tobytes().decode('utf-8')
+
+    def record(self, row):
+        """The row as {col: JSON value}, with missing values as 'N/A'."""
+        return json.loads('{' + ','.join(part for part in self.record_parts(row) if part) + '}')
+
+
+def _tokenize_tags(tags):
+    """Tag text per row -> (token vocabulary, token ID per (row, token), row offsets into the IDs)."""
+    import pandas as pd
+    token_lists = [[token.strip() for token in TAG_SEPARATOR.split(text) if token.strip()]
+                   if isinstance(text, str) else [] for text in tags.tolist()]
+    offsets = np.concatenate([[0], np.cumsum([len(tokens) for tokens in token_lists], dtype=np.int64)])
+    token_ids, vocabulary = pd.factorize(np.array([token for tokens in token_lists for token in tokens], dtype=object))
+    return np.asarray(vocabulary, dtype=object), token_ids.astype(np.int32), offsets
+
+
+def _smallest_code_dtype(num_categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_categories <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class RestaurantCatalog:
+    """The restaurant catalog in row order: what scoring and filtering read, plus a packed display store.
+
+    - restaurant_ids: fixed-width unicode array
+    - codes[col] / categories[col]: category columns (CATEGORY_COLS present in the catalog) as the smallest
+      integer codes (-1 = missing) and their labels
+    - numeric[col]: NUMERIC_COLS present in the catalog, float32
+    - lng, lat: parsed from the "lng,lat" location text, float32 (a float32 step is under a metre at
+      Shanghai's longitude; the geo index projects them in float64)
+    - tag_vocabulary / tag_token_ids / tag_offsets: the comma-separated dish tags as token IDs per row
+      (row r's tokens are tag_token_ids[tag_offsets[r]:tag_offsets[r + 1]]), for the hard filters
+    - display: every column of every row as response JSON (DisplayStore, memory-mapped)
+
+    Built once from the loaded CSV; the DataFrame can be dropped afterwards. Nothing here is mutated after
+    construction, so one catalog is shared by every engine, index and Client.
+    """
+
+    def __init__(self, all_restaurants_df, display_dir=None):
+        import pandas as pd
+        from food_data_generator import parse_location_column
+        self.columns = list(all_restaurants_df.columns)
+        self.num_restaurants = len(all_restaurants_df)
+        self.restaurant_ids = np.array(all_restaurants_df['restaurant_id'].astype(str).tolist(), dtype=str) \
+            if self.num_restaurants else np.empty(0, dtype='<U1')
+        self.codes, self.categories, self.numeric = {}, {}, {}
+        for col in config.CATEGORY_COLS:
+            if col in all_restaurants_df.columns:
+                codes, uniques = pd.factorize(all_restaurants_df[col])  # NaN -> -1
+                self.codes[col] = codes.astype(_smallest_code_dtype(len(uniques)))
+                self.categories[col] = np.asarray(uniques, dtype=object)
+        for col in config.NUMERIC_COLS:
+            if col in all_restaurants_df.columns:
+                self.numeric[col] = pd.to_numeric(all_restaurants_df[col], errors='coerce').to_numpy(
+                    dtype=np.float32, na_value=np.nan)
+        self.lng, self.lat = (values.astype(np.float32) for values in parse_location_column(all_restaurants_df))
+        self.tag_vocabulary, self.tag_token_ids, self.tag_offsets = _tokenize_tags(
+            all_restaurants_df['tag'] if 'tag' in all_restaurants_df.columns
+            else pd.Series([None] * self.num_restaurants, dtype=object))
+        self.display = DisplayStore(all_restaurants_df, display_dir)
+
+    def __len__(self):
+        return self.num_restaurants
+
+    @property
+    def feature_cols(self):
+        """Model feature columns the catalog supplies, in catalog column order."""
+        return [col for col in self.columns if col in self.codes or col in self.numeric]
+
+    def column_values(self, col, rows=None):
+        """Values of a feature column (object array with NaN for missing categories, or float32)."""
+        if col in self.numeric:
+            values = self.numeric[col]
+            return values if rows is None else values[rows]
+        codes = self.codes[col] if rows is None else self.codes[col][rows]
+        return np.append(self.categories[col], np.nan)[codes]  # Code -1 picks the appended NaN
+
+    def feature_frame(self, rows=None):
+        """DataFrame of restaurant_id + the feature columns (all rows, or the given row positions).
+
+        Built on demand for the preprocessor and training merges; not kept.
+        """
+        import pandas as pd
+        ids = self.restaurant_ids if rows is None else self.restaurant_ids[rows]
+        frame = {'restaurant_id': ids.astype(object)}
+        frame.update((col, self.column_values(col, rows)) for col in self.feature_cols)
+        return pd.DataFrame(frame)
+
+    def records_frame(self, rows):
+        """DataFrame of every catalog column for the given rows (e.g. a final top-k), from the display store."""
+        import pandas as pd
+        records = [{col: (np.nan if value == 'N/A' else value) for col, value in self.display.record(row).items()}
+                   for row in rows]
+        return pd.DataFrame(records, columns=self.columns)
+
+    def memory_usage(self):
+        """Heap bytes held per component; category labels count their Python string objects. The display
+        store is memory-mapped, see display.nbytes."""
+        labels = sum(cats.nbytes + sum(sys.getsizeof(value) for value in cats) for cats in self.categories.values())
+        return {"restaurant_ids": self.restaurant_ids.nbytes,
+                "category codes": sum(codes.nbytes for codes in self.codes.values()),
+                "category labels": labels,
+                "float32 columns": sum(values.nbytes for values in self.numeric.values()),
+                "lng/lat": self.lng.nbytes + self.lat.nbytes,
+                "tag tokens": self.tag_token_ids.nbytes + self.tag_offsets.nbytes + self.tag_vocabulary.nbytes
+                + sum(sys.getsizeof(token) for token in self.tag_vocabulary)}
+
+
+def as_restaurant_catalog(catalog):
+    """catalog itself, or a RestaurantCatalog built from a catalog DataFrame."""
+    return catalog if isinstance(catalog, RestaurantCatalog) else RestaurantCatalog(catalog)
+
+
+def print_memory_report(label, all_restaurants_df, catalog):
+    before = int(all_restaurants_df.memory_usage(deep=True).sum())
+    usage = catalog.memory_usage()
+    after = sum(usage.values())
+    print(f"--- {label}: {len(catalog)} restaurants ---")
+    print(f"  {'DataFrame (deep)':<22}{before / 1e6:10.2f} MB")
+    for name, nbytes in usage.items():
+        print(f"    {name:<20}{nbytes / 1e6:10.2f} MB")
+    print(f"  {'RestaurantCatalog':<22}{after / 1e6:10.2f} MB  ({before / max(after, 1):.1f}x smaller), plus "
+          f"{catalog.display.nbytes / 1e6:.2f} MB display store memory-mapped from a file")
+
+
+def synthetic_catalog_frame(all_restaurants_df, num_rows, seed=0):
+    """num_rows restaurants resampled from a real catalog, with unique IDs and jittered cost/rating/location."""
+    rng = np.random.default_rng(seed)
+    frame = all_restaurants_df.iloc[rng.integers(0, len(all_restaurants_df), num_rows)].reset_index(drop=True)
+    frame['restaurant_id'] = [f"S{i:09d}" for i in range(num_rows)]
+    if 'cost' in frame.columns:
+        frame['cost'] = (frame['cost'] * rng.uniform(0.8, 1.2, num_rows)).round()
+    if 'rating_biz' in frame.columns:
+        frame['rating_biz'] = (frame['rating_biz'] + rng.normal(0, 0.2, num_rows)).clip(0, 5).round(1)
+    return frame
+
+
+# Standalone check and memory report (food_catalog.py):
+#   python food_catalog.py [--synthetic-rows N]
+if __name__ == '__main__':
+    import argparse
+    import time
+    import pandas as pd
+    from food_data_generator import load_csv_to_dataframe
+
+    parser = argparse.ArgumentParser(description="Compare DataFrame and RestaurantCatalog memory.")
+    parser.add_argument('--synthetic-rows', type=int, default=1_000_000, help="0 skips the synthetic catalog")
+    args = parser.parse_args()
+
+    restaurants_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
+    restaurants_df.rename(columns={'id': 'restaurant_id', 'rating': 'rating_biz'}, inplace=True)
+    start = time.perf_counter()
+    catalog = RestaurantCatalog(restaurants_df)
+    build_s = time.perf_counter() - start
+
+    rows = [5, 3, 4000, 17]
+    expected = restaurants_df.iloc[rows].reset_index(drop=True)
+    decoded = catalog.records_frame(rows)
+    pd.testing.assert_frame_equal(decoded, expected, check_dtype=False)
+    features = catalog.feature_frame()
+    for col in catalog.feature_cols:
+        original = restaurants_df[col]
+        if col in catalog.numeric:
+            assert np.allclose(features[col], original, equal_nan=True, rtol=1e-6), col
+        else:
+            assert (features[col].isna() == original.isna()).all() and \
+                (features[col][original.notna()] == original[original.notna()]).all(), col
+    print(f"Catalog matches the DataFrame (features and decoded records); built in {build_s:.2f}s.")
+    print_memory_report("Shanghai CSV", restaurants_df, catalog)
+
+    if args.synthetic_rows > 0:
+        synthetic_df = synthetic_catalog_frame(restaurants_df, args.synthetic_rows)
+        start = time.perf_counter()
+        synthetic_catalog = RestaurantCatalog(synthetic_df)
+        print(f"Synthetic catalog built in {time.perf_counter() - start:.1f}s.")
+        print_memory_report("Synthetic catalog", synthetic_df, synthetic_catalog)
@@ -0,0 +1,402 @@
+# food_catalog_index.py
+import re
+import threading
+
+import numpy as np
+
+import federated_config as config
+from food_catalog import TAG_SEPARATOR, as_restaurant_catalog
+from food_numpy_backend import segmented_top_k
+
+# Catalog columns with an exact-match row index; also the accepted keys of a "filters" object.
+INDEXED_CATEGORY_COLS = ['adname', 'cuisine', 'business_area']
+GEO_FILTER_KEYS = ['lat', 'lng', 'radius_m', 'nearest_k']
+RANGE_FILTER_KEYS = ['min_cost', 'max_cost', 'within_budget']
+GROUP_BY_COLS = ['cuisine', 'adname']  # Columns /recommend?group_by= can return a top-k per value of
+EARTH_RADIUS_M = 6371008.8
+# Context columns mapped to hard exclusions, with their value -> keywords tables
+EXCLUSION_KEYWORDS = {'food_allergies': config.ALLERGY_EXCLUSION_KEYWORDS,
+                      'diseases': config.DISEASE_EXCLUSION_KEYWORDS}
+_CONTEXT_VALUE_SEPARATOR = re.compile(r'[;；,，、]')
+
+
+def split_context_values(value):
+    """'海鲜; 花生' -> ['海鲜', '花生']; None, 'None' and 'Unknown' -> []."""
+    if not isinstance(value, str):
+        return []
+    return [part.strip() for part in _CONTEXT_VALUE_SEPARATOR.split(value)
+            if part.strip() and part.strip() not in ('None', 'Unknown')]
+
+
+class GeoIndex:
+    """KD-tree over restaurant locations for radius and k-nearest queries.
+
+    Coordinates are projected to local metres (equirectangular around the catalog's
+    mean latitude), which is accurate to well under 1% across a single city.
+    """
+
+    def __init__(self, lng, lat):
+        valid = np.isfinite(lng) & np.isfinite(lat)
+        self.rows = np.flatnonzero(valid)  # Catalog row position of every tree point
+        self.ref_lat_rad = np.radians(lat[valid].mean()) if valid.any() else 0.0
+        self._points = self._project(lng[valid], lat[valid]) if valid.any() else None
+        self._tree = None
+        self._tree_lock = threading.Lock()
+
+    @property
+    def tree(self):
+        # Built on first use: importing scipy is a large share of inference_api's cold start
+        if self._tree is None and self._points is not None:
+            with self._tree_lock:
+                if self._tree is None:
+                    from scipy.spatial import cKDTree
+                    self._tree = cKDTree(self._points)
+        return self._tree
+
+    def _project(self, lng, lat):
+        lng, lat = np.radians(np.asarray(lng, dtype=np.float64)), np.radians(np.asarray(lat, dtype=np.float64))
+        return np.column_stack([lng * np.cos(self.ref_lat_rad) * EARTH_RADIUS_M, lat * EARTH_RADIUS_M])
+
+    def query(self, lat, lng, radius_m=None, nearest_k=None):
+        """Sorted catalog rows within radius_m of (lat, lng), limited to the nearest_k closest if given."""
+        tree = self.tree
+        if tree is None:
+            return np.empty(0, dtype=np.intp)
+        point = self._project([lng], [lat])[0]
+        if nearest_k is not None:
+            k = min(nearest_k, len(self.rows))
+            upper = np.inf if radius_m is None else radius_m
+            distances, points = tree.query(point, k=k, distance_upper_bound=upper)
+            points = np.atleast_1d(points)[np.isfinite(np.atleast_1d(distances))]
+        else:
+            points = np.asarray(tree.query_ball_point(point, r=radius_m), dtype=np.intp)
+        return np.sort(self.rows[points])
+
+
+class TagIndex:
+    """Inverted index from dish-tag tokens to catalog rows, and a packed bitset of excluded rows per
+    allergy / disease value (EXCLUSION_KEYWORDS).
+
+    A value's keywords are matched by substring against the distinct tokens and cuisine labels, not
+    every row; the matching tokens' rows are then set in its bitset, once, at load time.
+    """
+
+    def __init__(self, catalog):
+        self.num_restaurants = len(catalog)
+        self.vocabulary = catalog.tag_vocabulary
+        token_ids = catalog.tag_token_ids
+        order = np.argsort(token_ids, kind='stable')
+        self.postings = np.repeat(np.arange(self.num_restaurants), np.diff(catalog.tag_offsets))[order]
+        self.token_bounds = np.searchsorted(token_ids[order], np.arange(len(self.vocabulary) + 1))
+        self._cuisine_codes = catalog.codes.get('cuisine')
+        self._cuisines = catalog.categories.get('cuisine', [])
+        self.exclusion_bits = {
+            (col, value): np.packbits(self.rows_mask_for_keywords(keywords))
+            for col, keyword_map in EXCLUSION_KEYWORDS.items() for value, keywords in keyword_map.items()}
+
+    def rows_for_token(self, token_id):
+        return self.postings[self.token_bounds[token_id]:self.token_bounds[token_id + 1]]
+
+    def rows_mask_for_keywords(self, keywords):
+        """Boolean row mask: some tag token or the cuisine contains one of keywords."""
+        mask = np.zeros(self.num_restaurants, dtype=bool)
+        if not keywords:
+            return mask
+        pattern = re.compile('|'.join(map(re.escape, keywords)))
+        for token_id, token in enumerate(self.vocabulary):
+            if pattern.search(token):
+                mask[self.rows_for_token(token_id)] = True
+        if self._cuisine_codes is not None:
+            matched = [code for code, cuisine in enumerate(self._cuisines) if pattern.search(str(cuisine))]
+            mask |= np.isin(self._cuisine_codes, matched)
+        return mask
+
+    def excluded_mask(self, user_context):
+        """Boolean mask of the rows the context's allergies and diseases exclude, or None if none do.
+
+        Values without an entry in EXCLUSION_KEYWORDS exclude nothing.
+        """
+        bits = [self.exclusion_bits[(col, value)] for col in EXCLUSION_KEYWORDS
+                for value in split_context_values(user_context.get(col)) if (col, value) in self.exclusion_bits]
+        if not bits:
+            return None
+        return np.unpackbits(np.bitwise_or.reduce(bits), count=self.num_restaurants).astype(bool)
+
+
+class GroupSegments:
+    """Catalog rows grouped by the values of one category column (rows with a missing value left out).
+
+    Group g (labels[g]) is rows[offsets[g]:offsets[g + 1]], in ascending row order; segment_ids is the
+    group of each position. Built once, so a per-group top-k costs one sort of the scores per request.
+    """
+
+    def __init__(self, order, bounds, labels):
+        self.rows = order[bounds[0]:bounds[-1]]
+        self.offsets = bounds - bounds[0]
+        self.labels = labels
+        self.segment_ids = np.repeat(np.arange(len(labels)), np.diff(self.offsets))
+
+    def top_k(self, scores, k):
+        """[(label, top_scores, catalog_rows)] of the groups with finite scores, best group first.
+
+        scores: one per catalog row; -inf marks rows that are not candidates.
+        """
+        grouped_scores = scores[self.rows]
+        positions, bounds = segmented_top_k(grouped_scores, self.segment_ids, self.offsets, k)
+        groups = [(self.labels[g], grouped_scores[positions[bounds[g]:bounds[g + 1]]],
+                   self.rows[positions[bounds[g]:bounds[g + 1]]].tolist())
+                  for g in np.flatnonzero(np.diff(bounds))]
+        groups.sort(key=lambda group: -float(group[1][0]))  # Stable: equal best scores keep label order
+        return groups
+
+
+class CatalogIndex:
+    """Row-position indexes over the restaurant catalog, built once at load time.
+
+    Row positions refer to the catalog order (the same order as the precomputed
+    feature block), so results can be used to slice scores directly.
+    """
+
+    def __init__(self, catalog):
+        self.num_restaurants = len(catalog)
+        self.value_rows = {}
+        self.groups = {}  # GROUP_BY_COLS col -> GroupSegments
+        for col in INDEXED_CATEGORY_COLS:
+            if col not in catalog.codes:
+                continue
+            codes, uniques = catalog.codes[col], catalog.categories[col]  # Missing -> -1, never indexed
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            self.value_rows[col] = {
+                value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(uniques)}
+            if col in GROUP_BY_COLS:
+                self.groups[col] = GroupSegments(order, bounds, uniques)
+
+        cost = catalog.numeric['cost'].astype(np.float64) if 'cost' in catalog.numeric \
+            else np.full(self.num_restaurants, np.nan)
+        known = np.flatnonzero(~np.isnan(cost))
+        order = known[np.argsort(cost[known], kind='stable')]
+        self.cost_order = order            # Row positions with a known cost, cheapest first
+        self.sorted_cost = cost[order]
+
+        # Parsed from the "lng,lat" text when the catalog was built; not a model feature.
+        self.lng, self.lat = catalog.lng, catalog.lat
+        self.geo = GeoIndex(self.lng, self.lat)
+        self.tags = TagIndex(catalog)
+
+    def rows_for_values(self, col, values):
+        """Union of rows whose `col` equals any of `values` (sorted row positions)."""
+        index = self.value_rows.get(col, {})
+        parts = [index[v] for v in values if v in index]
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        return np.unique(np.concatenate(parts))
+
+    def rows_for_cost_range(self, min_cost=None, max_cost=None):
+        lo = 0 if min_cost is None else np.searchsorted(self.sorted_cost, min_cost, side='left')
+        hi = len(self.sorted_cost) if max_cost is None else np.searchsorted(self.sorted_cost, max_cost, side='right')
+        return np.sort(self.cost_order[lo:hi])
+
+    def rows_for_filters(self, filters, user_context=None):
+        """Intersects the requested filters. Returns (rows, error_message); rows is None when nothing filters.
+
+        filters: {"adname": str | [str], "cuisine": ..., "business_area": ...,
+                  "min_cost": number, "max_cost": number, "within_budget": bool,
+                  "lat": number, "lng": number, "radius_m": number, "nearest_k": int}
+        within_budget uses the context's daily_food_budget_cny as max_cost.
+        lat/lng need radius_m and/or nearest_k (the k closest, optionally within radius_m).
+        """
+        if not filters:
+            return None, None
+        if not isinstance(filters, dict):
+            return None, "'filters' must be an object."
+        unknown = [key for key in filters
+                   if key not in INDEXED_CATEGORY_COLS + RANGE_FILTER_KEYS + GEO_FILTER_KEYS]
+        if unknown:
+            return None, f"Unknown filter keys: {unknown}."
+
+        row_sets = []
+        for col in INDEXED_CATEGORY_COLS:
+            values = filters.get(col)
+            if values is None:
+                continue
+            values = [values] if isinstance(values, str) else values
+            if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+                return None, f"Filter '{col}' must be a string or a list of strings."
+            row_sets.append(self.rows_for_values(col, values))
+
+        min_cost, max_cost = filters.get('min_cost'), filters.get('max_cost')
+        for name, bound in (('min_cost', min_cost), ('max_cost', max_cost)):
+            if bound is not None and (isinstance(bound, bool) or not isinstance(bound, (int, float))):
+                return None, f"Filter '{name}' must be a number."
+        if filters.get('within_budget'):
+            budget = (user_context or {}).get('daily_food_budget_cny')
+            if isinstance(budget, (int, float)) and not isinstance(budget, bool) and budget > 0:
+                max_cost = budget if max_cost is None else min(max_cost, budget)
+        if min_cost is not None or max_cost is not None:
+            row_sets.append(self.rows_for_cost_range(min_cost, max_cost))
+
+        if any(key in filters for key in GEO_FILTER_KEYS):
+            geo_rows, error_msg = self._rows_for_geo_filter(filters)
+            if error_msg:
+                return None, error_msg
+            row_sets.append(geo_rows)
+
+        if not row_sets:
+            return None, None
+        rows = row_sets[0]
+        for other in row_sets[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows, None
+
+    def excluded_for_context(self, user_context):
+        """Boolean catalog mask of the restaurants the context's food_allergies / diseases exclude, or None."""
+        if not config.RECO_HEALTH_EXCLUSIONS_ENABLED:
+            return None
+        return self.tags.excluded_mask(user_context)
+
+    def _rows_for_geo_filter(self, filters):
+        lat, lng = filters.get('lat'), filters.get('lng')
+        radius_m, nearest_k = filters.get('radius_m'), filters.get('nearest_k')
+        for name, value in (('lat', lat), ('lng', lng), ('radius_m', radius_m)):
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                return None, f"Filter '{name}' must be a number."
+        if lat is None or lng is None or not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return None, "Geo filter needs valid 'lat' and 'lng'."
+        if radius_m is None and nearest_k is None:
+            return None, "Geo filter needs 'radius_m' and/or 'nearest_k'."
+        if radius_m is not None and radius_m <= 0:
+            return None, "Filter 'radius_m' must be positive."
+        if nearest_k is not None and (isinstance(nearest_k, bool) or not isinstance(nearest_k, int) or nearest_k <= 0):
+            return None, "Filter 'nearest_k' must be a positive integer."
+        return self.geo.query(lat, lng, radius_m=radius_m, nearest_k=nearest_k), None
+
+
+def pop_filter_rows(catalog_index, user_context):
+    """Removes a "filters" object from the context and resolves it. Returns (rows, error_message)."""
+    filters = user_context.pop('filters', None)
+    if filters is None:
+        return None, None
+    if catalog_index is None:
+        return None, "Filtering is unavailable: catalog index not built."
+    return catalog_index.rows_for_filters(filters, user_context)
+
+
+def excluded_rows_mask(catalog_index, user_context):
+    """Boolean catalog mask of the restaurants never to return for the context's allergies and diseases,
+    or None. The engine drops them from its candidates or scores (RecommendationEngine.top_k_batch), so a
+    request without filters still goes through retrieval and the sharded workers.
+    """
+    return None if catalog_index is None else catalog_index.excluded_for_context(user_context)
+
+
+def parse_group_args(catalog_index, group_by, per_group):
+    """?group_by=cuisine&per_group=5 -> ((col, GroupSegments, k) or None, error_message)."""
+    if not group_by:
+        return None, None
+    if group_by not in GROUP_BY_COLS:
+        return None, f"'group_by' must be one of {GROUP_BY_COLS}."
+    if catalog_index is None or group_by not in catalog_index.groups:
+        return None, f"Grouping by '{group_by}' is unavailable: catalog index not built."
+    try:
+        k = config.RECO_GROUP_TOP_K if per_group is None else int(per_group)
+    except ValueError:
+        return None, "'per_group' must be an integer."
+    if not 1 <= k <= config.RECO_GROUP_MAX_K:
+        return None, f"'per_group' must be between 1 and {config.RECO_GROUP_MAX_K}."
+    return (group_by, catalog_index.groups[group_by], k), None
+
+
+def pop_batch_filter_rows(catalog_index, user_contexts):
+    """pop_filter_rows for every batch entry. Returns (rows_per_entry, error_message)."""
+    rows_per_entry = []
+    for i, user_context in enumerate(user_contexts):
+        rows, error_msg = pop_filter_rows(catalog_index, user_context)
+        if error_msg:
+            return None, f"Entry {i}: {error_msg}"
+        rows_per_entry.append(rows)
+    return rows_per_entry, None
+
+
+def union_of_candidate_rows(rows_per_entry):
+    """Rows to score for a batch: None (whole catalog) if any entry is unfiltered."""
+    if any(rows is None for rows in rows_per_entry):
+        return None
+    return np.unique(np.concatenate(rows_per_entry)) if rows_per_entry else None
+
+
+def build_catalog_index(catalog, log_prefix=""):
+    index = CatalogIndex(as_restaurant_catalog(catalog))
+    sizes = {col: len(rows) for col, rows in index.value_rows.items()}
+    print(f"{log_prefix}Catalog index built: distinct values {sizes}, {len(index.sorted_cost)} priced restaurants, "
+          f"{len(index.geo.rows)} geo-located restaurants, {len(index.tags.vocabulary)} tag tokens, "
+          f"{len(index.tags.exclusion_bits)} allergy/disease exclusion sets.")
+    return index
+
+
+# Standalone check (food_catalog_index.py)
+if __name__ == '__main__':
+    import federated_config as config
+    from food_data_generator import load_csv_to_dataframe
+
+    restaurants_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
+    restaurants_df.rename(columns={'id': 'restaurant_id', 'rating': 'rating_biz'}, inplace=True)
+    index = build_catalog_index(restaurants_df)
+    filters = {'adname': '黄浦区', 'cuisine': ['川菜', '湘菜'], 'max_cost': 150}
+    rows, error = index.rows_for_filters(filters)
+    expected = np.flatnonzero((restaurants_df['adname'] == '黄浦区').to_numpy()
+                              & restaurants_df['cuisine'].isin(['川菜', '湘菜']).to_numpy()
+                              & (restaurants_df['cost'] <= 150).to_numpy())
+    assert error is None and np.array_equal(rows, expected), "Index result differs from DataFrame scan."
+    print(f"{filters} -> {len(rows)} of {len(restaurants_df)} restaurants (matches DataFrame scan).")
+
+    import time
+    lat, lng, radius_m = 31.2304, 121.4737, 1500.0  # People's Square
+    index.geo.tree  # Built lazily; time the query, not the build
+    start = time.perf_counter()
+    rows, error = index.rows_for_filters({'lat': lat, 'lng': lng, 'radius_m': radius_m})
+    geo_s = time.perf_counter() - start
+    # Brute-force haversine reference
+    phi1, phi2 = np.radians(lat), np.radians(index.lat)
+    a = (np.sin((phi2 - phi1) / 2) ** 2
+         + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(index.lng - lng) / 2) ** 2)
+    haversine_m = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+    expected = np.flatnonzero(haversine_m <= radius_m)
+    mismatched = np.setxor1d(rows, expected)
+    assert all(abs(haversine_m[r] - radius_m) < 5.0 for r in mismatched), "Geo index disagrees beyond the radius edge."
+    nearest, _ = index.rows_for_filters({'lat': lat, 'lng': lng, 'nearest_k': 10})
+    assert set(nearest) == set(np.argsort(haversine_m)[:10]), "k-nearest differs from brute force."
+    print(f"{len(rows)} restaurants within {radius_m:.0f}m ({len(mismatched)} edge mismatches), "
+          f"query took {geo_s * 1000:.2f}ms; 10-nearest matches brute force.")
+
+    tag_text = restaurants_df['tag'].fillna('').astype(str)
+    cuisine_text = restaurants_df['cuisine'].fillna('').astype(str)
+    for user_context in ({'food_allergies': '花生'}, {'food_allergies': '海鲜; 乳制品'}, {'diseases': '痛风'}):
+        start = time.perf_counter()
+        mask = excluded_rows_mask(index, dict(user_context))
+        exclude_ms = (time.perf_counter() - start) * 1000
+        keywords = [keyword for col, keyword_map in EXCLUSION_KEYWORDS.items()
+                    for value in split_context_values(user_context.get(col)) for keyword in keyword_map[value]]
+        pattern = '|'.join(map(re.escape, keywords))
+        # Brute force: some comma-separated tag or the cuisine contains a keyword
+        excluded = (tag_text.map(lambda text: any(re.search(pattern, token) for token in TAG_SEPARATOR.split(text)))
+                    | cuisine_text.str.contains(pattern)).to_numpy()
+        assert np.array_equal(mask, excluded), f"{user_context}: differs from scan."
+        print(f"{user_context} excludes {int(excluded.sum())} restaurants in {exclude_ms:.2f}ms (matches DataFrame scan).")
+
+    rng = np.random.default_rng(0)
+    scores = rng.random(len(restaurants_df)).astype(np.float32).round(2)  # Rounded: plenty of ties
+    scores[rng.random(len(scores)) < 0.3] = -np.inf  # Non-candidates
+    for col in GROUP_BY_COLS:
+        start = time.perf_counter()
+        groups = index.groups[col].top_k(scores, 5)
+        group_ms = (time.perf_counter() - start) * 1000
+        expected = {}
+        for row in np.lexsort((np.arange(len(scores)), -scores)):  # Best first, ties: lower row first
+            value = restaurants_df[col].iloc[row]
+            if np.isfinite(scores[row]) and isinstance(value, str) and len(expected.setdefault(value, [])) < 5:
+                expected[value].append(int(row))
+        assert {label: rows for label, _, rows in groups} == expected, f"Per-{col} top-k differs from sorting."
+        best = [float(top_scores[0]) for _, top_scores, _ in groups]
+        assert best == sorted(best, reverse=True), "Groups are not ordered by their best score."
+        print(f"Top 5 per {col}: {len(groups)} groups in {group_ms:.2f}ms (matches a full sort).")
@@ -17,6 +17,9 @@ import threading
 import json
 
 from food_model import FoodPreferenceModel, weights_to_json_serializable, weights_from_json_serializable
+from food_catalog import as_restaurant_catalog
+from food_features import transform_recommendation_frame
+from food_reco_engine import RecommendationEngine
 import federated_config as config
 
 # --- CRITICAL: Define CATEGORY_COLS and NUMERIC_COLS based on your MERGED data ---
@@ -78,39 +81,9 @@ def create_preprocessor():
     return preprocessor
 
 def process_features_for_recommendation(preprocessor, user_context_dict, all_restaurants_df_orig):
-    if all_restaurants_df_orig.empty: return torch.empty(0), [], 0
-    all_restaurants_df = all_restaurants_df_orig.copy()
-
-    inference_df_list = []
-    restaurant_ids_order = []
-    user_base_df = pd.DataFrame([user_context_dict])
-
-    for _, restaurant_row_series in all_restaurants_df.iterrows():
-        restaurant_row = restaurant_row_series.to_dict()
-        combined_features_df = user_base_df.copy()
-        for col, val in restaurant_row.items():
-            if col in CATEGORY_COLS or col in NUMERIC_COLS : # If it's a direct feature used by model
-                 combined_features_df[col] = val
-            # No need to add restaurant_id to features, it's for tracking
-        inference_df_list.append(combined_features_df)
-        restaurant_ids_order.append(restaurant_row['restaurant_id'])
-
-    if not inference_df_list: return torch.empty(0), [], 0
-    full_inference_df = pd.concat(inference_df_list, ignore_index=True)
-
-    all_expected_feature_cols = CATEGORY_COLS + NUMERIC_COLS
-    for col in all_expected_feature_cols:
-        if col not in full_inference_df.columns:
-            full_inference_df[col] = np.nan
-
-    try:
-        X_to_process = full_inference_df[all_expected_feature_cols]
-        X_processed = preprocessor.transform(X_to_process)
-    except Exception as e:
-        print(f"Error during preproc transform for recommendation: {e}")
-        return torch.empty(0), [], 0
-
-    return torch.tensor(X_processed, dtype=torch.float32), restaurant_ids_order, X_processed.shape[1]
+    # Vectorized: the user context is broadcast over all restaurant rows in one pass.
+    return transform_recommendation_frame(
+        preprocessor, user_context_dict, all_restaurants_df_orig, CATEGORY_COLS, NUMERIC_COLS)
 
 
 class Client:
@@ -121,8 +94,11 @@ class Client:
     def __init__(self, client_id, reviews_df_for_client, all_restaurants_df, server_url, user_enhanced_profile_series=None):
         self.client_id = client_id
         self.server_url = server_url
-        self.restaurants_df_ref = all_restaurants_df.copy() # Has 'rating_biz'
+        # A RestaurantCatalog (or catalog DataFrame with 'rating_biz'); shared, not copied, as nothing mutates it
+        self.catalog = as_restaurant_catalog(all_restaurants_df)
+        restaurant_features = self.catalog.feature_frame() # restaurant_id + feature columns, for the training merge
         self.model = None
+        self._reco_engine = None # RecommendationEngine over self.catalog; the catalog encoding is reused
         self.input_dim = 0
         self.user_profile_stable_features = user_enhanced_profile_series # Store for recommendation context
 
@@ -141,7 +117,7 @@ class Client:
                     print(f"Client {self.client_id}: No preprocessor found or load failed. Attempting to fit and save.")
                     temp_preprocessor_for_fitting = create_preprocessor()
                     self.X_train, self.y_train, self.input_dim = self._preprocess_training_data(
-                        reviews_df_for_client, self.restaurants_df_ref, temp_preprocessor_for_fitting, fit_mode=True
+                        reviews_df_for_client, restaurant_features, temp_preprocessor_for_fitting, fit_mode=True
                     )
                     if self.input_dim > 0:
                         Client._shared_preprocessor = temp_preprocessor_for_fitting
@@ -160,7 +136,7 @@ class Client:
         # All clients (including the first one after fitting) use the shared preprocessor for transform
         if Client._shared_preprocessor:
             self.X_train, self.y_train, self.input_dim = self._preprocess_training_data(
-                reviews_df_for_client, self.restaurants_df_ref, Client._shared_preprocessor, fit_mode=False
+                reviews_df_for_client, restaurant_features, Client._shared_preprocessor, fit_mode=False
             )
         else: # Should not happen if logic above is correct and first client succeeds
             print(f"Client {self.client_id}: CRITICAL - Shared preprocessor is not available. Cannot process data.")
@@ -358,28 +334,19 @@ class Client:
         if Client._shared_preprocessor is None:
             print(f"Client {self.client_id}: Shared preprocessor is None! Cannot recommend."); return pd.DataFrame(), []
 
-        features_tensor, restaurant_ids_order, num_feat = process_features_for_recommendation(
-            Client._shared_preprocessor, user_context_dict_full, self.restaurants_df_ref
-        )
-        if features_tensor.nelement() == 0: return pd.DataFrame(), []
-        if num_feat != self.model.fc1.in_features:
-            print(f"FATAL (Recommend): Feature mismatch! Model: {self.model.fc1.in_features}, Preproc: {num_feat}"); return pd.DataFrame(), []
-
-        self.model.eval()
-        with torch.no_grad():
-            logits = self.model(features_tensor); probs = torch.softmax(logits, dim=1)
-            high_pref_scores = probs[:, 2] # Index 2 for 'high' rating class
-            if high_pref_scores.numel() == 0: return pd.DataFrame(), []
-            k = min(top_n, len(restaurant_ids_order))
-            top_scores, top_indices = torch.topk(high_pref_scores, k=k)
-            rec_ids = [restaurant_ids_order[i] for i in top_indices]
-
-        rec_df = self.restaurants_df_ref[self.restaurants_df_ref['restaurant_id'].isin(rec_ids)].copy()
-        id_score_map = dict(zip(rec_ids, top_scores.tolist()))
-        rec_df['recommendation_score'] = rec_df['restaurant_id'].map(id_score_map)
-        rec_df = rec_df.sort_values(by='recommendation_score', ascending=False).reset_index(drop=True)
+        try:
+            engine = self._reco_engine
+            if engine is None or engine.preprocessor is not Client._shared_preprocessor:
+                engine = RecommendationEngine(self.catalog, Client._shared_preprocessor, self.model,
+                                              backend='torch', serving=False, log_prefix=f"Client {self.client_id}: ")
+            else:
+                engine = engine.with_model(self.model) # Weights change in training; the factorized cache must follow
+            self._reco_engine = engine
+            rec_df, top_scores = engine.recommendations_frame(user_context_dict_full, top_n)
+        except Exception as e:
+            print(f"FATAL (Recommend): {e}"); return pd.DataFrame(), []
         print(f"Client {self.client_id}: Top {len(rec_df)} recommendations generated.")
-        return rec_df, top_scores.tolist()
+        return rec_df, top_scores
 
 # Standalone test (food_client.py)
 if __name__ == '__main__':
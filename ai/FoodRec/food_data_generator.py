@@ -1,5 +1,6 @@
 # food_data_generator.py (adapted for Shanghai data)
 import pandas as pd
+import numpy as np
 import os
 import glob
 import federated_config as config # Import to modify config.NUM_USERS
@@ -20,6 +21,15 @@ def load_csv_to_dataframe(file_path, required_cols=None):
         print(f"ERROR: Could not read CSV {file_path}. Error: {e}")
         return pd.DataFrame()
 
+def parse_location_column(df, col='location'):
+    """Splits a "lng,lat" text column into two float64 arrays (NaN where missing or malformed)."""
+    if col not in df.columns:
+        return np.full(len(df), np.nan), np.full(len(df), np.nan)
+    parts = df[col].astype('string').str.split(',', n=1, expand=True).reindex(columns=[0, 1])
+    lng = pd.to_numeric(parts[0].str.strip(), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    lat = pd.to_numeric(parts[1].str.strip(), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    return lng, lat
+
 def get_shanghai_data_for_simulation():
     print(f"Loading Shanghai restaurant data from: {config.SHANGHAI_RESTAURANTS_FILE}")
     restaurants_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE,
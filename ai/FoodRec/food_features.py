@@ -0,0 +1,293 @@
+# food_features.py
+# torch and sklearn are imported where used: request parsing here is on inference_api's startup path.
+import pandas as pd
+import numpy as np
+
+import federated_config as config
+from food_timing import timed
+
+
+def build_recommendation_frame(user_context_dict, all_restaurants_df,
+                               category_cols=None, numeric_cols=None):
+    """Broadcasts one user context over every restaurant row in a single pass.
+
+    Returns (frame, restaurant_ids_order). The frame holds exactly the feature
+    columns (category_cols + numeric_cols) in that order, one row per restaurant,
+    in the same order as all_restaurants_df.
+    """
+    category_cols = config.CATEGORY_COLS if category_cols is None else category_cols
+    numeric_cols = config.NUMERIC_COLS if numeric_cols is None else numeric_cols
+    all_feature_cols = category_cols + numeric_cols
+    num_restaurants = len(all_restaurants_df)
+
+    # Restaurant values win over user-supplied values for the same column.
+    restaurant_feature_cols = [
+        col for col in all_restaurants_df.columns if col in all_feature_cols]
+    user_base_df = pd.DataFrame([user_context_dict])
+    user_feature_cols = [
+        col for col in user_base_df.columns
+        if col in all_feature_cols and col not in restaurant_feature_cols]
+
+    user_block = user_base_df[user_feature_cols].iloc[
+        np.zeros(num_restaurants, dtype=np.intp)].reset_index(drop=True)
+    restaurant_block = all_restaurants_df[restaurant_feature_cols].reset_index(drop=True)
+    frame = pd.concat([user_block, restaurant_block], axis=1)
+
+    for col in all_feature_cols:
+        if col not in frame.columns:
+            frame[col] = np.nan
+    restaurant_ids_order = all_restaurants_df['restaurant_id'].tolist()
+    return frame[all_feature_cols], restaurant_ids_order
+
+
+def transform_recommendation_frame(preprocessor, user_context_dict, all_restaurants_df,
+                                   category_cols=None, numeric_cols=None, log_prefix=""):
+    """Builds and encodes the candidate matrix. Returns (tensor, ids, num_features)."""
+    import torch
+    if all_restaurants_df.empty:
+        return torch.empty(0), [], 0
+    X_to_process, restaurant_ids_order = build_recommendation_frame(
+        user_context_dict, all_restaurants_df, category_cols, numeric_cols)
+    try:
+        X_processed = preprocessor.transform(X_to_process)
+    except Exception as e:
+        print(f"{log_prefix}Error during preproc transform for recommendation: {e}")
+        return torch.empty(0), [], 0
+    return torch.tensor(X_processed, dtype=torch.float32), restaurant_ids_order, X_processed.shape[1]
+
+
+def _output_feature_owners(preprocessor):
+    """Maps every output column of a fitted ColumnTransformer back to its input column."""
+    from sklearn.pipeline import Pipeline
+    from sklearn.impute import SimpleImputer
+    from sklearn.preprocessing import StandardScaler, OneHotEncoder
+    owners = []
+    for name, transformer, cols in preprocessor.transformers_:
+        if transformer == 'drop' or name == 'remainder':
+            continue
+        col_owners = list(cols)
+        steps = transformer.steps if isinstance(transformer, Pipeline) else [(name, transformer)]
+        for _, step in steps:
+            if isinstance(step, SimpleImputer):
+                # Imputer drops input columns that had no observed values at fit time.
+                col_owners = list(step.get_feature_names_out(col_owners))
+            elif isinstance(step, OneHotEncoder):
+                if step.drop_idx_ is not None or getattr(step, 'infrequent_categories_', None) is not None:
+                    raise ValueError("OneHotEncoder with drop/infrequent categories is not supported.")
+                col_owners = [owner for owner, cats in zip(col_owners, step.categories_)
+                              for _ in range(len(cats))]
+            elif not isinstance(step, StandardScaler):
+                raise ValueError(f"Unsupported preprocessor step: {type(step).__name__}")
+        owners.extend(col_owners)
+    return owners
+
+
+def preprocessor_output_width(preprocessor):
+    """Number of columns a fitted preprocessor outputs, i.e. the input_dim of a model trained with it."""
+    return len(_output_feature_owners(preprocessor))
+
+
+class PrecomputedCandidateEncoder:
+    """Encodes the restaurant-side feature columns once at load time.
+
+    Per request only the single user row goes through the preprocessor; its
+    user-owned output columns are tiled over the cached restaurant block.
+    """
+
+    def __init__(self, preprocessor, all_restaurants_df, category_cols=None, numeric_cols=None):
+        self.category_cols = config.CATEGORY_COLS if category_cols is None else category_cols
+        self.numeric_cols = config.NUMERIC_COLS if numeric_cols is None else numeric_cols
+        self.preprocessor = preprocessor
+        all_feature_cols = self.category_cols + self.numeric_cols
+        self.restaurant_feature_cols = [
+            col for col in all_restaurants_df.columns if col in all_feature_cols]
+
+        owners = _output_feature_owners(preprocessor)
+        self.num_features = len(owners)
+        self.user_out_idx = np.array(
+            [j for j, owner in enumerate(owners) if owner not in self.restaurant_feature_cols], dtype=np.intp)
+        self.restaurant_out_idx = np.array(
+            [j for j, owner in enumerate(owners) if owner in self.restaurant_feature_cols], dtype=np.intp)
+
+        restaurant_frame, self.restaurant_ids_order = build_recommendation_frame(
+            {}, all_restaurants_df, self.category_cols, self.numeric_cols)
+        encoded = preprocessor.transform(restaurant_frame)
+        if encoded.shape[1] != self.num_features:
+            raise ValueError(f"Preprocessor produced {encoded.shape[1]} columns, expected {self.num_features}.")
+        self.restaurant_block = np.ascontiguousarray(
+            encoded[:, self.restaurant_out_idx], dtype=np.float32)
+        # A single restaurant row completes the user frame; its values are discarded.
+        self._probe_restaurant_df = all_restaurants_df.iloc[:1]
+        self._check_against_full_transform(all_restaurants_df)
+
+    def _check_against_full_transform(self, all_restaurants_df):
+        probe_context = {col: ("Unknown" if col in self.category_cols else 0.0)
+                         for col in self.category_cols + self.numeric_cols}
+        sample_df = all_restaurants_df.iloc[:min(32, len(all_restaurants_df))]
+        full_frame, _ = build_recommendation_frame(
+            probe_context, sample_df, self.category_cols, self.numeric_cols)
+        expected = self.preprocessor.transform(full_frame).astype(np.float32)
+        if not np.array_equal(expected, self.transform(probe_context)[:len(sample_df)]):
+            raise ValueError("Split user/restaurant encoding does not reproduce the full transform.")
+
+    def encode_users(self, user_context_dicts):
+        """Returns the user-owned output columns for many contexts as a (B, n_user) float32 matrix."""
+        with timed('features'):
+            users_df = pd.DataFrame(list(user_context_dicts))
+            probe_frame, _ = build_recommendation_frame(
+                {}, self._probe_restaurant_df, self.category_cols, self.numeric_cols)
+            user_frame = probe_frame.iloc[np.zeros(len(users_df), dtype=np.intp)].reset_index(drop=True)
+            for col in users_df.columns:
+                if col in user_frame.columns and col not in self.restaurant_feature_cols:
+                    user_frame[col] = users_df[col]
+        with timed('preprocess'):
+            encoded = self.preprocessor.transform(user_frame)
+            return encoded[:, self.user_out_idx].astype(np.float32)
+
+    def encode_user(self, user_context_dict):
+        """Returns the user-owned output columns for one context as a float32 vector."""
+        return self.encode_users([user_context_dict])[0]
+
+    def transform(self, user_context_dict):
+        """Returns the full (num_restaurants, num_features) float32 candidate matrix."""
+        X = np.empty((len(self.restaurant_block), self.num_features), dtype=np.float32)
+        X[:, self.restaurant_out_idx] = self.restaurant_block
+        X[:, self.user_out_idx] = self.encode_user(user_context_dict)
+        return X
+
+
+def fill_missing_user_features(user_context_dict, catalog):
+    """Defaults user-side feature columns absent from the context in place. Returns the defaulted columns.
+
+    catalog: a RestaurantCatalog or catalog DataFrame; its columns are the restaurant side.
+    """
+    missing_features = []
+    for col in config.CATEGORY_COLS + config.NUMERIC_COLS:
+        if col not in catalog.columns and col not in user_context_dict:
+            missing_features.append(col)
+            user_context_dict[col] = "Unknown" if col in config.CATEGORY_COLS else 0.0
+    return missing_features
+
+
+def parse_batch_entries(payload, max_entries, max_top_n=None):
+    """Validates a /recommend_batch payload. Returns (user_contexts, top_ns, error_message).
+
+    Each entry's top_n defaults to RECO_TOP_N and must be an integer between 1 and max_top_n
+    (RECO_BATCH_MAX_TOP_N by default).
+    """
+    max_top_n = config.RECO_BATCH_MAX_TOP_N if max_top_n is None else max_top_n
+    entries = payload.get('requests') if isinstance(payload, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return None, None, "Invalid input: expected a non-empty 'requests' list."
+    if len(entries) > max_entries:
+        return None, None, f"Too many entries: {len(entries)} > {max_entries}."
+    user_contexts, top_ns = [], []
+    for i, entry in enumerate(entries):
+        user_context = entry.get('user_context') if isinstance(entry, dict) else None
+        top_n = entry.get('top_n', config.RECO_TOP_N) if isinstance(entry, dict) else None
+        if not isinstance(user_context, dict) or not user_context:
+            return None, None, f"Entry {i}: 'user_context' must be a non-empty object."
+        if isinstance(top_n, bool) or not isinstance(top_n, int) or not 1 <= top_n <= max_top_n:
+            return None, None, f"Entry {i}: 'top_n' must be an integer between 1 and {max_top_n}."
+        user_context = dict(user_context)
+        if 'filters' in entry:
+            user_context['filters'] = entry['filters']  # Popped again by the caller
+        user_contexts.append(user_context)
+        top_ns.append(top_n)
+    return user_contexts, top_ns, None
+
+
+def build_candidate_encoder(preprocessor, all_restaurants_df, log_prefix=""):
+    """Returns a PrecomputedCandidateEncoder, or None if the preprocessor cannot be split."""
+    try:
+        encoder = PrecomputedCandidateEncoder(preprocessor, all_restaurants_df)
+    except Exception as e:
+        print(f"{log_prefix}Restaurant feature block not precomputed ({e}). Falling back to full transform per request.")
+        return None
+    print(f"{log_prefix}Precomputed restaurant feature block {encoder.restaurant_block.shape} "
+          f"(user block: {len(encoder.user_out_idx)} columns per request).")
+    return encoder
+
+
+def encode_candidates(candidate_encoder, preprocessor, user_context_dict, all_restaurants_df, log_prefix="",
+                      rows=None):
+    """Same contract as transform_recommendation_frame, using the precomputed block when available.
+
+    rows: optional catalog row positions to restrict the candidates to (e.g. from CatalogIndex).
+    """
+    import torch
+    if candidate_encoder is None:
+        candidates_df = all_restaurants_df if rows is None else all_restaurants_df.iloc[rows]
+        return transform_recommendation_frame(
+            preprocessor, user_context_dict, candidates_df, log_prefix=log_prefix)
+    try:
+        X = candidate_encoder.transform(user_context_dict)
+    except Exception as e:
+        print(f"{log_prefix}Error during preproc transform for recommendation: {e}")
+        return torch.empty(0), [], 0
+    if rows is None:
+        return torch.from_numpy(X), candidate_encoder.restaurant_ids_order, candidate_encoder.num_features
+    restaurant_ids_order = [candidate_encoder.restaurant_ids_order[i] for i in rows]
+    return torch.from_numpy(X[rows]), restaurant_ids_order, candidate_encoder.num_features
+
+
+def _build_recommendation_frame_rowwise(user_context_dict, all_restaurants_df,
+                                        category_cols, numeric_cols):
+    # Reference (pre-vectorization) builder, kept for the standalone equivalence check.
+    inference_df_list = []
+    user_base_df = pd.DataFrame([user_context_dict])
+    for _, restaurant_row_series in all_restaurants_df.iterrows():
+        combined_features_df = user_base_df.copy()
+        for col, val in restaurant_row_series.to_dict().items():
+            if col in category_cols or col in numeric_cols:
+                combined_features_df[col] = val
+        inference_df_list.append(combined_features_df)
+    full_inference_df = pd.concat(inference_df_list, ignore_index=True)
+    for col in category_cols + numeric_cols:
+        if col not in full_inference_df.columns:
+            full_inference_df[col] = np.nan
+    return full_inference_df[category_cols + numeric_cols], all_restaurants_df['restaurant_id'].tolist()
+
+
+# Standalone equivalence check (food_features.py)
+if __name__ == '__main__':
+    import joblib
+    import time
+    from food_data_generator import load_csv_to_dataframe
+
+    restaurants_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
+    restaurants_df.rename(columns={'id': 'restaurant_id', 'rating': 'rating_biz'}, inplace=True)
+    preprocessor = joblib.load(config.PREPROCESSOR_SAVE_PATH)
+    user_context = {'gender': '女', 'age': 31, 'hometown': '上海', 'diseases': '高血压',
+                    'daily_food_budget_cny': 120, 'heart_rate_bpm': 72, 'cost': 999.0}
+    for col in config.CATEGORY_COLS + config.NUMERIC_COLS:
+        if col not in restaurants_df.columns and col not in user_context:
+            user_context[col] = "Unknown" if col in config.CATEGORY_COLS else 0.0
+
+    sample_df = restaurants_df.sample(n=min(500, len(restaurants_df)), random_state=0)
+    start = time.perf_counter()
+    ref_frame, ref_ids = _build_recommendation_frame_rowwise(
+        user_context, sample_df, config.CATEGORY_COLS, config.NUMERIC_COLS)
+    rowwise_s = time.perf_counter() - start
+    start = time.perf_counter()
+    new_frame, new_ids = build_recommendation_frame(user_context, sample_df)
+    vectorized_s = time.perf_counter() - start
+
+    assert ref_ids == new_ids, "Restaurant ID order differs."
+    np.testing.assert_array_equal(preprocessor.transform(ref_frame), preprocessor.transform(new_frame))
+    print(f"Equivalent on {len(sample_df)} restaurants. Row-wise: {rowwise_s:.3f}s, vectorized: {vectorized_s:.4f}s")
+
+    encoder = PrecomputedCandidateEncoder(preprocessor, restaurants_df)
+    full_frame, _ = build_recommendation_frame(user_context, restaurants_df)
+    start = time.perf_counter()
+    X_split = encoder.transform(user_context)
+    split_s = time.perf_counter() - start
+    np.testing.assert_array_equal(preprocessor.transform(full_frame).astype(np.float32), X_split)
+    print(f"Split encoder equivalent on {len(restaurants_df)} restaurants. Per-request: {split_s:.4f}s")
+
+    entry = {'user_context': {'age': 30}}
+    for top_n in (0, -1, 2.5, '5', True, None, 101):
+        assert parse_batch_entries({'requests': [dict(entry, top_n=top_n)]}, 4, max_top_n=100)[2], top_n
+    _, top_ns, error_msg = parse_batch_entries({'requests': [entry, dict(entry, top_n=100)]}, 4, max_top_n=100)
+    assert error_msg is None and top_ns == [config.RECO_TOP_N, 100], (top_ns, error_msg)
+    print("Batch entries check passed: top_n outside 1..100 or not an integer is rejected.")
@@ -0,0 +1,95 @@
+# food_hot_reload.py
+import hashlib
+import os
+import threading
+import time
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(paths):
+    """(path, mtime_ns, size) per path; None for files that don't exist."""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append((path, None, None))
+    return tuple(signature)
+
+
+class FileChangeWatcher:
+    """Polls serving artifacts in a daemon thread and calls on_change() when they change.
+
+    A change is acted on only once the files have stopped changing for one poll interval, so a
+    checkpoint that is still being written isn't loaded. on_change() runs on the watcher thread and
+    returns True on success; a failed load isn't retried until the files change again.
+    """
+
+    def __init__(self, paths, on_change, interval_seconds, log_prefix=""):
+        self.paths = list(paths)
+        self.on_change = on_change
+        self.interval_seconds = interval_seconds
+        self.log_prefix = log_prefix
+        self.loaded_signature = file_signature(self.paths)  # What the current snapshot was built from
+        self._pending_signature = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll_once(self):
+        """One watcher step. Returns True if on_change() ran and succeeded."""
+        signature = file_signature(self.paths)
+        if signature == self.loaded_signature:
+            self._pending_signature = None
+            return False
+        if signature != self._pending_signature:
+            self._pending_signature = signature  # Changed; wait one more interval for it to settle
+            return False
+        self._pending_signature = None
+        self.loaded_signature = signature
+        print(f"{self.log_prefix}Serving artifacts changed; reloading in the background.")
+        try:
+            return bool(self.on_change())
+        except Exception as e:
+            print(f"{self.log_prefix}Reload failed ({e}). Keeping the current snapshot.")
+            return False
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            self.poll_once()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="serving-artifact-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+# Standalone check (food_hot_reload.py)
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'model.bin')
+        with open(path, 'wb') as f:
+            f.write(b'v1')
+        reloads = []
+        watcher = FileChangeWatcher([path], lambda: reloads.append(open(path, 'rb').read()) or True, 0.01)
+        assert not watcher.poll_once() and reloads == []
+        time.sleep(0.01)
+        with open(path, 'wb') as f:
+            f.write(b'v2-longer')
+        assert not watcher.poll_once(), "Reloaded before the file settled."
+        assert watcher.poll_once() and reloads == [b'v2-longer']
+        assert not watcher.poll_once()
+        print("Watcher reloads once per settled change.")
@@ -0,0 +1,240 @@
+# food_metrics.py
+# Per-route request metrics for a Flask app, served as Prometheus text (exposition format 0.0.4) from /metrics.
+# Standard library only: one lock and a few list updates per request, cheap enough to leave on in production.
+import threading
+import time
+from bisect import bisect_left
+
+import federated_config as config
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# stats() keys that only ever grow (result cache, request coalescer); exported as <name>_<key>_total counters
+STATS_COUNTER_KEYS = frozenset({'hits', 'misses', 'coalesced', 'evictions', 'expirations', 'invalidations',
+                                'requests', 'batches', 'failed_batches'})
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Bucket counts (per upper bound, not cumulative until rendered), sum and count of observations."""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.bucket_counts = [0] * (len(self.bounds) + 1)  # Last bucket: above every bound (+Inf)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.bucket_counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def samples(self, name, label_names, label_values):
+        cumulative = 0
+        for bound, bucket_count in zip(self.bounds + [float('inf')], self.bucket_counts):
+            cumulative += bucket_count
+            le = 'le="' + _format_value(bound) + '"'
+            yield f"{name}_bucket{_labels(label_names, label_values, le)} {cumulative}"
+        yield f"{name}_sum{_labels(label_names, label_values)} {_format_value(self.total)}"
+        yield f"{name}_count{_labels(label_names, label_values)} {self.count}"
+
+
+class RouteMetrics:
+    """Request counts, latency / payload-size histograms, in-flight gauges and unhandled exceptions per route.
+
+    Routes are labelled by their URL rule ('/recommend', not the raw path), so label cardinality stays
+    bounded; unmatched paths share the route label 'unmatched'. Collectors added with add_collector
+    contribute further metric families (cache and coalescer stats) at scrape time.
+    """
+
+    def __init__(self, prefix, latency_buckets=None, size_buckets=None):
+        self.prefix = prefix
+        self.latency_buckets = sorted(config.METRICS_LATENCY_BUCKETS_SECONDS if latency_buckets is None
+                                      else latency_buckets)
+        self.size_buckets = sorted(config.METRICS_SIZE_BUCKETS_BYTES if size_buckets is None else size_buckets)
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._requests = {}  # (route, method, status) -> count
+        self._latency = {}  # (route, method) -> Histogram (seconds)
+        self._request_size = {}  # (route, method) -> Histogram (bytes)
+        self._response_size = {}
+        self._in_flight = {}  # (route, method) -> requests being handled
+        self._exceptions = {}  # (route, method, exception class) -> count
+        self._collectors = []
+
+    def add_collector(self, collect):
+        """collect() -> [(name, type, help, [(labels dict, value), ...]), ...]; name is used without the prefix."""
+        self._collectors.append(collect)
+
+    def request_started(self, route, method):
+        with self._lock:
+            self._in_flight[(route, method)] = self._in_flight.get((route, method), 0) + 1
+
+    def request_finished(self, route, method, status, seconds, request_bytes=None, response_bytes=None):
+        key = (route, method)
+        with self._lock:
+            self._in_flight[key] -= 1
+            self._requests[key + (str(status),)] = self._requests.get(key + (str(status),), 0) + 1
+            if key not in self._latency:
+                self._latency[key] = Histogram(self.latency_buckets)
+                self._request_size[key] = Histogram(self.size_buckets)
+                self._response_size[key] = Histogram(self.size_buckets)
+            self._latency[key].observe(seconds)
+            if request_bytes is not None:
+                self._request_size[key].observe(request_bytes)
+            if response_bytes is not None:
+                self._response_size[key].observe(response_bytes)
+
+    def exception_raised(self, route, method, exception):
+        key = (route, method, type(exception).__name__)
+        with self._lock:
+            self._exceptions[key] = self._exceptions.get(key, 0) + 1
+
+    def _family(self, name, metric_type, help_text, lines):
+        return [f"# HELP {self.prefix}{name} {help_text}", f"# TYPE {self.prefix}{name} {metric_type}"] + lines
+
+    def render(self):
+        """All metric families as Prometheus text."""
+        p = self.prefix
+        route_labels = ('route', 'method')
+        with self._lock:
+            requests = sorted(self._requests.items())
+            in_flight = sorted(self._in_flight.items())
+            exceptions = sorted(self._exceptions.items())
+            histograms = [(name, help_text, [(key, hist.samples(f"{p}{name}", route_labels, key))
+                                             for key, hist in sorted(per_route.items())])
+                          for name, help_text, per_route in (
+                              ('http_request_duration_seconds', "Request latency by route.", self._latency),
+                              ('http_request_size_bytes', "Request body size by route.", self._request_size),
+                              ('http_response_size_bytes', "Response body size by route.", self._response_size))]
+            histograms = [(name, help_text, [line for _, samples in per_route for line in samples])
+                          for name, help_text, per_route in histograms]
+        lines = self._family('http_requests_total', 'counter', "Requests handled, by route, method and status.",
+                             [f"{p}http_requests_total{_labels(route_labels + ('status',), key)} {count}"
+                              for key, count in requests])
+        lines += self._family('http_requests_in_flight', 'gauge', "Requests being handled, by route.",
+                              [f"{p}http_requests_in_flight{_labels(route_labels, key)} {count}"
+                               for key, count in in_flight])
+        lines += self._family('http_exceptions_total', 'counter', "Unhandled exceptions, by route and class.",
+                              [f"{p}http_exceptions_total{_labels(route_labels + ('exception',), key)} {count}"
+                               for key, count in exceptions])
+        for name, help_text, samples in histograms:
+            lines += self._family(name, 'histogram', help_text, samples)
+        lines += self._family('uptime_seconds', 'gauge', "Seconds since the metrics were created.",
+                              [f"{p}uptime_seconds {_format_value(time.time() - self.started_at)}"])
+        for collect in self._collectors:
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines += self._family(name, metric_type, help_text,
+                                      [f"{p}{name}{_labels(labels.keys(), labels.values())} {_format_value(value)}"
+                                       for labels, value in samples])
+        return "\n".join(lines) + "\n"
+
+
+def install_route_metrics(app, metrics, path='/metrics'):
+    """Records every request of app into metrics and serves metrics.render() at path (GET)."""
+    from flask import g, request
+
+    def route_of_request():
+        return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_route = route_of_request()
+        g.metrics_started_at = time.perf_counter()
+        g.metrics_finished = False
+        metrics.request_started(g.metrics_route, request.method)
+
+    @app.after_request
+    def _metrics_finish(response):
+        g.metrics_finished = True
+        metrics.request_finished(g.metrics_route, request.method, response.status_code,
+                                 time.perf_counter() - g.metrics_started_at,
+                                 request.content_length or 0, response.calculate_content_length())
+        return response
+
+    @app.teardown_request
+    def _metrics_teardown(exception):
+        if 'metrics_started_at' not in g:
+            return
+        # after_request is skipped when an exception escapes the view (e.g. propagated in debug mode)
+        if not g.metrics_finished:
+            metrics.request_finished(g.metrics_route, request.method, 500,
+                                     time.perf_counter() - g.metrics_started_at, request.content_length or 0)
+        if exception is not None:
+            metrics.exception_raised(g.metrics_route, request.method, exception)
+
+    @app.route(path, methods=['GET'])
+    def metrics_route():
+        return app.response_class(metrics.render(), mimetype=PROMETHEUS_CONTENT_TYPE)
+
+    return metrics
+
+
+def stats_collector(name, stats, help_prefix):
+    """Metric families for the numeric entries of a stats() dict (cache / coalescer stats).
+
+    Keys in STATS_COUNTER_KEYS become counters named <name>_<key>_total; the rest (size, hit_rate,
+    queued, ...) are gauges.
+    """
+    families = []
+    for key, value in stats.items():
+        if not isinstance(value, (int, float)):
+            continue
+        if key in STATS_COUNTER_KEYS:
+            families.append((f"{name}_{key}_total", 'counter', f"{help_prefix}: {key}.", [({}, value)]))
+        else:
+            families.append((f"{name}_{key}", 'gauge', f"{help_prefix}: {key}.", [({}, value)]))
+    return families
+
+
+# Standalone check (food_metrics.py)
+if __name__ == '__main__':
+    from flask import Flask, jsonify
+
+    app = Flask(__name__)
+    metrics = install_route_metrics(app, RouteMetrics('demo_', latency_buckets=[0.001, 0.1]))
+    metrics.add_collector(lambda: stats_collector('cache', {"hits": 3, "hit_rate": 0.75, "enabled": True, "version": "v"}, "Cache"))
+
+    @app.route('/items/<int:item_id>', methods=['POST'])
+    def item(item_id):
+        if item_id == 0:
+            raise ValueError("no item 0")
+        return jsonify({"id": item_id})
+
+    client = app.test_client()
+    for item_id in (1, 2, 0):
+        client.post(f'/items/{item_id}', json={"payload": "x" * 100})
+    client.get('/nowhere')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'demo_http_requests_total{route="/items/<int:item_id>",method="POST",status="200"} 2' in text
+    assert 'demo_http_requests_total{route="/items/<int:item_id>",method="POST",status="500"} 1' in text
+    assert 'demo_http_requests_total{route="unmatched",method="GET",status="404"} 1' in text
+    assert 'demo_http_exceptions_total{route="/items/<int:item_id>",method="POST",exception="ValueError"} 1' in text
+    assert 'demo_http_request_duration_seconds_bucket{route="/items/<int:item_id>",method="POST",le="+Inf"} 3' in text
+    assert 'demo_http_requests_in_flight{route="/items/<int:item_id>",method="POST"} 0' in text
+    assert '# TYPE demo_cache_hits_total counter' in text and 'demo_cache_hits_total 3' in text
+    assert '# TYPE demo_cache_hit_rate gauge' in text and 'demo_cache_version' not in text
+    assert 'demo_cache_enabled 1' in text
+    print(f"Metrics check passed ({len(text.splitlines())} exposition lines).")
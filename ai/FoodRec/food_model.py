@@ -16,13 +16,54 @@ class FoodPreferenceModel(nn.Module):
         self.fc3 = nn.Linear(HIDDEN_DIM // 2, OUTPUT_DIM)
 
     def forward(self, x):
-        x = F.relu(self.bn1(self.fc1(x)))
+        return self.forward_after_fc1(self.fc1(x))
+
+    def forward_after_fc1(self, x):
+        # Everything downstream of fc1; lets callers supply a precomputed fc1 pre-activation.
+        x = F.relu(self.bn1(x))
         x = F.dropout(x, p=0.4, training=self.training) # Increased dropout
         x = F.relu(self.bn2(self.fc2(x)))
         x = F.dropout(x, p=0.4, training=self.training) # Increased dropout
         x = self.fc3(x)
         return x
 
+class FoldedFoodPreferenceModel(nn.Module):
+    """Inference-only FoodPreferenceModel: bn1/bn2 folded into fc1/fc2, dropout removed.
+
+    forward_after_fc1 takes the folded fc1 output (i.e. bn1(fc1(x)) of the source model).
+    """
+    def __init__(self, fc1, fc2, fc3):
+        super(FoldedFoodPreferenceModel, self).__init__()
+        self.fc1 = fc1
+        self.fc2 = fc2
+        self.fc3 = fc3
+
+    def forward(self, x):
+        return self.forward_after_fc1(self.fc1(x))
+
+    @torch.jit.export
+    def forward_after_fc1(self, x):
+        x = F.relu(x)
+        x = F.relu(self.fc2(x))
+        return self.fc3(x)
+
+def _fold_linear_bn(linear, bn):
+    # bn(Wx + b) = (scale*W)x + scale*(b - running_mean) + beta, with scale = gamma / sqrt(running_var + eps)
+    scale = bn.weight / torch.sqrt(bn.running_var + bn.eps)
+    folded = nn.Linear(linear.in_features, linear.out_features)
+    folded.weight.copy_(linear.weight * scale.unsqueeze(1))
+    folded.bias.copy_((linear.bias - bn.running_mean) * scale + bn.bias)
+    return folded
+
+def fold_batchnorm(model):
+    """Returns a FoldedFoodPreferenceModel computing model's eval-mode output with fewer ops."""
+    with torch.no_grad():
+        folded = FoldedFoodPreferenceModel(_fold_linear_bn(model.fc1, model.bn1),
+                                           _fold_linear_bn(model.fc2, model.bn2),
+                                           nn.Linear(model.fc3.in_features, model.fc3.out_features))
+        folded.fc3.load_state_dict(model.fc3.state_dict())
+    return folded.eval()
+
 def weights_to_json_serializable(state_dict):
     return {k: v.cpu().numpy().tolist() for k, v in state_dict.items()}
 
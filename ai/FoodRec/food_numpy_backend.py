@@ -0,0 +1,219 @@
+# food_numpy_backend.py
+# Serving-time scoring with plain NumPy: no torch, sklearn or pandas imports in this module.
+# The bundle is written by export_numpy_bundle() in food_serving_model.py.
+import math
+
+import numpy as np
+
+import federated_config as config
+from food_timing import timed
+
+BUNDLE_FORMAT_VERSION = 1
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+class NumpyPreprocessor:
+    """Re-implementation of the fitted ColumnTransformer from exported arrays.
+
+    Blocks are applied in export order: 'onehot' (most-frequent imputation + one-hot,
+    unknown values -> all zeros) and 'scale' (mean imputation + standard scaling).
+    """
+
+    def __init__(self, bundle):
+        self.blocks = []
+        self.owners = []  # Input column of every output column
+        for b in range(int(bundle['num_blocks'])):
+            kind = str(bundle[f'b{b}_kind'])
+            cols = [str(c) for c in bundle[f'b{b}_cols']]
+            start = len(self.owners)
+            if kind == 'onehot':
+                counts = bundle[f'b{b}_category_counts']
+                categories = [str(c) for c in bundle[f'b{b}_categories']]
+                bounds = np.concatenate([[0], np.cumsum(counts)])
+                block = {'kind': kind, 'cols': cols, 'start': start, 'fill': [str(f) for f in bundle[f'b{b}_fill']],
+                         'offsets': bounds[:-1], 'widths': counts,
+                         'lookup': [{cat: j for j, cat in enumerate(categories[bounds[i]:bounds[i + 1]])}
+                                    for i in range(len(cols))]}
+                self.owners.extend(col for col, width in zip(cols, counts) for _ in range(width))
+            elif kind == 'scale':
+                block = {'kind': kind, 'cols': cols, 'start': start, 'fill': bundle[f'b{b}_fill'].astype(np.float64),
+                         'mean': bundle[f'b{b}_mean'].astype(np.float64),
+                         'scale': bundle[f'b{b}_scale'].astype(np.float64)}
+                self.owners.extend(cols)
+            else:
+                raise ValueError(f"Unsupported bundle block kind: {kind}")
+            self.blocks.append(block)
+        self.input_cols = [col for block in self.blocks for col in block['cols']]
+        self.num_features = len(self.owners)
+
+    def output_indices(self, cols):
+        cols = set(cols)
+        return np.array([j for j, owner in enumerate(self.owners) if owner in cols], dtype=np.intp)
+
+    def encode(self, columns, num_rows, cols):
+        """(num_rows, len(output_indices(cols))) float32 encoding of the given input columns.
+
+        columns: {col: sequence of num_rows values}; absent columns are treated as missing.
+        """
+        cols = set(cols)
+        out = np.zeros((num_rows, self.num_features), dtype=np.float32)
+        rows = np.arange(num_rows)
+        for block in self.blocks:
+            for i, col in enumerate(block['cols']):
+                if col not in cols:
+                    continue
+                values = columns.get(col, [None] * num_rows)
+                if block['kind'] == 'onehot':
+                    lookup, fill = block['lookup'][i], block['fill'][i]
+                    codes = np.array([lookup.get(fill if _is_missing(v) else v, -1) for v in values], dtype=np.intp)
+                    known = codes >= 0
+                    out[rows[known], block['start'] + block['offsets'][i] + codes[known]] = 1.0
+                else:
+                    x = np.array([np.nan if _is_missing(v) else v for v in values], dtype=np.float64)
+                    x[np.isnan(x)] = block['fill'][i]
+                    out[:, block['start'] + i] = (x - block['mean'][i]) / block['scale'][i]
+        return out[:, self.output_indices(cols)]
+
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def high_pref_probability(logits):
+    # softmax(logits)[..., 2], computed stably
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(shifted)
+    return exp[..., 2] / exp.sum(axis=-1)
+
+
+class NumpyScoringEngine:
+    """NumPy counterpart of FactorizedScoringEngine over the BatchNorm-folded model in a bundle.
+
+    The restaurant side of fc1 (W_r·X_restaurants + b) is computed once at load time, or taken
+    precomputed from a serving bundle (restaurant_columns then only needs the column names);
+    per request only the user columns are encoded.
+    """
+
+    def __init__(self, bundle, restaurant_columns, restaurant_ids_order, restaurant_pre_activation=None):
+        self.preprocessor = NumpyPreprocessor(bundle)
+        self.restaurant_ids_order = (restaurant_ids_order if isinstance(restaurant_ids_order, np.ndarray)
+                                     else list(restaurant_ids_order))  # A bundle's mapped ID array is kept as is
+        num_restaurants = len(self.restaurant_ids_order)
+        self.restaurant_feature_cols = [col for col in self.preprocessor.input_cols if col in restaurant_columns]
+        self.user_feature_cols = [col for col in self.preprocessor.input_cols if col not in restaurant_columns]
+        fc1_weight = bundle['fc1_weight'].astype(np.float32)
+        if fc1_weight.shape[1] != self.preprocessor.num_features:
+            raise ValueError(f"Bundle model expects {fc1_weight.shape[1]} features, "
+                             f"preprocessor produces {self.preprocessor.num_features}.")
+        self.user_weight = np.ascontiguousarray(
+            fc1_weight[:, self.preprocessor.output_indices(self.user_feature_cols)])
+        if restaurant_pre_activation is None:
+            restaurant_block = self.preprocessor.encode(restaurant_columns, num_restaurants, self.restaurant_feature_cols)
+            restaurant_pre_activation = (
+                restaurant_block @ fc1_weight[:, self.preprocessor.output_indices(self.restaurant_feature_cols)].T
+                + bundle['fc1_bias'].astype(np.float32))
+        elif restaurant_pre_activation.shape != (num_restaurants, fc1_weight.shape[0]):
+            raise ValueError(f"Precomputed restaurant part has shape {restaurant_pre_activation.shape}, "
+                             f"expected {(num_restaurants, fc1_weight.shape[0])}.")
+        self.restaurant_pre_activation = restaurant_pre_activation
+        self.fc2_weight_t = np.ascontiguousarray(bundle['fc2_weight'].astype(np.float32).T)
+        self.fc2_bias = bundle['fc2_bias'].astype(np.float32)
+        self.fc3_weight_t = np.ascontiguousarray(bundle['fc3_weight'].astype(np.float32).T)
+        self.fc3_bias = bundle['fc3_bias'].astype(np.float32)
+
+    @property
+    def num_features(self):
+        return self.preprocessor.num_features
+
+    def ids_for_rows(self, rows):
+        if rows is None:
+            return self.restaurant_ids_order
+        return [self.restaurant_ids_order[i] for i in rows]
+
+    def encode_users(self, user_contexts):
+        with timed('features'):
+            columns = {col: [context.get(col) for context in user_contexts] for col in self.user_feature_cols}
+        with timed('preprocess'):
+            return self.preprocessor.encode(columns, len(user_contexts), self.user_feature_cols)
+
+    def forward_after_fc1(self, pre_activation):
+        hidden = _relu(pre_activation)
+        hidden = _relu(hidden @ self.fc2_weight_t + self.fc2_bias)
+        return hidden @ self.fc3_weight_t + self.fc3_bias
+
+    def high_pref_scores(self, user_contexts, rows=None, max_rows=None):
+        """(B, N) float32 high-preference probabilities, N = catalog or len(rows), chunked like the torch engine."""
+        max_rows = config.RECO_BATCH_MAX_SCORE_ROWS if max_rows is None else max_rows
+        restaurant_part = self.restaurant_pre_activation if rows is None else \
+            self.restaurant_pre_activation[np.asarray(rows, dtype=np.intp)]
+        num_restaurants, hidden_dim = restaurant_part.shape
+        user_block = self.encode_users(user_contexts)
+        with timed('forward'):
+            user_parts = user_block @ self.user_weight.T
+            scores = np.empty((len(user_contexts), num_restaurants), dtype=np.float32)
+            users_per_chunk = max(1, max_rows // max(num_restaurants, 1))
+            for start in range(0, len(user_contexts), users_per_chunk):
+                chunk = user_parts[start:start + users_per_chunk]
+                pre_activation = (restaurant_part[None, :, :] + chunk[:, None, :]).reshape(-1, hidden_dim)
+                scores[start:start + len(chunk)] = high_pref_probability(
+                    self.forward_after_fc1(pre_activation)).reshape(len(chunk), num_restaurants)
+        return scores
+
+
+def top_k(scores, k):
+    """(top_scores, top_indices) of a 1-D score array, best first; non-finite (masked) scores are dropped."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return scores[:0], np.empty(0, dtype=np.intp)
+    candidates = np.sort(np.argpartition(-scores, k - 1)[:k])  # Equal scores: lower row first
+    order = candidates[np.argsort(-scores[candidates], kind='stable')]
+    order = order[np.isfinite(scores[order])]
+    return scores[order], order
+
+
+def segmented_top_k(scores, segment_ids, segment_offsets, k):
+    """The top k finite scores of every segment in one stable sort.
+
+    scores are laid out segment by segment: segment s spans segment_offsets[s]:segment_offsets[s + 1] and
+    segment_ids is the segment of each position. Returns (positions, bounds): segment s's picks, best
+    first (equal scores: earlier position first), are positions[bounds[s]:bounds[s + 1]].
+    """
+    order = np.lexsort((-scores, segment_ids))  # Segments keep their spans, sorted best first inside
+    rank = np.arange(len(order)) - segment_offsets[segment_ids]
+    keep = (rank < k) & np.isfinite(scores[order])
+    return order[keep], np.searchsorted(segment_ids[keep], np.arange(len(segment_offsets)))
+
+
+def mask_scores_to_candidates(scores, scored_rows, rows_per_entry):
+    """NumPy version of food_scoring.mask_scores_to_candidates."""
+    for i, rows in enumerate(rows_per_entry):
+        if rows is None:
+            continue
+        keep = np.isin(np.arange(scores.shape[1]) if scored_rows is None else scored_rows, rows)
+        scores[i, ~keep] = -np.inf
+    return scores
+
+
+def load_numpy_bundle(path):
+    bundle = dict(np.load(path, allow_pickle=False))
+    if int(bundle.get('format_version', -1)) != BUNDLE_FORMAT_VERSION:
+        raise ValueError(f"Unsupported NumPy bundle format in {path}.")
+    return bundle
+
+
+def build_numpy_scoring_engine(bundle_path, all_restaurants_df, log_prefix=""):
+    """Returns a NumpyScoringEngine over the catalog, or None if the bundle is missing or unusable."""
+    try:
+        bundle = load_numpy_bundle(bundle_path)
+        restaurant_columns = {col: all_restaurants_df[col].tolist()
+                              for col in all_restaurants_df.columns if col in config.CATEGORY_COLS + config.NUMERIC_COLS}
+        engine = NumpyScoringEngine(bundle, restaurant_columns, all_restaurants_df['restaurant_id'].tolist())
+    except Exception as e:
+        print(f"{log_prefix}NumPy backend unavailable ({e}). Export it with 'python food_serving_model.py'.")
+        return None
+    print(f"{log_prefix}NumPy scoring engine ready from {bundle_path}: cached fc1 restaurant part "
+          f"{engine.restaurant_pre_activation.shape}, {len(engine.user_feature_cols)} user columns per request.")
+    return engine
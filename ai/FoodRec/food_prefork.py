@@ -0,0 +1,133 @@
+# food_prefork.py
+# Preload-and-fork serving: the parent loads the catalog, preprocessor and model once, moves the large
+# read-only matrices into mmap'd files, then forks workers that accept on one shared listening socket.
+# Workers share the parent's pages copy-on-write; POSIX only (os.fork).
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from food_serving_bundle import is_file_mapped
+
+
+def shared_memory_dir():
+    # /dev/shm is RAM-backed on Linux; elsewhere fall back to the temp dir (still shared via the page cache)
+    return tempfile.mkdtemp(prefix="foodrec-serving-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+
+def mmap_array(array, directory, name):
+    """Writes array to directory/name.npy and returns a copy-on-write memory map of it.
+
+    Every process mapping the file shares its clean pages, so forked workers don't each hold a copy.
+    """
+    path = os.path.join(directory, f"{name}.npy")
+    np.save(path, np.ascontiguousarray(array))
+    return np.load(path, mmap_mode='c')
+
+
+def share_engine_arrays(reco_engine, directory, log_prefix=""):
+    """Replaces a RecommendationEngine's per-catalog matrices with memory maps under directory; returns total bytes."""
+    shared_bytes = 0
+    encoder = reco_engine.candidate_encoder
+    if encoder is not None:
+        encoder.restaurant_block = mmap_array(encoder.restaurant_block, directory, "restaurant_block")
+        shared_bytes += encoder.restaurant_block.nbytes
+    engine = reco_engine.scoring_engine
+    if engine is not None:
+        import torch
+        mapped = mmap_array(engine.restaurant_pre_activation.numpy(), directory, "restaurant_pre_activation")
+        engine.restaurant_pre_activation = torch.from_numpy(mapped)
+        shared_bytes += mapped.nbytes
+    numpy_engine = reco_engine.numpy_engine
+    # A serving bundle's matrices are already mapped from its file, so workers share them as is
+    if numpy_engine is not None and not is_file_mapped(numpy_engine.restaurant_pre_activation):
+        numpy_engine.restaurant_pre_activation = mmap_array(
+            numpy_engine.restaurant_pre_activation, directory, "numpy_restaurant_pre_activation")
+        shared_bytes += numpy_engine.restaurant_pre_activation.nbytes
+    print(f"{log_prefix}Shared {shared_bytes / 1e6:.1f} MB of catalog matrices via {directory}.")
+    return shared_bytes
+
+
+def _serve_worker(app, host, port, listen_fd, worker_index, on_worker_start, threads_per_worker):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C goes to the parent, which stops the workers
+    if 'torch' in sys.modules:  # Not imported at all by the numpy backend
+        sys.modules['torch'].set_num_threads(threads_per_worker)  # N workers x all cores would oversubscribe the CPU
+    if on_worker_start is not None:
+        on_worker_start()
+    from werkzeug.serving import make_server
+    server = make_server(host, port, app, threaded=True, fd=listen_fd)
+    print(f"Worker {worker_index} (pid {os.getpid()}) serving on {host}:{port}.")
+    server.serve_forever()
+
+
+def serve_preforked(app, host, port, num_workers, on_worker_start=None, shared_dir=None, log_prefix=""):
+    """Forks num_workers Werkzeug servers that accept on one socket bound here; restarts workers that die.
+
+    Call after all resources are loaded. on_worker_start runs in each worker after the fork (threads,
+    e.g. a hot-reload watcher, don't survive fork). Blocks until SIGINT/SIGTERM, then stops the
+    workers and removes shared_dir.
+    """
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_socket.bind((host, port))
+    listen_socket.listen(128)
+    listen_socket.set_inheritable(True)
+    threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    gc.freeze()  # Keep the loaded objects out of GC passes, which would otherwise dirty their shared pages
+
+    workers = {}  # pid -> worker index
+    stopping = []
+
+    def spawn(worker_index):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _serve_worker(app, host, port, listen_socket.fileno(), worker_index, on_worker_start, threads_per_worker)
+            finally:
+                os._exit(1)
+        workers[pid] = worker_index
+
+    def stop(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for worker_index in range(num_workers):
+        spawn(worker_index)
+    print(f"{log_prefix}Pre-forked {num_workers} workers on {host}:{port} "
+          f"({threads_per_worker} torch threads each).")
+    try:
+        while not stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(0.2)
+                continue
+            worker_index = workers.pop(pid, None)
+            if worker_index is not None and not stopping:
+                print(f"{log_prefix}Worker {worker_index} (pid {pid}) exited with status {status}; restarting.")
+                spawn(worker_index)
+    finally:
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(workers):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        listen_socket.close()
+        if shared_dir is not None:
+            shutil.rmtree(shared_dir, ignore_errors=True)
+        print(f"{log_prefix}All workers stopped.")
@@ -0,0 +1,117 @@
+# food_quantization.py
+import copy
+import time
+import warnings
+
+import torch
+import torch.nn as nn
+
+import federated_config as config
+from food_scoring import FactorizedScoringEngine
+
+
+def quantize_linear_layers(model):
+    """Copy of the model with every nn.Linear replaced by a dynamic int8 (qint8) Linear.
+
+    Weights are quantized once; activations are quantized per batch at run time.
+    BatchNorm and the rest of the graph stay in float32.
+    """
+    from torch.ao.quantization import quantize_dynamic
+    model = copy.deepcopy(model).eval()
+    with warnings.catch_warnings():
+        # torch.ao.quantization is deprecated in favour of torchao, which isn't a dependency here.
+        warnings.simplefilter("ignore")
+        return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def probe_user_contexts(candidate_encoder):
+    """A fixed spread of user contexts used to compare fp32 and int8 rankings."""
+    user_cols = [col for col in candidate_encoder.category_cols + candidate_encoder.numeric_cols
+                 if col not in candidate_encoder.restaurant_feature_cols]
+    base = {col: ("Unknown" if col in candidate_encoder.category_cols else 0.0) for col in user_cols}
+    contexts = []
+    for i, (age, budget) in enumerate([(22, 40), (30, 80), (38, 150), (45, 300), (55, 60), (68, 120)]):
+        context = dict(base, age=age, daily_food_budget_cny=budget, heart_rate_bpm=60 + 5 * i,
+                       sleep_hours_last_night=5.5 + 0.5 * i, steps_today_before_meal=1500 * i)
+        context['gender'] = config.GENDERS[i % len(config.GENDERS)]
+        context['activity_level'] = config.ACTIVITY_LEVELS[i % len(config.ACTIVITY_LEVELS)]
+        contexts.append({col: value for col, value in context.items() if col in user_cols})
+    return contexts
+
+
+def top_k_overlap(reference_engine, candidate_engine, user_contexts, k):
+    """Mean |top-k(reference) ∩ top-k(candidate)| / k of the high-preference scores over the contexts."""
+    user_vectors = reference_engine.candidate_encoder.encode_users(user_contexts)
+    results, timings = [], []
+    for engine in (reference_engine, candidate_engine):
+        start = time.perf_counter()
+        scores = torch.softmax(engine.logits_for_user_vectors(user_vectors), dim=-1)[..., 2]
+        timings.append(time.perf_counter() - start)
+        results.append(torch.topk(scores, k=min(k, scores.shape[1]), dim=1).indices.tolist())
+    overlaps = [len(set(reference_top) & set(candidate_top)) / max(len(reference_top), 1)
+                for reference_top, candidate_top in zip(*results)]
+    return sum(overlaps) / len(overlaps), timings
+
+
+def quantized_serving_model(model, candidate_encoder, log_prefix=""):
+    """Dynamic int8 copy of model if its top-k overlap with the fp32 model passes the threshold, else None.
+
+    The overlap is measured on probe contexts with RECO_INT8_OVERLAP_TOP_K and compared with
+    RECO_INT8_MIN_TOP_K_OVERLAP.
+    """
+    if candidate_encoder is None:
+        print(f"{log_prefix}Int8 quantization skipped: no precomputed candidate block to validate it against.")
+        return None
+    try:
+        quantized_model = quantize_linear_layers(model)
+        overlap, (fp32_s, int8_s) = top_k_overlap(
+            FactorizedScoringEngine(model, candidate_encoder), FactorizedScoringEngine(quantized_model, candidate_encoder),
+            probe_user_contexts(candidate_encoder), config.RECO_INT8_OVERLAP_TOP_K)
+    except Exception as e:
+        print(f"{log_prefix}Int8 quantization unavailable ({e}).")
+        return None
+    report = (f"top-{config.RECO_INT8_OVERLAP_TOP_K} overlap vs fp32 {overlap:.3f} "
+              f"(threshold {config.RECO_INT8_MIN_TOP_K_OVERLAP}); probe scoring fp32 {fp32_s * 1000:.1f}ms, "
+              f"int8 {int8_s * 1000:.1f}ms")
+    if overlap < config.RECO_INT8_MIN_TOP_K_OVERLAP:
+        print(f"{log_prefix}Int8 quantization REFUSED: {report}.")
+        return None
+    print(f"{log_prefix}Int8 quantization enabled: {report}.")
+    return quantized_model
+
+
+# Standalone check (food_quantization.py)
+if __name__ == '__main__':
+    import joblib
+    from food_model import FoodPreferenceModel
+    from food_data_generator import load_csv_to_dataframe
+    from food_features import PrecomputedCandidateEncoder
+
+    restaurants_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
+    restaurants_df.rename(columns={'id': 'restaurant_id', 'rating': 'rating_biz'}, inplace=True)
+    encoder = PrecomputedCandidateEncoder(joblib.load(config.PREPROCESSOR_SAVE_PATH), restaurants_df)
+    shipped_model = FoodPreferenceModel(input_dim=encoder.num_features)
+    shipped_model.load_state_dict(torch.load(config.GLOBAL_MODEL_SAVE_PATH, map_location='cpu'))
+    # The shipped model saturates (ties at score 1.0), so a random-init model shows ranking drift.
+    torch.manual_seed(0)
+    random_model = FoodPreferenceModel(input_dim=encoder.num_features)
+    with torch.no_grad():
+        random_model.bn1.running_mean.uniform_(-0.5, 0.5); random_model.bn1.running_var.uniform_(0.5, 2.0)
+    contexts = probe_user_contexts(encoder)
+    X = torch.from_numpy(encoder.transform(contexts[0]))
+
+    for name, model in (("shipped", shipped_model), ("random-init", random_model)):
+        model.eval()
+        quantized_model = quantize_linear_layers(model)
+        with torch.no_grad():
+            fp32_logits, int8_logits = model(X), quantized_model(X)
+        engine_logits = FactorizedScoringEngine(quantized_model, encoder).logits(contexts[0])
+        scale = fp32_logits.abs().max()
+        overlap, (fp32_s, int8_s) = top_k_overlap(
+            FactorizedScoringEngine(model, encoder), FactorizedScoringEngine(quantized_model, encoder),
+            contexts, config.RECO_INT8_OVERLAP_TOP_K)
+        print(f"{name}: max |logit| diff / max |logit| vs fp32: int8 forward "
+              f"{(int8_logits - fp32_logits).abs().max() / scale:.4f}, int8 factorized "
+              f"{(engine_logits - fp32_logits).abs().max() / scale:.4f}; top-{config.RECO_INT8_OVERLAP_TOP_K} "
+              f"overlap {overlap:.3f} over {len(contexts)} probe contexts; fp32 {fp32_s * 1000:.1f}ms, "
+              f"int8 {int8_s * 1000:.1f}ms")
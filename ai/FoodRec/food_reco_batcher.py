@@ -0,0 +1,153 @@
+# food_reco_batcher.py
+import queue
+import threading
+import time
+
+import federated_config as config
+from food_timing import current_timer, request_timer
+
+
+class _Waiter:
+    # One queued request; the submitting thread blocks on done.
+    def __init__(self, item):
+        self.item = item
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.phases = {}  # Phase timings of the batch it ran in (see food_timing)
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RequestCoalescer:
+    """Micro-batches concurrent single requests into one call of run_batch(items) -> results.
+
+    A batch is closed when max_batch_size requests are queued or max_wait_ms has passed since
+    its first request arrived, whichever comes first. run_batch runs on one worker thread and
+    must return one result per item, in order; if it raises, every waiter in the batch gets the error.
+    """
+
+    def __init__(self, run_batch, max_batch_size=None, max_wait_ms=None, name="request-coalescer"):
+        self.run_batch = run_batch
+        self.max_batch_size = config.RECO_COALESCE_MAX_BATCH if max_batch_size is None else max_batch_size
+        self.max_wait_ms = config.RECO_COALESCE_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.max_batch_seen = 0
+        self.batch_size_counts = {}  # batch size -> number of batches
+        self.queue_wait_total_s = 0.0
+        self.queue_wait_max_s = 0.0
+        self.batch_run_total_s = 0.0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        """Queues item and blocks until its batch has run; returns its result or raises the batch's error."""
+        self._ensure_worker()
+        waiter = _Waiter(item)
+        self._queue.put(waiter)
+        waiter.done.wait()
+        timer = current_timer()
+        if timer is not None and waiter.started_at is not None:
+            timer.add('queue', waiter.started_at - waiter.enqueued_at)
+            timer.merge(waiter.phases)  # Shared by every request of the batch
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.value
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Past the deadline, still take whatever queued up while the previous batch ran.
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started_at = time.monotonic()
+            try:
+                with request_timer() as batch_timer:
+                    results = self.run_batch([waiter.item for waiter in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(batch)} requests.")
+                for waiter, result in zip(batch, results):
+                    waiter.value = result
+                failed = False
+            except Exception as e:
+                for waiter in batch:
+                    waiter.error = e
+                failed = True
+            finished_at = time.monotonic()
+            for waiter in batch:
+                waiter.started_at = started_at
+                waiter.phases = dict(batch_timer.phases)
+            with self._lock:
+                self.requests += len(batch)
+                self.batches += 1
+                self.failed_batches += int(failed)
+                self.max_batch_seen = max(self.max_batch_seen, len(batch))
+                self.batch_size_counts[len(batch)] = self.batch_size_counts.get(len(batch), 0) + 1
+                for waiter in batch:
+                    wait_s = started_at - waiter.enqueued_at
+                    self.queue_wait_total_s += wait_s
+                    self.queue_wait_max_s = max(self.queue_wait_max_s, wait_s)
+                self.batch_run_total_s += finished_at - started_at
+            for waiter in batch:
+                waiter.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"max_batch_size": self.max_batch_size, "max_wait_ms": self.max_wait_ms,
+                    "queued": self._queue.qsize(), "requests": self.requests, "batches": self.batches,
+                    "failed_batches": self.failed_batches,
+                    "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+                    "max_batch_size_seen": self.max_batch_seen,
+                    "batch_size_counts": {str(size): n for size, n in sorted(self.batch_size_counts.items())},
+                    "mean_queue_wait_ms": 1000 * self.queue_wait_total_s / self.requests if self.requests else 0.0,
+                    "max_queue_wait_ms": 1000 * self.queue_wait_max_s,
+                    "mean_batch_run_ms": 1000 * self.batch_run_total_s / self.batches if self.batches else 0.0}
+
+
+# Standalone check (food_reco_batcher.py)
+if __name__ == '__main__':
+    seen_batches = []
+
+    def square_all(items):
+        seen_batches.append(len(items))
+        time.sleep(0.01)
+        if -1 in items:
+            raise ValueError("bad item")
+        return [x * x for x in items]
+
+    coalescer = RequestCoalescer(square_all, max_batch_size=8, max_wait_ms=20)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, coalescer.submit(i))) for i in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {i: i * i for i in range(20)}, results
+    assert max(seen_batches) <= 8 and len(seen_batches) < 20, seen_batches
+    start = time.monotonic()
+    assert coalescer.submit(3) == 9 and time.monotonic() - start < 0.2  # A lone request waits at most max_wait_ms
+    try:
+        coalescer.submit(-1)
+        raise AssertionError("Batch error was not raised to the waiter.")
+    except ValueError:
+        pass
+    print(f"Coalescer check passed, batches {seen_batches}: {coalescer.stats()}")
@@ -0,0 +1,190 @@
+# food_reco_cache.py
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import federated_config as config
+from food_timing import note
+
+
+class _Flight:
+    # One in-progress computation that concurrent identical requests wait on.
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RecommendationCache:
+    """In-process LRU + TTL cache of recommendation responses, keyed on the user context.
+
+    Contexts are matched exactly unless quantization is on (RECO_CACHE_QUANTIZE): then numeric
+    values are snapped to the bucket size configured per column, and the quantized context is
+    what gets scored, so every request in a bucket gets the same answer.
+    Entries belong to one model/preprocessor version; set_version() drops them when it changes.
+    Concurrent misses on the same key share one computation (singleflight).
+    """
+
+    def __init__(self, max_entries=None, ttl_seconds=None, numeric_buckets=None, quantize_numeric=None):
+        self.max_entries = config.RECO_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl_seconds = config.RECO_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.numeric_buckets = dict(config.RECO_CACHE_NUMERIC_BUCKETS if numeric_buckets is None else numeric_buckets)
+        self.quantize_numeric = config.RECO_CACHE_QUANTIZE if quantize_numeric is None else quantize_numeric
+        self.version = None
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # Misses that waited on another request's computation
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def set_version(self, version):
+        """Records the current model/preprocessor version; cached entries from another version are dropped."""
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self.version = version
+
+    def quantize(self, user_context):
+        """Copy of the context with bucketed numeric values (exact when the column has no bucket).
+
+        Returns the context unchanged unless quantization is on.
+        """
+        if not (self.enabled and self.quantize_numeric):
+            return user_context
+        quantized = dict(user_context)
+        for col, bucket in self.numeric_buckets.items():
+            value = quantized.get(col)
+            if bucket and isinstance(value, (int, float)) and not isinstance(value, bool):
+                quantized[col] = round(round(value / bucket) * bucket, 6)
+        return quantized
+
+    def make_key(self, quantized_context, *extra, version=None):
+        """Hashable key for the context plus any extra request parts; version defaults to the cache's."""
+        try:
+            context_key = json.dumps(quantized_context, sort_keys=True, ensure_ascii=False)
+        except (TypeError, ValueError):
+            return None  # Not JSON-serialisable (shouldn't happen for request bodies); skip caching
+        return (self.version if version is None else version, context_key) + tuple(json.dumps(e, sort_keys=True) for e in extra)
+
+    def get_or_compute(self, key, compute):
+        """Returns compute()'s value for key, from cache when fresh.
+
+        compute returns (value, cacheable); only cacheable values are stored.
+        """
+        if not self.enabled or key is None:
+            return compute()[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    note('cache', 'hit')
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+        note('cache', 'miss' if leader else 'coalesced')
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        cacheable = False
+        try:
+            value, cacheable = compute()
+            flight.value = value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+                if flight.error is None and cacheable and key[0] == self.version:
+                    self._entries[key] = (time.monotonic() + self.ttl_seconds, flight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            flight.done.set()
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"enabled": self.enabled, "version": self.version, "size": len(self._entries),
+                    "max_entries": self.max_entries, "ttl_seconds": self.ttl_seconds,
+                    "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions, "expirations": self.expirations,
+                    "invalidations": self.invalidations, "quantize_numeric": self.quantize_numeric,
+                    "numeric_buckets": self.numeric_buckets}
+
+
+def cached_response_parts(response):
+    # Flask responses are rebuilt per request from (body, status, mimetype); only 200s are cached.
+    return (response.get_data(), response.status_code, response.mimetype), response.status_code == 200
+
+
+# Standalone check (food_reco_cache.py)
+if __name__ == '__main__':
+    exact = RecommendationCache(max_entries=2, numeric_buckets={'heart_rate_bpm': 5}, quantize_numeric=False)
+    assert exact.quantize({'heart_rate_bpm': 71.4}) == {'heart_rate_bpm': 71.4}  # Default: scored as sent
+
+    cache = RecommendationCache(max_entries=2, ttl_seconds=0.2, numeric_buckets={'heart_rate_bpm': 5},
+                                quantize_numeric=True)
+    cache.set_version(1)
+    calls = []
+
+    def compute(tag):
+        calls.append(tag)
+        time.sleep(0.05)
+        return tag, True
+
+    a = cache.quantize({'age': 30, 'heart_rate_bpm': 71.4})
+    b = cache.quantize({'heart_rate_bpm': 69, 'age': 30})
+    assert a == b == {'age': 30, 'heart_rate_bpm': 70}, (a, b)
+    key = cache.make_key(a, None)
+    threads = [threading.Thread(target=cache.get_or_compute, args=(key, lambda: compute('x'))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == ['x'] and cache.coalesced == 7, (calls, cache.stats())
+    assert cache.get_or_compute(key, lambda: compute('y')) == 'x' and cache.hits == 1
+
+    cache.set_version(2)  # Model updated
+    key_v2 = cache.make_key(a, None)
+    assert cache.get_or_compute(key_v2, lambda: compute('z')) == 'z'
+    time.sleep(0.25)
+    assert cache.get_or_compute(key_v2, lambda: compute('w')) == 'w' and cache.expirations == 1
+
+    def interrupted():
+        raise KeyboardInterrupt
+    try:
+        cache.get_or_compute(cache.make_key({'i': -1}), interrupted)
+    except KeyboardInterrupt:
+        pass  # A BaseException leaves no flight or entry behind
+    assert cache.make_key({'i': -1}) not in cache._entries and not cache._flights
+    for i in range(3):
+        cache.get_or_compute(cache.make_key({'i': i}), lambda: compute(i))
+    assert cache.stats()['size'] == 2 and cache.evictions == 2
+    print(f"Cache check passed: {cache.stats()}")
@@ -0,0 +1,334 @@
+# food_reco_engine.py
+# The one recommendation path: food_server, inference_api, run_inference and Client.recommend_top_restaurants
+# all score and rank through a RecommendationEngine.
+# torch and the modules built on it are imported by the 'torch'/'int8' backends only, so a 'numpy'
+# or 'bundle' engine loads without them.
+import numpy as np
+
+import federated_config as config
+from food_catalog import as_restaurant_catalog
+from food_features import build_candidate_encoder, fill_missing_user_features
+from food_catalog_index import union_of_candidate_rows
+from food_numpy_backend import (build_numpy_scoring_engine, top_k as numpy_top_k,
+                                mask_scores_to_candidates as numpy_mask_scores_to_candidates)
+from food_serving_bundle import build_bundle_scoring_engine
+from food_timing import timed
+
+BACKENDS = ('torch', 'int8', 'numpy', 'bundle')
+NUMPY_BACKENDS = ('numpy', 'bundle')  # Served by a NumpyScoringEngine, without a model or preprocessor
+
+
+def default_backend():
+    # RECO_INT8_QUANTIZATION upgrades the torch backend to int8, as it did before backends were pluggable
+    if config.RECO_INFERENCE_BACKEND == 'torch' and config.RECO_INT8_QUANTIZATION:
+        return 'int8'
+    return config.RECO_INFERENCE_BACKEND
+
+
+def infer_input_dim(state_dict):
+    return state_dict['fc1.weight'].shape[1] if 'fc1.weight' in state_dict else -1
+
+
+def load_reco_model(state_dict, input_dim=None):
+    """FoodPreferenceModel in eval mode from a state dict; strict, so every caller loads weights the same way."""
+    from food_model import FoodPreferenceModel
+    input_dim = infer_input_dim(state_dict) if input_dim is None or input_dim <= 0 else input_dim
+    if input_dim <= 0:
+        raise ValueError("Could not infer input_dim from the model state_dict.")
+    model = FoodPreferenceModel(input_dim=input_dim)
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+
+def _catalog_rows(top_indices, scored_rows):
+    top_indices = top_indices.tolist() if hasattr(top_indices, 'tolist') else list(top_indices)
+    if scored_rows is None:
+        return top_indices
+    return [int(scored_rows[i]) for i in top_indices]
+
+
+class RecommendationEngine:
+    """Catalog, encoded restaurant features, model snapshot and top-k for every recommendation caller.
+
+    catalog: a RestaurantCatalog (or a catalog DataFrame, converted once here).
+
+    backend: 'torch' (factorized fc1 over the model from prepare_serving_model, or the eager model with
+    serving=False), 'int8' (dynamic int8 model if it passes the top-k overlap gate, else 'torch') or
+    'numpy' (NumpyScoringEngine over an exported bundle; no model or preprocessor needed) or 'bundle'
+    (the same over a memory-mapped serving bundle, which also holds the encoded catalog).
+    Optional extras for whole-catalog requests: sharded process-pool scoring and two-tower retrieval,
+    each still gated by its config flag. An engine isn't changed after construction: new weights
+    mean a new engine (with_model), so a request holding the old one sees consistent state. The
+    shard worker pool is the exception that outlives engines: with_model pushes the new weights to it.
+    """
+
+    def __init__(self, catalog, preprocessor=None, model=None, backend=None, serving=True,
+                 source_model_path=None, bundle_path=None, candidate_encoder=None,
+                 sharded=False, retrieval=False, catalog_path=None, log_prefix=""):
+        self.catalog = as_restaurant_catalog(catalog)
+        self.preprocessor = preprocessor
+        self.model = model.eval() if model is not None else None
+        self.backend = default_backend() if backend is None else backend
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{self.backend}'; expected one of {BACKENDS}.")
+        self.serving = serving
+        self.sharded = sharded
+        self.log_prefix = log_prefix
+        self.candidate_encoder = None
+        self.serving_model = None
+        self.scoring_engine = None  # Factorized fc1 cache (W_r·X_restaurants) for the torch backends
+        self.numpy_engine = None
+        self.sharded_pool = None  # ShardedScoringPool, shared by every engine with_model derives from this one
+        self.sharded_engine = None
+        self.retriever = None
+
+        if self.backend == 'numpy':
+            bundle_path = config.NUMPY_BUNDLE_SAVE_PATH if bundle_path is None else bundle_path
+            self.numpy_engine = build_numpy_scoring_engine(bundle_path, self.catalog.feature_frame(), log_prefix)
+        elif self.backend == 'bundle':
+            # catalog_path (the CSV the catalog was loaded from) lets a stale bundle be refused
+            bundle_path = config.SERVING_BUNDLE_SAVE_PATH if bundle_path is None else bundle_path
+            self.numpy_engine = build_bundle_scoring_engine(bundle_path, self.catalog.restaurant_ids, catalog_path,
+                                                            log_prefix)
+        if self.backend in NUMPY_BACKENDS:
+            if self.numpy_engine is None:
+                raise RuntimeError(f"{self.backend} backend selected but {bundle_path} is unusable.")
+            self.input_dim = self.numpy_engine.num_features
+            return
+
+        if self.model is None or preprocessor is None:
+            raise ValueError(f"The '{self.backend}' backend needs a model and a preprocessor.")
+        from food_model import fold_batchnorm
+        from food_scoring import build_scoring_engine
+        from food_serving_model import prepare_serving_model
+        self.input_dim = self.model.fc1.in_features
+        # Restaurant-side features are encoded once per catalog + preprocessor; requests only encode the user row
+        self.candidate_encoder = candidate_encoder if candidate_encoder is not None else \
+            build_candidate_encoder(preprocessor, self.catalog.feature_frame(), log_prefix)
+        if self.backend == 'int8':
+            from food_quantization import quantized_serving_model
+            self.serving_model = quantized_serving_model(fold_batchnorm(self.model), self.candidate_encoder, log_prefix)
+            if self.serving_model is None:
+                print(f"{log_prefix}Serving fp32 model.")
+        if self.serving_model is None:
+            self.serving_model = prepare_serving_model(self.model, self.candidate_encoder, log_prefix,
+                                                       source_model_path) if serving else self.model
+        self.scoring_engine = build_scoring_engine(self.serving_model, self.candidate_encoder, log_prefix)
+        if self.scoring_engine is not None and self.scoring_engine.num_features != self.input_dim:
+            self.scoring_engine = None  # Falls back to the full transform, which reports the mismatch
+        if sharded is True:
+            from food_sharded_scoring import build_sharded_scoring_pool
+            self.sharded_pool = build_sharded_scoring_pool(self.candidate_encoder, log_prefix)
+        elif sharded:
+            self.sharded_pool = sharded  # Reused from the previous engine; only the weights are sent
+        if self.sharded_pool is not None and self.scoring_engine is not None:
+            try:
+                self.sharded_engine = self.sharded_pool.load_model(self.scoring_engine)
+            except Exception as e:
+                print(f"{log_prefix}Sharded scoring unavailable for this model ({e}). Scoring in process.")
+        if retrieval is True:
+            from food_retrieval import build_candidate_retriever
+            self.retriever = build_candidate_retriever(self.candidate_encoder, log_prefix)
+        elif retrieval:
+            self.retriever = retrieval  # Reused from the previous engine; it depends on the catalog, not the weights
+
+    @property
+    def ready(self):
+        return self.numpy_engine is not None or self.model is not None
+
+    @property
+    def serving_model_name(self):
+        if self.backend == 'bundle':
+            return f"numpy (serving bundle {self.numpy_engine.bundle.version})"
+        if self.numpy_engine is not None:
+            return "numpy"
+        return type(self.serving_model).__name__ if self.scoring_engine is not None else "full transform fallback"
+
+    def with_model(self, model, source_model_path=None):
+        """Engine for new weights over the same catalog and preprocessor, reusing the catalog encoding."""
+        if self.backend in NUMPY_BACKENDS:
+            raise ValueError(f"The {self.backend} backend is built from an exported bundle, not model weights.")
+        return RecommendationEngine(self.catalog, self.preprocessor, model, self.backend, self.serving,
+                                    source_model_path, candidate_encoder=self.candidate_encoder,
+                                    sharded=self.sharded_pool or self.sharded, retrieval=self.retriever or False,
+                                    log_prefix=self.log_prefix)
+
+    def close(self):
+        # Stops the sharded scoring workers, for every engine sharing them (at shutdown); requests already
+        # holding such an engine fall back to in-process scoring
+        if self.sharded_pool is not None:
+            self.sharded_pool.close()
+
+    def fill_missing_features(self, user_context):
+        """Defaults absent user-side columns in place; returns the defaulted column names."""
+        return fill_missing_user_features(user_context, self.catalog)
+
+    def high_pref_scores(self, user_contexts, rows=None):
+        """(B, N) high-preference probabilities over the catalog (N = len(rows) when rows are given).
+
+        A tensor, or an ndarray on the numpy backend.
+        """
+        if self.numpy_engine is not None:
+            return self.numpy_engine.high_pref_scores(user_contexts, rows=rows)
+        from food_scoring import high_pref_scores_for_contexts
+        # feature_frame is passed uncalled: only the fallback without the factorized engine builds it
+        scores, _ = high_pref_scores_for_contexts(self.scoring_engine, self.model, self.preprocessor,
+                                                  self.catalog.feature_frame, user_contexts, rows=rows)
+        return scores
+
+    def top_k_batch(self, user_contexts, top_ns, rows_per_entry=None, excluded_per_entry=None):
+        """Per context (top_scores, catalog_rows), best first, scored as one users x restaurants pass.
+
+        rows_per_entry: optional candidate catalog rows per context (None = whole catalog, which goes
+        through retrieval or the sharded workers when those are enabled). excluded_per_entry: optional
+        boolean catalog mask per context of restaurants never to return (see excluded_rows_mask); they
+        are dropped from the candidates before scoring (an unfiltered context's candidates become the
+        rest of the catalog; the sharded workers skip them the same way).
+        Contexts should already be complete (fill_missing_features); an entry may get fewer than top_n results.
+        """
+        rows_per_entry = [None] * len(user_contexts) if rows_per_entry is None else list(rows_per_entry)
+        excluded_per_entry = [None] * len(user_contexts) if excluded_per_entry is None else list(excluded_per_entry)
+        unfiltered = [i for i, rows in enumerate(rows_per_entry) if rows is None]
+        if unfiltered and self.retriever is not None:
+            # Encoding records its own features / preprocess phases, so it stays outside 'retrieval'
+            user_vectors = self.candidate_encoder.encode_users([user_contexts[i] for i in unfiltered])
+            with timed('retrieval'):
+                retrieved = self.retriever.candidate_rows_for_user_vectors(user_vectors)
+            for i, rows in zip(unfiltered, retrieved):
+                rows_per_entry[i] = rows  # The model re-ranks only these
+        if self.sharded_engine is not None and all(rows is None for rows in rows_per_entry):
+            try:
+                user_vectors = self.candidate_encoder.encode_users(user_contexts)
+                with timed('sharded'):  # Forward pass and top-k, in the shard workers
+                    top_scores, top_rows = self.sharded_engine.top_k_for_user_vectors(
+                        user_vectors, max(top_ns), excluded_per_entry)
+                results = []
+                for scores, rows, top_n in zip(top_scores, top_rows, top_ns):
+                    finite = scores[:top_n].isfinite()  # Restaurants excluded for this context come back as -inf
+                    results.append((scores[:top_n][finite], rows[:top_n][finite].tolist()))
+                return results
+            except Exception as e:
+                print(f"{self.log_prefix}Sharded scoring failed ({e}). Scoring in process.")
+        for i, (rows, excluded) in enumerate(zip(rows_per_entry, excluded_per_entry)):
+            if excluded is None:
+                continue
+            if rows is None:
+                rows_per_entry[i] = np.flatnonzero(~excluded)  # Only the restaurants left are scored
+            else:
+                rows = np.asarray(rows, dtype=np.intp)
+                rows_per_entry[i] = rows[~excluded[rows]]
+        scored_rows = union_of_candidate_rows(rows_per_entry)
+        if scored_rows is not None and len(scored_rows) == 0:
+            return [(np.empty(0, dtype=np.float32), []) for _ in user_contexts]
+
+        if self.numpy_engine is not None:
+            scores = self.high_pref_scores(user_contexts, rows=scored_rows)
+            with timed('topk'):
+                scores = numpy_mask_scores_to_candidates(scores, scored_rows, rows_per_entry)
+                top_per_entry = [numpy_top_k(row, top_n) for row, top_n in zip(scores, top_ns)]
+        else:
+            from food_scoring import batched_top_k, mask_scores_to_candidates
+            scores = self.high_pref_scores(user_contexts, rows=scored_rows)
+            with timed('topk'):
+                scores = mask_scores_to_candidates(scores, scored_rows, rows_per_entry)
+                top_per_entry = batched_top_k(scores, top_ns)
+        return [(top_scores, _catalog_rows(top_indices, scored_rows)) for top_scores, top_indices in top_per_entry]
+
+    def top_k(self, user_context, k=20, rows=None, excluded=None):
+        """(top_scores, catalog_rows) for one complete user context."""
+        return self.top_k_batch([user_context], [k], [rows], [excluded])[0]
+
+    def top_k_per_group(self, user_context, k, group_segments, rows=None, excluded=None):
+        """[(group label, top_scores, catalog_rows)] for one complete user context: k per group of
+        group_segments (a CatalogIndex GroupSegments), best group first.
+
+        One scoring pass over the catalog (or the candidate rows), in process: every group needs its
+        own candidates, so retrieval and the sharded workers are not used. excluded: as in top_k_batch.
+        """
+        if excluded is not None:  # Excluded restaurants are not scored
+            rows = np.flatnonzero(~excluded) if rows is None else rows[~excluded[rows]]
+        scores = self.high_pref_scores([user_context], rows=rows)[0]
+        scores = np.asarray(scores.numpy() if hasattr(scores, 'numpy') else scores, dtype=np.float32)
+        with timed('topk'):
+            if rows is not None:
+                catalog_scores = np.full(len(self.catalog), -np.inf, dtype=np.float32)
+                catalog_scores[rows] = scores
+                scores = catalog_scores
+            return group_segments.top_k(scores, k)
+
+    def recommendations_frame(self, user_context, top_n=20):
+        """(catalog DataFrame of the top_n restaurants with a 'recommendation_score' column, scores list)."""
+        user_context = dict(user_context)
+        self.fill_missing_features(user_context)
+        top_scores, rows = self.top_k(user_context, top_n)
+        scores = [float(score) for score in top_scores]
+        recommendations_df = self.catalog.records_frame(rows)
+        recommendations_df['recommendation_score'] = scores
+        return recommendations_df, scores
+
+
+def top_k_for_requests(requests, top_n):
+    """(top_scores, catalog_rows) for queued single requests, (engine, user_context, candidate_rows, excluded) each.
+
+    Requests that captured the same engine are scored as one batch; a model swap can leave two engines in one queue.
+    """
+    results = [None] * len(requests)
+    by_engine = {}
+    for i, (engine, _, _, _) in enumerate(requests):
+        by_engine.setdefault(engine, []).append(i)
+    for engine, indices in by_engine.items():
+        for i, result in zip(indices, engine.top_k_batch([requests[i][1] for i in indices], [top_n] * len(indices),
+                                                         [requests[i][2] for i in indices],
+                                                         [requests[i][3] for i in indices])):
+            results[i] = result
+    return results
+
+
+# Standalone check (food_reco_engine.py)
+if __name__ == '__main__':
+    import joblib
+    import pandas as pd
+    import torch
+    from food_model import FoodPreferenceModel
+    from food_data_generator import load_csv_to_dataframe
+    from food_catalog import RestaurantCatalog
+    from food_catalog_index import build_catalog_index
+
+    restaurants_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
+    restaurants_df.rename(columns={'id': 'restaurant_id', 'rating': 'rating_biz'}, inplace=True)
+    catalog = RestaurantCatalog(restaurants_df)
+    preprocessor = joblib.load(config.PREPROCESSOR_SAVE_PATH)
+    encoder = build_candidate_encoder(preprocessor, catalog.feature_frame())
+    torch.manual_seed(0)  # Random-init weights give unsaturated scores, so ranking differences would show
+    model = FoodPreferenceModel(input_dim=encoder.num_features)
+    with torch.no_grad():
+        model.bn1.running_mean.uniform_(-0.5, 0.5); model.bn1.running_var.uniform_(0.5, 2.0)
+    model.eval()
+    eager = RecommendationEngine(catalog, preprocessor, model, serving=False, candidate_encoder=encoder)
+    assert eager.backend == 'torch' and eager.with_model(model).candidate_encoder is encoder
+    served = RecommendationEngine(catalog, preprocessor, model, backend='torch', candidate_encoder=encoder)
+    fallback = RecommendationEngine(catalog, preprocessor, model, serving=False, candidate_encoder=encoder)
+    fallback.scoring_engine = None  # Full transform per request
+
+    user_context = {'gender': '女', 'age': 31, 'daily_food_budget_cny': 120, 'heart_rate_bpm': 72}
+    eager.fill_missing_features(user_context)
+    cuisine_rows = build_catalog_index(catalog).rows_for_filters({'cuisine': ['川菜']})[0]
+    for rows in (None, cuisine_rows):
+        reference_scores, reference_rows = fallback.top_k(user_context, 20, rows=rows)
+        for name, engine in (("eager factorized", eager), ("served", served)):
+            scores, top_rows = engine.top_k(user_context, 20, rows=rows)
+            torch.testing.assert_close(scores, reference_scores, rtol=1e-4, atol=1e-5)
+            assert set(top_rows) == set(reference_rows), f"{name}: top-20 differs from the full transform."
+    frame, scores = served.recommendations_frame(user_context, 10)
+    assert len(frame) == 10 and frame['recommendation_score'].tolist() == scores
+    pd.testing.assert_frame_equal(frame.drop(columns='recommendation_score'), restaurants_df.iloc[
+        served.top_k(user_context, 10)[1]].reset_index(drop=True), check_dtype=False)
+    batch = served.top_k_batch([user_context, dict(user_context, age=60)], [5, 10], [cuisine_rows, None])
+    assert [len(rows) for _, rows in batch] == [5, 10] and set(batch[0][1]) <= set(cuisine_rows.tolist())
+    excluded = np.zeros(len(catalog), dtype=bool)
+    excluded[served.top_k(user_context, 5, rows=cuisine_rows)[1] + served.top_k(user_context, 5)[1]] = True
+    for rows in (None, cuisine_rows):
+        for engine in (served, fallback):
+            assert not excluded[engine.top_k(user_context, 20, rows=rows, excluded=excluded)[1]].any()
+    print(f"Engine check passed ({served.serving_model_name}): factorized and served top-20 match the full "
+          f"transform, with and without filters; top frame: {frame['name'].head(3).tolist()}")
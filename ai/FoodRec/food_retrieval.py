@@ -0,0 +1,286 @@
+# food_retrieval.py
+# Optional candidate retrieval in front of the reco model: a two-tower model embeds users and restaurants,
+# an inverted-file (IVF) index over the restaurant embeddings returns a few hundred candidates, and the
+# FoodPreferenceModel re-ranks only those. Train and save with 'python food_retrieval.py'.
+# The towers are distilled from the reco model (its scores over the catalog for user contexts drawn from
+# the review data), not fitted to the review ratings directly: the reviews label too few (user, restaurant)
+# pairs to rank the whole catalog, and the retrieval stage only has to keep the re-ranker's top-k.
+# retrieval_recall measures that, as recall@k against exhaustive scoring with the reco model.
+import math
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+import federated_config as config
+
+
+class TwoTowerModel(nn.Module):
+    """User and restaurant towers over the encoder's user-owned / restaurant-owned columns; score = dot product."""
+
+    def __init__(self, user_dim, restaurant_dim, embed_dim=None, hidden_dim=None):
+        super(TwoTowerModel, self).__init__()
+        self.embed_dim = config.RETRIEVAL_EMBED_DIM if embed_dim is None else embed_dim
+        self.hidden_dim = config.HIDDEN_DIM if hidden_dim is None else hidden_dim
+        self.user_tower = nn.Sequential(
+            nn.Linear(user_dim, self.hidden_dim), nn.ReLU(), nn.Linear(self.hidden_dim, self.embed_dim))
+        self.restaurant_tower = nn.Sequential(
+            nn.Linear(restaurant_dim, self.hidden_dim), nn.ReLU(), nn.Linear(self.hidden_dim, self.embed_dim))
+
+    def embed_users(self, user_vectors):
+        return self.user_tower(user_vectors)
+
+    def embed_restaurants(self, restaurant_vectors):
+        return self.restaurant_tower(restaurant_vectors)
+
+
+class IVFIndex:
+    """Inverted-file index for maximum inner product search over restaurant embeddings.
+
+    Embeddings are clustered with k-means into num_lists lists (default ~sqrt(N)); a query scans the
+    lists with the highest centroid·query until at least num_probes lists and k rows are covered,
+    so the work per query grows with sqrt(N) instead of N.
+    """
+
+    def __init__(self, embeddings, num_lists=None, num_probes=None, seed=0):
+        from sklearn.cluster import MiniBatchKMeans
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        num_rows = len(embeddings)
+        self.num_lists = max(1, min(num_rows, num_lists or int(round(math.sqrt(num_rows)))))
+        self.num_probes = config.RECO_RETRIEVAL_NUM_PROBES if num_probes is None else num_probes
+        kmeans = MiniBatchKMeans(n_clusters=self.num_lists, random_state=seed, n_init=3,
+                                 batch_size=min(num_rows, 8192)).fit(embeddings)
+        assignment = kmeans.labels_
+        self.centroids = kmeans.cluster_centers_.astype(np.float32)
+        # Rows of each list are stored contiguously: list l is rows[offsets[l]:offsets[l + 1]]
+        self.rows = np.argsort(assignment, kind='stable').astype(np.intp)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=self.num_lists))])
+        self.embeddings = np.ascontiguousarray(embeddings[self.rows])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, query, k):
+        """Catalog rows of the (approximately) k highest query·embedding restaurants, best first."""
+        query = np.asarray(query, dtype=np.float32)
+        list_order = np.argsort(-(self.centroids @ query))
+        spans, covered = [], 0
+        for probe, lst in enumerate(list_order):
+            if probe >= self.num_probes and covered >= k:
+                break
+            start, stop = self.offsets[lst], self.offsets[lst + 1]
+            spans.append(np.arange(start, stop))
+            covered += stop - start
+        positions = np.concatenate(spans)
+        scores = self.embeddings[positions] @ query
+        k = min(k, len(positions))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return self.rows[positions[top[np.argsort(-scores[top])]]]
+
+
+class CandidateRetriever:
+    """Two-tower embeddings of the encoder's catalog in an IVFIndex; candidate_rows() feeds the re-ranker."""
+
+    def __init__(self, tower_model, candidate_encoder, num_candidates=None, num_lists=None, num_probes=None):
+        self.tower_model = tower_model.eval()
+        self.candidate_encoder = candidate_encoder
+        self.num_candidates = config.RECO_RETRIEVAL_CANDIDATES if num_candidates is None else num_candidates
+        with torch.no_grad():
+            restaurant_embeddings = tower_model.embed_restaurants(
+                torch.from_numpy(candidate_encoder.restaurant_block)).numpy()
+        self.index = IVFIndex(restaurant_embeddings, num_lists, num_probes)
+
+    def candidate_rows_for_user_vectors(self, user_vectors, num_candidates=None):
+        num_candidates = self.num_candidates if num_candidates is None else num_candidates
+        with torch.no_grad():
+            queries = self.tower_model.embed_users(torch.as_tensor(user_vectors, dtype=torch.float32)).numpy()
+        # Sorted, like CatalogIndex rows, so the re-ranker scores them in catalog order
+        return [np.sort(self.index.search(query, num_candidates)) for query in queries]
+
+    def candidate_rows(self, user_context_dict, num_candidates=None):
+        """Sorted catalog rows of the retrieved candidates for one user context."""
+        return self.candidate_rows_for_user_vectors(
+            self.candidate_encoder.encode_users([user_context_dict]), num_candidates)[0]
+
+
+def review_user_contexts(review_dfs, count, seed=0):
+    """User contexts from the review data: the review rows, then column-wise resamples of them up to count.
+
+    Resampled contexts leave a random share of their columns at the request defaults
+    (see fill_missing_user_features), since API callers often send only part of the profile.
+    """
+    import pandas as pd
+    reviews_df = pd.concat(review_dfs, ignore_index=True)
+    user_cols = [col for col in config.CATEGORY_COLS + config.NUMERIC_COLS if col in reviews_df.columns]
+    reviews_df = reviews_df[user_cols]
+    rng = np.random.default_rng(seed)
+    contexts = reviews_df.to_dict('records')
+    while len(contexts) < count:
+        picks = rng.integers(0, len(reviews_df), size=len(user_cols))
+        defaulted = rng.random(len(user_cols)) < rng.random()
+        contexts.append({col: ("Unknown" if col in config.CATEGORY_COLS else 0.0) if default else reviews_df[col].iat[i]
+                         for col, i, default in zip(user_cols, picks, defaulted)})
+    return contexts[:count]
+
+
+def _teacher_log_odds(engine, user_vectors):
+    # High-preference log-odds of the reco model over the whole catalog, (B, N)
+    logits = engine.logits_for_user_vectors(user_vectors)
+    log_probs = torch.log_softmax(logits, dim=-1)
+    return log_probs[..., 2] - torch.logsumexp(log_probs[..., :2], dim=-1)
+
+
+def train_two_tower(engine, user_contexts, epochs=None, list_size=512, teacher_top=128, batch_size=64,
+                    learning_rate=0.003, temperature=0.2, seed=0, log_prefix=""):
+    """Distils the reco model behind engine (a FactorizedScoringEngine) into a TwoTowerModel.
+
+    Per user context the towers see a list of the teacher's top teacher_top restaurants plus random
+    ones (list_size in total) and are trained with a listwise softmax loss against the teacher's
+    high-preference log-odds (standardized per user, divided by temperature), so the dot product
+    ranks restaurants like the reco model.
+    """
+    epochs = config.RETRIEVAL_TRAIN_EPOCHS if epochs is None else epochs
+    encoder = engine.candidate_encoder
+    torch.manual_seed(seed)
+    generator = torch.Generator().manual_seed(seed)
+    user_vectors = torch.from_numpy(encoder.encode_users(user_contexts))
+    restaurant_vectors = torch.from_numpy(encoder.restaurant_block)
+    num_restaurants = len(restaurant_vectors)
+    with torch.no_grad():
+        teacher = torch.cat([_teacher_log_odds(engine, user_vectors[i:i + 256])
+                             for i in range(0, len(user_vectors), 256)])
+        # Raw log-odds differ little across restaurants; standardize so the targets aren't near-uniform
+        teacher = (teacher - teacher.mean(dim=1, keepdim=True)) / (teacher.std(dim=1, keepdim=True) + 1e-6)
+    teacher_top = min(teacher_top, num_restaurants)
+    list_size = min(list_size, num_restaurants)
+    top_rows = torch.topk(teacher, k=teacher_top, dim=1).indices
+    model = TwoTowerModel(user_vectors.shape[1], restaurant_vectors.shape[1])
+    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+    for epoch in range(epochs):
+        permutation = torch.randperm(len(user_vectors), generator=generator)
+        total_loss = 0.0
+        for start in range(0, len(permutation), batch_size):
+            users = permutation[start:start + batch_size]
+            random_rows = torch.randint(0, num_restaurants, (len(users), list_size - teacher_top), generator=generator)
+            rows = torch.cat([top_rows[users], random_rows], dim=1)  # (b, list_size)
+            user_embeddings = model.embed_users(user_vectors[users])
+            restaurant_embeddings = model.embed_restaurants(restaurant_vectors[rows.reshape(-1)]).reshape(
+                len(users), list_size, -1)
+            student = torch.einsum('bd,bld->bl', user_embeddings, restaurant_embeddings)
+            target = torch.softmax(torch.gather(teacher[users], 1, rows) / temperature, dim=1)
+            loss = -(target * torch.log_softmax(student, dim=1)).sum(dim=1).mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item() * len(users)
+        if epoch == 0 or (epoch + 1) % 10 == 0 or epoch + 1 == epochs:
+            print(f"{log_prefix}Two-tower epoch {epoch + 1}/{epochs}: listwise loss {total_loss / len(permutation):.4f}")
+    return model.eval()
+
+
+def retrieval_recall(engine, retriever, user_contexts, k=20, other_ks=(10, 50)):
+    """Mean |top-k(re-ranked retrieval) ∩ top-k(exhaustive)| / k, plus per-query timings of both paths.
+
+    Exhaustive scoring is the reco model over the whole catalog, the ranking the towers were distilled
+    from. recall_at_k is for k; recall_by_k also has other_ks (timings are for the largest of them).
+    """
+    encoder = engine.candidate_encoder
+    ks = sorted({k, *other_ks})
+    recalls, exhaustive_s, retrieval_s = {kk: [] for kk in ks}, [], []
+    for user_context in user_contexts:
+        user_vector = encoder.encode_users([user_context])
+        start = time.perf_counter()
+        scores = torch.softmax(engine.logits_for_user_vectors(user_vector)[0], dim=-1)[:, 2]
+        exhaustive = torch.topk(scores, k=min(ks[-1], len(scores))).indices.tolist()
+        exhaustive_s.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        rows = retriever.candidate_rows_for_user_vectors(user_vector)[0]
+        scores = torch.softmax(engine.logits_for_user_vectors(user_vector, rows=rows)[0], dim=-1)[:, 2]
+        retrieved = [int(rows[i]) for i in torch.topk(scores, k=min(ks[-1], len(scores))).indices.tolist()]
+        retrieval_s.append(time.perf_counter() - start)
+        for kk in ks:
+            recalls[kk].append(len(set(exhaustive[:kk]) & set(retrieved[:kk])) / max(len(exhaustive[:kk]), 1))
+    return {"recall_at_k": float(np.mean(recalls[k])), "k": k,
+            "recall_by_k": {kk: float(np.mean(values)) for kk, values in recalls.items()},
+            "teacher": "reco model (distilled)", "num_candidates": retriever.num_candidates,
+            "num_lists": retriever.index.num_lists, "num_probes": retriever.index.num_probes,
+            "exhaustive_p50_ms": 1000 * float(np.median(exhaustive_s)),
+            "retrieval_p50_ms": 1000 * float(np.median(retrieval_s))}
+
+
+def save_two_tower(model, path, report=None):
+    torch.save({"state_dict": model.state_dict(), "embed_dim": model.embed_dim, "hidden_dim": model.hidden_dim,
+                "user_dim": model.user_tower[0].in_features,
+                "restaurant_dim": model.restaurant_tower[0].in_features, "report": report or {}}, path)
+
+
+def load_two_tower(path):
+    checkpoint = torch.load(path, map_location='cpu')
+    model = TwoTowerModel(checkpoint['user_dim'], checkpoint['restaurant_dim'],
+                          checkpoint['embed_dim'], checkpoint['hidden_dim'])
+    model.load_state_dict(checkpoint['state_dict'])
+    return model.eval(), checkpoint.get('report', {})
+
+
+def build_candidate_retriever(candidate_encoder, log_prefix="", path=None):
+    """Returns a CandidateRetriever when RECO_RETRIEVAL_ENABLED and a trained two-tower model exists, else None."""
+    if not config.RECO_RETRIEVAL_ENABLED or candidate_encoder is None:
+        return None
+    path = config.RETRIEVAL_MODEL_SAVE_PATH if path is None else path
+    try:
+        tower_model, report = load_two_tower(path)
+        if tower_model.user_tower[0].in_features != len(candidate_encoder.user_out_idx) or \
+                tower_model.restaurant_tower[0].in_features != len(candidate_encoder.restaurant_out_idx):
+            raise ValueError("tower input sizes don't match the preprocessor")
+        retriever = CandidateRetriever(tower_model, candidate_encoder)
+    except Exception as e:
+        print(f"{log_prefix}Candidate retrieval disabled ({e}). Train it with 'python food_retrieval.py'.")
+        return None
+    print(f"{log_prefix}Candidate retrieval ready: {retriever.num_candidates} of {len(retriever.index)} restaurants "
+          f"per request from {retriever.index.num_lists} IVF lists (towers distilled from the reco model; "
+          f"recall@{report.get('k', '?')} vs exhaustive scoring {report.get('recall_at_k', float('nan')):.3f}).")
+    return retriever
+
+
+# Distils the retrieval towers from the current global model and saves them (food_retrieval.py)
+if __name__ == '__main__':
+    import argparse
+    import joblib
+    from food_model import FoodPreferenceModel
+    from food_data_generator import get_shanghai_data_for_simulation
+    from food_features import PrecomputedCandidateEncoder
+    from food_scoring import FactorizedScoringEngine
+
+    parser = argparse.ArgumentParser(description="Distil the two-tower retrieval model from the reco model "
+                                                 "and report its recall against exhaustive scoring.")
+    parser.add_argument('--contexts', type=int, default=4096, help="Training user contexts drawn from the reviews.")
+    parser.add_argument('--epochs', type=int, default=None)
+    parser.add_argument('--random-teacher', action='store_true',
+                        help="Distil a random-init reco model instead (checks the pipeline when the "
+                             "global model's scores saturate); nothing is saved.")
+    args = parser.parse_args()
+
+    review_dfs, restaurants_df = get_shanghai_data_for_simulation()
+    encoder = PrecomputedCandidateEncoder(joblib.load(config.PREPROCESSOR_SAVE_PATH), restaurants_df)
+    torch.manual_seed(0)  # Same random-init teacher on every --random-teacher run
+    teacher_model = FoodPreferenceModel(input_dim=encoder.num_features)
+    if args.random_teacher:
+        with torch.no_grad():
+            teacher_model.bn1.running_mean.uniform_(-0.5, 0.5); teacher_model.bn1.running_var.uniform_(0.5, 2.0)
+    else:
+        teacher_model.load_state_dict(torch.load(config.GLOBAL_MODEL_SAVE_PATH, map_location='cpu'))
+    engine = FactorizedScoringEngine(teacher_model.eval(), encoder)
+    contexts = review_user_contexts(review_dfs, args.contexts + 200)
+    tower_model = train_two_tower(engine, contexts[:args.contexts], args.epochs, log_prefix="Retrieval: ")
+    retriever = CandidateRetriever(tower_model, encoder)
+    report = retrieval_recall(engine, retriever, contexts[args.contexts:])  # Held-out contexts
+    print(f"Retrieval: recall@{report['k']} vs exhaustive scoring {report['recall_at_k']:.3f} with "
+          f"{report['num_candidates']} candidates; p50 exhaustive {report['exhaustive_p50_ms']:.2f}ms, "
+          f"retrieve + re-rank {report['retrieval_p50_ms']:.2f}ms ({len(encoder.restaurant_ids_order)} restaurants).")
+    print("Retrieval: recall vs exhaustive scoring by k: "
+          + ", ".join(f"@{k} {recall:.3f}" for k, recall in report['recall_by_k'].items()))
+    if not args.random_teacher:
+        save_two_tower(tower_model, config.RETRIEVAL_MODEL_SAVE_PATH, report)
+        print(f"Retrieval: two-tower model saved to {config.RETRIEVAL_MODEL_SAVE_PATH}.")
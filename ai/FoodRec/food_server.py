@@ -20,6 +20,17 @@ import traceback  # For printing tracebacks
 import federated_config as config
 from food_model import FoodPreferenceModel, weights_to_json_serializable, weights_from_json_serializable
 from food_data_generator import load_csv_to_dataframe, get_shanghai_data_for_simulation
+from food_features import transform_recommendation_frame, build_candidate_encoder, parse_batch_entries
+from food_reco_output import (RecommendationRecordStore, recommendations_response, batch_recommendations_response,
+                              grouped_recommendations_response, with_server_timing)
+from food_catalog import RestaurantCatalog
+from food_catalog_index import (build_catalog_index, pop_filter_rows, pop_batch_filter_rows, excluded_rows_mask,
+                                parse_group_args)
+from food_reco_cache import RecommendationCache, cached_response_parts
+from food_reco_batcher import RequestCoalescer
+from food_reco_engine import RecommendationEngine, load_reco_model, top_k_for_requests
+from food_timing import timed
+from food_metrics import RouteMetrics, install_route_metrics, stats_collector
 
 # --- Import Client and its dependencies ---
 # The ReviewDataset and preprocessor functions are defined within food_client now,
@@ -36,10 +47,28 @@ fl_client_updates = []
 fl_connected_clients_this_round = set()
 fl_current_round_server = 0
 
-api_all_restaurants_df = None
+api_catalog = None  # RestaurantCatalog shared by the engine, the index, the record store and Client instances
 api_preprocessor = None  # Global preprocessor for API use
 api_input_dim = -1      # Global input_dim for API use
-reco_inference_model = None
+api_candidate_encoder = None  # Restaurant-side feature block, encoded once at load time
+reco_engine = None  # RecommendationEngine for the current reco model; replaced (not mutated) on model change
+api_catalog_index = None  # adname/cuisine/business_area -> rows, sorted cost; for request "filters"
+api_record_store = None  # Response records from the catalog's display store
+reco_model_version = 0  # Bumped whenever the reco model or candidate encoder changes
+reco_result_cache = RecommendationCache()  # /recommend responses for the current reco_model_version
+# Concurrent /recommend scoring, one batched pass per RECO_COALESCE_MAX_WAIT_MS (if RECO_COALESCE_ENABLED)
+reco_coalescer = RequestCoalescer(lambda requests: top_k_for_requests(requests, config.RECO_TOP_N),
+                                  name="reco-coalescer")
+# Per-route counts, latency and payload histograms for every endpoint, scraped from /metrics
+route_metrics = RouteMetrics('food_server_')
+route_metrics.add_collector(lambda: stats_collector('reco_cache', reco_result_cache.stats(), "/recommend result cache"))
+route_metrics.add_collector(lambda: stats_collector('reco_coalescer', reco_coalescer.stats(), "/recommend coalescer"))
+route_metrics.add_collector(lambda: [
+    ('reco_model_version', 'gauge', "Version of the served recommendation model.", [({}, reco_model_version)]),
+    ('fl_pending_client_updates', 'gauge', "Client updates received for the current FL round.",
+     [({}, len(fl_client_updates))])])
+if config.METRICS_ENABLED:
+    install_route_metrics(app, route_metrics)
 
 # === Preprocessing Logic (Server's version for APIs) ===
 # This create_api_preprocessor will be used to initialize api_preprocessor.
@@ -66,35 +95,8 @@ def create_api_preprocessor_server():
 
 
 def process_features_for_api_recommendation(preprocessor, user_context_dict, all_restaurants_df_orig):
-    if all_restaurants_df_orig.empty:
-        return torch.empty(0), [], 0
-    all_restaurants_df = all_restaurants_df_orig.copy()
-    inference_df_list = []
-    restaurant_ids_order = []
-    user_base_df = pd.DataFrame([user_context_dict])
-    for _, restaurant_row_series in all_restaurants_df.iterrows():
-        restaurant_row = restaurant_row_series.to_dict()
-        combined_features_df = user_base_df.copy()
-        for col, val in restaurant_row.items():
-            if col in config.CATEGORY_COLS or col in config.NUMERIC_COLS:
-                combined_features_df[col] = val
-        inference_df_list.append(combined_features_df)
-        restaurant_ids_order.append(restaurant_row['restaurant_id'])
-    if not inference_df_list:
-        return torch.empty(0), [], 0
-    full_inference_df = pd.concat(inference_df_list, ignore_index=True)
-    all_expected_feature_cols = config.CATEGORY_COLS + config.NUMERIC_COLS
-    for col in all_expected_feature_cols:
-        if col not in full_inference_df.columns:
-            full_inference_df[col] = np.nan
-    try:
-        X_to_process = full_inference_df[all_expected_feature_cols]
-        X_processed = preprocessor.transform(X_to_process)
-    except Exception as e:
-        print(
-            f"API Server: Error during preproc transform for recommendation: {e}")
-        return torch.empty(0), [], 0
-    return torch.tensor(X_processed, dtype=torch.float32), restaurant_ids_order, X_processed.shape[1]
+    return transform_recommendation_frame(
+        preprocessor, user_context_dict, all_restaurants_df_orig, log_prefix="API Server: ")
 
 
 # === Federated Learning Server Core Logic ===
@@ -102,7 +104,10 @@ def save_fl_global_model_to_disk():
     global fl_global_model_weights
     if fl_global_model_weights:
         try:
-            torch.save(fl_global_model_weights, config.GLOBAL_MODEL_SAVE_PATH)
+            # Write then rename, so a hot-reloading inference_api never reads a half-written file
+            tmp_path = config.GLOBAL_MODEL_SAVE_PATH + ".tmp"
+            torch.save(fl_global_model_weights, tmp_path)
+            os.replace(tmp_path, config.GLOBAL_MODEL_SAVE_PATH)
             print(
                 f"FL Server: Global model saved to {config.GLOBAL_MODEL_SAVE_PATH}")
         except Exception as e:
@@ -204,6 +209,7 @@ def submit_fl_update_route():
             # This will use and potentially set config.INPUT_DIM, api_input_dim
             aggregate_fl_updates()
             save_fl_global_model_to_disk()
+            update_reco_model_from_fl_weights()
             fl_client_updates.clear()
             fl_connected_clients_this_round.clear()
             fl_current_round_server += 1
@@ -308,48 +314,135 @@ def aggregate_fl_updates():
 # === Recommendation API Logic ===
 
 
+def refresh_reco_engine(model):
+    # Swaps in an engine for model (None = not ready); requests in flight keep the engine they captured.
+    global reco_engine, reco_model_version
+    previous_engine = reco_engine
+    if model is None:
+        reco_engine = None
+        if previous_engine is not None:
+            previous_engine.close()
+    elif previous_engine is not None:
+        reco_engine = previous_engine.with_model(model)  # Reuses the catalog encoding, retriever and shard workers
+    else:
+        reco_engine = RecommendationEngine(
+            api_catalog, api_preprocessor, model,
+            backend='int8' if config.RECO_INT8_QUANTIZATION else 'torch', candidate_encoder=api_candidate_encoder,
+            sharded=True, retrieval=True, log_prefix="API Server: ")
+    reco_model_version += 1
+    reco_result_cache.set_version(reco_model_version)
+
+
+def update_reco_model_from_fl_weights():
+    if not fl_global_model_weights or api_input_dim <= 0:
+        return
+    if _infer_input_dim_from_state_dict(fl_global_model_weights) != api_input_dim:
+        print("API Server WARNING: Aggregated model dim differs from api_input_dim. Reco model not updated.")
+        return
+    try:
+        new_model = load_reco_model(fl_global_model_weights, api_input_dim)
+    except Exception as e:
+        print(f"API Server WARNING: Could not load aggregated weights into reco model: {e}")
+        return
+    refresh_reco_engine(new_model)
+    print("API Server: Recommendation model updated from aggregated FL weights.")
+
+
 @app.route('/recommend', methods=['POST'])
+@with_server_timing
 def recommend_route():
-    global api_all_restaurants_df, reco_inference_model, api_preprocessor, api_input_dim
-    if api_all_restaurants_df is None or reco_inference_model is None or api_preprocessor is None or api_input_dim <= 0:
+    if api_catalog is None or reco_engine is None or api_input_dim <= 0:
         return jsonify({"error": "Recommendation server resources not ready."}), 503
     user_context = request.get_json()
     if not user_context:
         return jsonify({"error": "Invalid input: No JSON payload."}), 400
-    all_user_side_features_expected = [col for col in config.CATEGORY_COLS +
-                                       config.NUMERIC_COLS if col not in api_all_restaurants_df.columns]
-    for col in all_user_side_features_expected:
-        if col not in user_context:
-            user_context[col] = "Unknown" if col in config.CATEGORY_COLS else 0.0
+    # Optional ?fields=name,cuisine,... projects the returned records
+    fields, error_msg = api_record_store.parse_fields(request.args.get('fields'))
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    # Optional ?group_by=cuisine|adname&per_group=5: the best per_group restaurants of every group
+    group, error_msg = parse_group_args(api_catalog_index, request.args.get('group_by'), request.args.get('per_group'))
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    # Identical contexts share one cached response (near-identical ones too with RECO_CACHE_QUANTIZE)
+    user_context = reco_result_cache.quantize(user_context)
+    cache_key = reco_result_cache.make_key(user_context, fields, group and [group[0], group[2]])
+    body, status, mimetype = reco_result_cache.get_or_compute(
+        cache_key,
+        lambda: cached_response_parts(app.make_response(recommend_for_context(user_context, fields, group))))
+    return app.response_class(body, status=status, mimetype=mimetype)
+
+
+def recommend_for_context(user_context, fields, group=None):
+    # Optional "filters" key restricts the scored candidates, see CatalogIndex.rows_for_filters
+    with timed('filter'):
+        candidate_rows, error_msg = pop_filter_rows(api_catalog_index, user_context)
+        excluded = excluded_rows_mask(api_catalog_index, user_context)
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    if candidate_rows is not None and len(candidate_rows) == 0:
+        return jsonify({"message": "No restaurants match the filters.", "recommendations": []})
+    engine = reco_engine  # Snapshot; FL aggregation may swap it mid-request
+    with timed('defaults'):
+        engine.fill_missing_features(user_context)
     try:
-        features_tensor, restaurant_ids_order, num_feat_proc = process_features_for_api_recommendation(
-            api_preprocessor, user_context, api_all_restaurants_df)
+        if group is not None:
+            group_by, group_segments, per_group = group
+            groups = engine.top_k_per_group(user_context, per_group, group_segments, rows=candidate_rows,
+                                             excluded=excluded)
+            return grouped_recommendations_response(api_record_store, group_by, groups, fields)
+        if config.RECO_COALESCE_ENABLED:
+            top_scores_t, catalog_rows = reco_coalescer.submit((engine, user_context, candidate_rows, excluded))
+        else:
+            top_scores_t, catalog_rows = engine.top_k(user_context, config.RECO_TOP_N, rows=candidate_rows,
+                                                     excluded=excluded)
     except Exception as e:
         return jsonify({"error": f"Feature processing error: {str(e)}"}), 500
-    if features_tensor.nelement() == 0:
-        return jsonify({"message": "No features processed.", "recommendations": []})
-    if num_feat_proc != api_input_dim:
-        return jsonify({"error": f"Feature mismatch! Model expects {api_input_dim}, Preproc: {num_feat_proc}."}), 500
-    reco_inference_model.eval()
-    with torch.no_grad():
-        logits = reco_inference_model(features_tensor)
-        probs = torch.softmax(logits, dim=1)
-        high_pref_scores = probs[:, 2]
-        if high_pref_scores.numel() == 0:
-            return jsonify({"message": "No scores generated.", "recommendations": []})
-        k = min(20, high_pref_scores.numel(), len(restaurant_ids_order))
-        if k == 0:
-            return jsonify({"message": "Not enough data for recs.", "recommendations": []})
-        top_scores_t, top_indices_t = torch.topk(high_pref_scores, k=k)
-        rec_ids = [restaurant_ids_order[i] for i in top_indices_t.tolist()]
-        top_recs_df = api_all_restaurants_df[api_all_restaurants_df['restaurant_id'].isin(
-            rec_ids)].copy()
-        id_score_map_inf = dict(zip(rec_ids, top_scores_t.tolist()))
-        top_recs_df['recommendation_score'] = top_recs_df['restaurant_id'].map(
-            id_score_map_inf)
-        recs_output = top_recs_df.sort_values(
-            by='recommendation_score', ascending=False).fillna('N/A').to_dict(orient='records')
-    return jsonify({"recommendations": recs_output})
+    if not catalog_rows:
+        return jsonify({"message": "No scores generated.", "recommendations": []})
+    return recommendations_response(api_record_store, catalog_rows, top_scores_t, fields)
+
+
+@app.route('/recommend/cache_stats', methods=['GET'])
+def recommend_cache_stats_route():
+    # Hit/miss counters for tuning RECO_CACHE_NUMERIC_BUCKETS
+    return jsonify(reco_result_cache.stats())
+
+
+@app.route('/recommend/coalescer_stats', methods=['GET'])
+def recommend_coalescer_stats_route():
+    # Batch size and queue wait of the /recommend coalescer, for tuning RECO_COALESCE_MAX_WAIT_MS/_MAX_BATCH
+    return jsonify(dict(reco_coalescer.stats(), enabled=config.RECO_COALESCE_ENABLED))
+
+
+@app.route('/recommend_batch', methods=['POST'])
+@with_server_timing
+def recommend_batch_route():
+    # Body: {"requests": [{"user_context": {...}, "top_n": 10, "filters": {...}}, ...]}; results keep request order.
+    if api_catalog is None or reco_engine is None or api_input_dim <= 0:
+        return jsonify({"error": "Recommendation server resources not ready."}), 503
+    user_contexts, top_ns, error_msg = parse_batch_entries(
+        request.get_json(silent=True), config.RECO_BATCH_MAX_CONTEXTS)
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    fields, error_msg = api_record_store.parse_fields(request.args.get('fields'))
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    with timed('filter'):
+        rows_per_entry, error_msg = pop_batch_filter_rows(api_catalog_index, user_contexts)
+        excluded_per_entry = [excluded_rows_mask(api_catalog_index, user_context) for user_context in user_contexts]
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    engine = reco_engine
+    with timed('defaults'):
+        for user_context in user_contexts:
+            engine.fill_missing_features(user_context)
+    try:
+        results = engine.top_k_batch(user_contexts, top_ns, rows_per_entry, excluded_per_entry)
+    except Exception as e:
+        return jsonify({"error": f"Batch scoring error: {str(e)}"}), 500
+    return batch_recommendations_response(
+        api_record_store, [(catalog_rows, top_scores_t) for top_scores_t, catalog_rows in results], fields)
 
 
 def csv_string_to_dataframe(csv_string):
@@ -367,8 +460,8 @@ def csv_string_to_dataframe(csv_string):
 @app.route('/train_user_model', methods=['POST'])
 def train_user_model_route():
     # Uses shared resources
-    global api_all_restaurants_df, api_preprocessor, api_input_dim, config
-    if api_all_restaurants_df is None or Client._shared_preprocessor is None:  # Check Client's preprocessor
+    global api_catalog, api_preprocessor, api_input_dim, config
+    if api_catalog is None or Client._shared_preprocessor is None:  # Check Client's preprocessor
         # Note: api_preprocessor is the server's global one. Client manages its own static var.
         # They should be the same instance after load_all_global_resources.
         return jsonify({"error": "Training API resources (restaurants or client preprocessor) not loaded."}), 503
@@ -407,7 +500,7 @@ def train_user_model_route():
         client_instance = Client(
             client_id=client_id_str,
             reviews_df_for_client=client_review_data.copy(),
-            all_restaurants_df=api_all_restaurants_df,  # Server's global restaurant data
+            all_restaurants_df=api_catalog,  # Server's global restaurant catalog, shared rather than copied
             server_url=server_url_for_client,
             user_enhanced_profile_series=user_profile_series
         )
@@ -478,7 +571,8 @@ def _infer_input_dim_from_state_dict(state_dict):
 
 
 def load_all_global_resources():
-    global api_all_restaurants_df, api_preprocessor, api_input_dim, reco_inference_model, fl_global_model_weights, config
+    global api_catalog, api_preprocessor, api_input_dim, fl_global_model_weights, config
+    global api_candidate_encoder, api_catalog_index, api_record_store
 
     print("--- Combined Server: Loading ALL Global Resources ---")
     # Populates fl_global_model_weights, can set config.INPUT_DIM, api_input_dim
@@ -488,15 +582,18 @@ def load_all_global_resources():
     if restaurants_df_from_generator.empty:
         print("CRITICAL: No Shanghai restaurant data for API. Exiting.")
         exit(1)
-    api_all_restaurants_df = restaurants_df_from_generator
-    if 'id' in api_all_restaurants_df.columns:
-        api_all_restaurants_df.rename(
+    restaurants_df = restaurants_df_from_generator
+    if 'id' in restaurants_df.columns:
+        restaurants_df.rename(
             columns={'id': 'restaurant_id'}, inplace=True)
-    if 'rating' in api_all_restaurants_df.columns:
-        api_all_restaurants_df.rename(
+    if 'rating' in restaurants_df.columns:
+        restaurants_df.rename(
             columns={'rating': 'rating_biz'}, inplace=True)
     print(
-        f"API Server: Loaded {len(api_all_restaurants_df)} Shanghai restaurants.")
+        f"API Server: Loaded {len(restaurants_df)} Shanghai restaurants.")
+    api_catalog = RestaurantCatalog(restaurants_df)  # The DataFrame isn't kept
+    api_catalog_index = build_catalog_index(api_catalog, log_prefix="API Server: ")
+    api_record_store = RecommendationRecordStore(api_catalog)
 
     if os.path.exists(config.PREPROCESSOR_SAVE_PATH):
         try:
@@ -506,6 +603,8 @@ def load_all_global_resources():
             Client._preprocessor_fitted_and_saved = True      # Update Client static vars
             print(
                 f"API Server: Loaded shared preprocessor from {config.PREPROCESSOR_SAVE_PATH} for API and Client class.")
+            api_candidate_encoder = build_candidate_encoder(
+                api_preprocessor, api_catalog.feature_frame(), log_prefix="API Server: ")
             if api_input_dim == -1 and hasattr(api_preprocessor, 'transformers_'):
                 dummy_df_cols = config.CATEGORY_COLS + config.NUMERIC_COLS
                 temp_data = {col: [np.nan] for col in dummy_df_cols}
@@ -533,6 +632,7 @@ def load_all_global_resources():
             f"API Server: CRITICAL - Preprocessor not found at {config.PREPROCESSOR_SAVE_PATH}. Must be pre-trained.")
         exit(1)
 
+    reco_inference_model = None
     if not os.path.exists(config.GLOBAL_MODEL_SAVE_PATH):
         print(
             f"API Server WARNING: Recommendation model {config.GLOBAL_MODEL_SAVE_PATH} not found. /recommend might fail until FL model is trained.")
@@ -556,10 +656,7 @@ def load_all_global_resources():
                 print(
                     f"API Server CRITICAL: Final INPUT_DIM for reco model is {api_input_dim}. Exiting.")
                 exit(1)
-            reco_inference_model = FoodPreferenceModel(input_dim=api_input_dim)
-            reco_inference_model.load_state_dict(
-                reco_model_state_dict, strict=False)
-            reco_inference_model.eval()
+            reco_inference_model = load_reco_model(reco_model_state_dict, api_input_dim)
             print(
                 f"API Server: Recommendation model weights loaded (INPUT_DIM: {api_input_dim}).")
         except Exception as e:
@@ -581,6 +678,8 @@ def load_all_global_resources():
         print("API Server CRITICAL: Could not determine a valid INPUT_DIM. Exiting.")
         exit(1)
 
+    refresh_reco_engine(reco_inference_model)  # Starts the shard workers (if enabled) before app.run's threads
+
     print(
         f"--- Combined Server: All global resources loaded. Final effective INPUT_DIM: {api_input_dim} ---")
 
@@ -0,0 +1,223 @@
+# food_serving_model.py
+import json
+import os
+import warnings
+
+import numpy as np
+import torch
+from sklearn.pipeline import Pipeline
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import StandardScaler, OneHotEncoder
+
+import federated_config as config
+from food_model import fold_batchnorm
+from food_numpy_backend import BUNDLE_FORMAT_VERSION
+from food_hot_reload import file_sha256
+
+SOURCE_INFO_FILE = 'source_model.json'  # Extra file inside the exported TorchScript archive
+
+
+def script_and_freeze(folded_model):
+    """Frozen TorchScript graph of a FoldedFoodPreferenceModel.
+
+    Weights become constants; fc1 and forward_after_fc1 are kept for the factorized scoring engine.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # torch.jit is deprecated upstream but still the lightest option here
+        scripted = torch.jit.script(folded_model.eval())
+        return torch.jit.freeze(scripted, preserved_attrs=['fc1', 'forward_after_fc1'])
+
+
+def export_serving_torchscript(model, source_model_path, torchscript_path):
+    """Folds BatchNorm, scripts and freezes the model, and saves it with the source checkpoint's hash."""
+    frozen = script_and_freeze(fold_batchnorm(model))
+    source_info = {'source_model': os.path.basename(source_model_path), 'sha256': file_sha256(source_model_path)}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        torch.jit.save(frozen, torchscript_path, _extra_files={SOURCE_INFO_FILE: json.dumps(source_info)})
+    return frozen
+
+
+def load_serving_torchscript(torchscript_path, source_model_path, log_prefix=""):
+    """Loads an exported graph if it was built from the current source checkpoint, else returns None."""
+    if not os.path.exists(torchscript_path):
+        return None
+    extra_files = {SOURCE_INFO_FILE: ''}
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            frozen = torch.jit.load(torchscript_path, map_location='cpu', _extra_files=extra_files)
+        source_info = json.loads(extra_files[SOURCE_INFO_FILE] or '{}')
+    except Exception as e:
+        print(f"{log_prefix}Could not load TorchScript model {torchscript_path}: {e}")
+        return None
+    if source_info.get('sha256') != file_sha256(source_model_path):
+        print(f"{log_prefix}TorchScript model {torchscript_path} is stale (exported from another checkpoint). Ignoring it.")
+        return None
+    return frozen
+
+
+def _preprocessor_blocks(preprocessor):
+    # Arrays for every transformer of the fitted ColumnTransformer, in output order (see NumpyPreprocessor).
+    blocks = []
+    for name, transformer, cols in preprocessor.transformers_:
+        if transformer == 'drop' or name == 'remainder':
+            continue
+        steps = [step for _, step in transformer.steps] if isinstance(transformer, Pipeline) else [transformer]
+        if len(steps) != 2 or not isinstance(steps[0], SimpleImputer):
+            raise ValueError(f"Transformer '{name}' is not an imputer + encoder/scaler pipeline.")
+        imputer, encoder = steps
+        kept_cols = [str(c) for c in imputer.get_feature_names_out(list(cols))]
+        fill = [value for col, value in zip(cols, imputer.statistics_) if col in kept_cols]
+        if isinstance(encoder, OneHotEncoder):
+            if encoder.handle_unknown != 'ignore' or encoder.drop_idx_ is not None \
+                    or getattr(encoder, 'infrequent_categories_', None) is not None:
+                raise ValueError(f"OneHotEncoder in '{name}' must use handle_unknown='ignore' without drop/infrequent.")
+            if not all(isinstance(c, str) for cats in encoder.categories_ for c in cats) \
+                    or not all(isinstance(f, str) for f in fill):
+                raise ValueError(f"OneHotEncoder in '{name}' has non-string categories.")
+            blocks.append({'kind': 'onehot', 'cols': kept_cols, 'fill': np.array(fill, dtype=str),
+                           'category_counts': np.array([len(c) for c in encoder.categories_], dtype=np.int64),
+                           'categories': np.array([c for cats in encoder.categories_ for c in cats], dtype=str)})
+        elif isinstance(encoder, StandardScaler):
+            num_cols = len(kept_cols)
+            blocks.append({'kind': 'scale', 'cols': kept_cols, 'fill': np.array(fill, dtype=np.float64),
+                           'mean': np.zeros(num_cols) if encoder.mean_ is None else encoder.mean_,
+                           'scale': np.ones(num_cols) if encoder.scale_ is None else encoder.scale_})
+        else:
+            raise ValueError(f"Unsupported encoder in '{name}': {type(encoder).__name__}")
+    return blocks
+
+
+def numpy_bundle_arrays(model, preprocessor):
+    """BatchNorm-folded weights and the preprocessor's vocabularies/statistics as named arrays (see NumpyPreprocessor)."""
+    folded = fold_batchnorm(model)
+    arrays = {'format_version': np.array(BUNDLE_FORMAT_VERSION)}
+    for layer in ('fc1', 'fc2', 'fc3'):
+        arrays[f'{layer}_weight'] = getattr(folded, layer).weight.detach().numpy().astype(np.float32)
+        arrays[f'{layer}_bias'] = getattr(folded, layer).bias.detach().numpy().astype(np.float32)
+    blocks = _preprocessor_blocks(preprocessor)
+    arrays['num_blocks'] = np.array(len(blocks))
+    for b, block in enumerate(blocks):
+        arrays[f'b{b}_kind'] = np.array(block.pop('kind'))
+        arrays[f'b{b}_cols'] = np.array(block.pop('cols'), dtype=str)
+        arrays.update({f'b{b}_{key}': value for key, value in block.items()})
+    return arrays
+
+
+def export_numpy_bundle(model, preprocessor, bundle_path):
+    """Writes numpy_bundle_arrays to one .npz.
+
+    Read back by food_numpy_backend.load_numpy_bundle; no pickled objects are stored.
+    """
+    arrays = numpy_bundle_arrays(model, preprocessor)
+    with open(bundle_path, 'wb') as f:  # File handle: np.savez would otherwise append '.npz'
+        np.savez(f, **arrays)
+
+
+def prepare_serving_model(model, candidate_encoder, log_prefix="", source_model_path=None):
+    """Returns the fp32 model the scoring engine should run, from the eager model (int8 is the
+    RecommendationEngine's 'int8' backend):
+
+    - RECO_TORCHSCRIPT_SERVING: BatchNorm-folded, frozen TorchScript graph (loaded from
+      TORCHSCRIPT_MODEL_SAVE_PATH when it was exported from source_model_path, else built here);
+    - otherwise the eager model itself.
+    """
+    if model is None:
+        return None
+    model.eval()
+    if not config.RECO_TORCHSCRIPT_SERVING:
+        return model
+    if source_model_path is not None:
+        frozen = load_serving_torchscript(config.TORCHSCRIPT_MODEL_SAVE_PATH, source_model_path, log_prefix)
+        if frozen is not None:
+            print(f"{log_prefix}Loaded frozen TorchScript model from {config.TORCHSCRIPT_MODEL_SAVE_PATH}.")
+            return frozen
+    try:
+        frozen = script_and_freeze(fold_batchnorm(model))
+    except Exception as e:
+        print(f"{log_prefix}TorchScript export failed ({e}). Serving eager model.")
+        return model
+    print(f"{log_prefix}Serving BatchNorm-folded, frozen TorchScript model.")
+    return frozen
+
+
+# Export step and equivalence check (food_serving_model.py):
+#   python food_serving_model.py  ->  writes TORCHSCRIPT_MODEL_SAVE_PATH and NUMPY_BUNDLE_SAVE_PATH
+#                                     from GLOBAL_MODEL_SAVE_PATH and PREPROCESSOR_SAVE_PATH
+if __name__ == '__main__':
+    import time
+    import tempfile
+    import joblib
+    from food_model import FoodPreferenceModel
+    from food_data_generator import load_csv_to_dataframe
+    from food_features import PrecomputedCandidateEncoder
+    from food_scoring import FactorizedScoringEngine
+    from food_quantization import probe_user_contexts
+
+    state_dict = torch.load(config.GLOBAL_MODEL_SAVE_PATH, map_location='cpu')
+    model = FoodPreferenceModel(input_dim=state_dict['fc1.weight'].shape[1])
+    model.load_state_dict(state_dict)
+    model.eval()
+    export_serving_torchscript(model, config.GLOBAL_MODEL_SAVE_PATH, config.TORCHSCRIPT_MODEL_SAVE_PATH)
+    frozen = load_serving_torchscript(config.TORCHSCRIPT_MODEL_SAVE_PATH, config.GLOBAL_MODEL_SAVE_PATH)
+    assert frozen is not None, "Exported model did not reload."
+    print(f"Exported frozen TorchScript model to {config.TORCHSCRIPT_MODEL_SAVE_PATH}")
+
+    preprocessor = joblib.load(config.PREPROCESSOR_SAVE_PATH)
+    export_numpy_bundle(model, preprocessor, config.NUMPY_BUNDLE_SAVE_PATH)
+    print(f"Exported NumPy serving bundle to {config.NUMPY_BUNDLE_SAVE_PATH} "
+          f"({os.path.getsize(config.NUMPY_BUNDLE_SAVE_PATH) / 1024:.0f} KiB)")
+
+    restaurants_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
+    restaurants_df.rename(columns={'id': 'restaurant_id', 'rating': 'rating_biz'}, inplace=True)
+    encoder = PrecomputedCandidateEncoder(preprocessor, restaurants_df)
+    context = probe_user_contexts(encoder)[0]
+    X = torch.from_numpy(encoder.transform(context))
+
+    # Shipped weights plus a random-init model with non-trivial BatchNorm statistics
+    torch.manual_seed(0)
+    random_model = FoodPreferenceModel(input_dim=encoder.num_features)
+    with torch.no_grad():
+        for bn in (random_model.bn1, random_model.bn2):
+            bn.running_mean.uniform_(-0.5, 0.5); bn.running_var.uniform_(0.5, 2.0)
+            bn.weight.uniform_(0.5, 1.5); bn.bias.uniform_(-0.2, 0.2)
+    random_model.eval()
+    for name, eager, scripted in (("shipped", model, frozen),
+                                  ("random-init", random_model, script_and_freeze(fold_batchnorm(random_model)))):
+        with torch.no_grad():
+            eager_logits, scripted_logits = eager(X), scripted(X)
+        torch.testing.assert_close(scripted_logits, eager_logits, rtol=1e-4, atol=1e-4 * eager_logits.abs().max().item())
+        eager_engine, scripted_engine = FactorizedScoringEngine(eager, encoder), FactorizedScoringEngine(scripted, encoder)
+        torch.testing.assert_close(scripted_engine.logits(context), eager_engine.logits(context),
+                                   rtol=1e-4, atol=1e-4 * eager_logits.abs().max().item())
+        timings, user_vector = [], encoder.encode_user(context)
+        for engine in (eager_engine, scripted_engine):
+            engine.logits_for_user_vector(user_vector)
+            start = time.perf_counter()
+            for _ in range(20):
+                engine.logits_for_user_vector(user_vector)
+            timings.append((time.perf_counter() - start) / 20)
+        print(f"{name}: folded TorchScript logits match eager model (full and factorized); "
+              f"factorized per-request eager {timings[0] * 1000:.2f}ms, TorchScript {timings[1] * 1000:.2f}ms")
+
+    from food_numpy_backend import build_numpy_scoring_engine, top_k
+    contexts = probe_user_contexts(encoder)
+    for name, eager in (("shipped", model), ("random-init", random_model)):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bundle_path = os.path.join(tmp_dir, 'bundle.npz')
+            export_numpy_bundle(eager, preprocessor, bundle_path)
+            numpy_engine = build_numpy_scoring_engine(bundle_path, restaurants_df)
+        torch_engine = FactorizedScoringEngine(eager, encoder)
+        assert np.array_equal(numpy_engine.encode_users(contexts), encoder.encode_users(contexts)), \
+            "NumPy preprocessor differs from sklearn."
+        expected = torch.softmax(torch_engine.logits_for_user_vectors(encoder.encode_users(contexts)), dim=-1)[..., 2]
+        start = time.perf_counter()
+        numpy_scores = numpy_engine.high_pref_scores(contexts)
+        numpy_s = time.perf_counter() - start
+        np.testing.assert_allclose(numpy_scores, expected.numpy(), rtol=1e-4, atol=1e-6)
+        if name == "random-init":  # The shipped model saturates (ties at 1.0), so rankings are compared here
+            for row, expected_row in zip(numpy_scores, expected):
+                assert set(top_k(row, 20)[1]) == set(torch.topk(expected_row, 20).indices.tolist())
+        print(f"{name}: NumPy backend matches torch scores for {len(contexts)} contexts "
+              f"({numpy_s * 1000:.1f}ms for the batch)")
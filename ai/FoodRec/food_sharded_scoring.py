@@ -0,0 +1,277 @@
+# food_sharded_scoring.py
+# Whole-catalog scoring split into contiguous row shards, scored in parallel by long-lived worker processes.
+# The workers are started once (ShardedScoringPool) and receive each new model's weights; they are never
+# re-created per model, so an FL aggregation does not start processes from the threaded server.
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+import federated_config as config
+
+# Worker process state, set by _init_worker and _load_model
+_worker_shards = None  # Global (start, stop) of every shard
+_worker_first_row = 0  # Catalog row of the worker's first restaurant
+_worker_encoder = None  # The worker's rows of the restaurant block, with the encoder's column split
+_worker_version = None
+_worker_engine = None  # FactorizedScoringEngine over the worker's rows, for _worker_version
+
+
+def shard_bounds(num_rows, num_shards):
+    """Contiguous, non-empty (start, stop) row ranges covering num_rows, as even as possible."""
+    num_shards = max(1, min(num_shards, num_rows))
+    edges = np.linspace(0, num_rows, num_shards + 1).astype(int)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+
+def _init_worker(restaurant_block, user_out_idx, restaurant_out_idx, num_features, shards, first_row,
+                 threads_per_worker):
+    global _worker_shards, _worker_first_row, _worker_encoder
+    _worker_shards, _worker_first_row = shards, first_row
+    _worker_encoder = SimpleNamespace(restaurant_block=restaurant_block, user_out_idx=user_out_idx,
+                                      restaurant_out_idx=restaurant_out_idx, num_features=num_features,
+                                      restaurant_ids_order=None)
+    torch.set_num_threads(threads_per_worker)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _model_payload(model):
+    # TorchScript graphs (the frozen serving model) are saved with torch.jit, eager / int8 modules pickled
+    buffer = io.BytesIO()
+    if isinstance(model, torch.jit.ScriptModule):
+        torch.jit.save(model, buffer)
+        return 'script', buffer.getvalue()
+    torch.save(model, buffer)
+    return 'eager', buffer.getvalue()
+
+
+def _load_model(version, kind, payload):
+    # Replaces the worker's model; fc1's restaurant part is recomputed for the worker's rows only
+    global _worker_version, _worker_engine
+    from food_scoring import FactorizedScoringEngine
+    buffer = io.BytesIO(payload)
+    model = torch.jit.load(buffer) if kind == 'script' else torch.load(buffer, weights_only=False)
+    _worker_engine, _worker_version = None, None  # The old restaurant part is freed before the new one is built
+    _worker_engine, _worker_version = FactorizedScoringEngine(model, _worker_encoder), version
+    return version
+
+
+def _score_shards(version, shard_indices, user_vectors, k, shard_exclusions=None):
+    # Local top-k per shard; indices are returned as catalog rows. shard_exclusions: per shard, the (B, rows)
+    # excluded-restaurant bits packed along rows. Restaurants excluded for every user are not scored; one
+    # excluded for only some users of the batch is scored once and set to -inf for those.
+    if version != _worker_version:
+        raise RuntimeError(f"Shard worker holds model version {_worker_version}, request needs {version}.")
+    results = []
+    for j, shard_index in enumerate(shard_indices):
+        start, stop = _worker_shards[shard_index]
+        candidates, excluded = None, None
+        rows = slice(start - _worker_first_row, stop - _worker_first_row)
+        if shard_exclusions is not None:
+            excluded = np.unpackbits(shard_exclusions[j], axis=1, count=stop - start).astype(bool)
+            wanted = ~excluded.all(axis=0)  # Shard-local rows some user of the batch may get
+            if not wanted.any():
+                results.append((np.empty((len(user_vectors), 0), dtype=np.float32),
+                                np.empty((len(user_vectors), 0), dtype=np.int64)))
+                continue
+            if not wanted.all():
+                candidates = np.flatnonzero(wanted)
+                excluded = excluded[:, candidates]
+                rows = candidates + (start - _worker_first_row)
+        logits = _worker_engine.logits_for_user_vectors(user_vectors, rows=rows)
+        scores = torch.softmax(logits, dim=-1)[..., 2]
+        if excluded is not None and excluded.any():
+            scores[torch.from_numpy(excluded)] = float('-inf')
+        top_scores, top_indices = torch.topk(scores, k=min(k, scores.shape[1]), dim=1)
+        top_indices = top_indices.numpy()
+        results.append((top_scores.numpy(), (top_indices if candidates is None else candidates[top_indices]) + start))
+    return results
+
+
+class ShardedScoringPool:
+    """Worker processes that score the catalog of a candidate encoder as num_shards row shards.
+
+    Each worker owns a contiguous run of shards and gets its rows of the restaurant block once, at start.
+    load_model pushes a model's weights to every worker, which recomputes fc1's restaurant part for its
+    rows, and returns the ShardedScoringEngine that scores with that model. Workers are spawned rather
+    than forked, so a pool may be started from a process whose torch or server threads already run;
+    it lives as long as the process (or until close), across any number of models.
+    """
+
+    def __init__(self, candidate_encoder, num_shards, num_workers):
+        self.candidate_encoder = candidate_encoder
+        self.num_rows = len(candidate_encoder.restaurant_ids_order)
+        self.shards = shard_bounds(self.num_rows, num_shards)
+        self.num_workers = max(1, min(num_workers, len(self.shards)))
+        self.worker_shards = [part.tolist() for part in np.array_split(np.arange(len(self.shards)), self.num_workers)]
+        self.version = 0
+        threads_per_worker = max(1, (os.cpu_count() or 1) // self.num_workers)
+        context = multiprocessing.get_context('spawn')
+        self.pools = []
+        for shard_indices in self.worker_shards:
+            first_row, last_row = self.shards[shard_indices[0]][0], self.shards[shard_indices[-1]][1]
+            self.pools.append(ProcessPoolExecutor(
+                max_workers=1, mp_context=context, initializer=_init_worker,
+                initargs=(candidate_encoder.restaurant_block[first_row:last_row], candidate_encoder.user_out_idx,
+                          candidate_encoder.restaurant_out_idx, candidate_encoder.num_features, self.shards,
+                          first_row, threads_per_worker)))
+        # Start the workers now rather than on the first request
+        self.worker_pids = [future.result() for future in [pool.submit(_ping) for pool in self.pools]]
+
+    def load_model(self, engine):
+        """Sends engine's (a FactorizedScoringEngine over this pool's encoder) model to every worker.
+
+        Returns a ShardedScoringEngine for it. A request still holding the previous ShardedScoringEngine
+        gets an error from the workers and falls back to in-process scoring.
+        """
+        if engine.candidate_encoder is not self.candidate_encoder:
+            raise ValueError("The scoring engine encodes another catalog than the shard workers hold.")
+        self.version += 1
+        kind, payload = _model_payload(engine.model)
+        futures = [pool.submit(_load_model, self.version, kind, payload) for pool in self.pools]
+        for future in futures:
+            future.result()
+        return ShardedScoringEngine(self, self.version, engine)
+
+    def close(self):
+        # Already-submitted work still completes
+        for pool in self.pools:
+            pool.shutdown(wait=False)
+
+
+class ShardedScoringEngine:
+    """One model's top-k over a ShardedScoringPool: each worker scores its shards for the request's users
+    and returns a local top-k per shard; the parent merges them into the global top-k."""
+
+    def __init__(self, pool, version, engine):
+        self.pool = pool
+        self.version = version
+        self.engine = engine
+
+    @property
+    def num_features(self):
+        return self.engine.num_features
+
+    def top_k_for_user_vectors(self, user_vectors, k, excluded_per_entry=None):
+        """(B, n_user) user matrix -> ((B, k) top scores, (B, k) catalog rows), best first.
+
+        excluded_per_entry: optional boolean catalog mask (or None) per user of restaurants to leave out;
+        the workers skip restaurants excluded for every user, and the rest come back as -inf for the users
+        who excluded them (so a user may get fewer than k finite scores).
+        """
+        user_vectors = np.ascontiguousarray(user_vectors, dtype=np.float32)
+        excluded = None
+        if excluded_per_entry is not None and any(mask is not None for mask in excluded_per_entry):
+            excluded = np.stack([np.zeros(self.pool.num_rows, dtype=bool) if mask is None else mask
+                                 for mask in excluded_per_entry])
+        packed = None if excluded is None else [np.packbits(excluded[:, start:stop], axis=1)
+                                                for start, stop in self.pool.shards]  # N/8 bytes per user to send
+        futures = [pool.submit(_score_shards, self.version, shard_indices, user_vectors, k,
+                               None if packed is None else [packed[i] for i in shard_indices])
+                   for pool, shard_indices in zip(self.pool.pools, self.pool.worker_shards)]
+        parts = [part for future in futures for part in future.result()]
+        scores = torch.from_numpy(np.concatenate([part[0] for part in parts], axis=1))
+        rows = np.concatenate([part[1] for part in parts], axis=1)
+        top_scores, positions = torch.topk(scores, k=min(k, scores.shape[1]), dim=1)
+        return top_scores, torch.from_numpy(np.take_along_axis(rows, positions.numpy(), axis=1))
+
+    def top_k(self, user_context_dicts, k, excluded_per_entry=None):
+        return self.top_k_for_user_vectors(self.engine.candidate_encoder.encode_users(user_context_dicts), k,
+                                           excluded_per_entry)
+
+
+def build_sharded_scoring_pool(candidate_encoder, log_prefix="", num_shards=None, num_workers=None):
+    """Returns a ShardedScoringPool over candidate_encoder's catalog when RECO_SHARDED_SCORING is on and the
+    catalog has at least RECO_SHARDED_MIN_ROWS restaurants, else None."""
+    if candidate_encoder is None or not config.RECO_SHARDED_SCORING:
+        return None
+    num_rows = len(candidate_encoder.restaurant_ids_order)
+    if num_rows < config.RECO_SHARDED_MIN_ROWS:
+        print(f"{log_prefix}Sharded scoring skipped: {num_rows} restaurants, below RECO_SHARDED_MIN_ROWS "
+              f"({config.RECO_SHARDED_MIN_ROWS}). Scoring in process.")
+        return None
+    num_shards = config.RECO_SCORING_SHARDS if num_shards is None else num_shards
+    num_workers = config.RECO_SCORING_WORKERS if num_workers is None else num_workers
+    if num_workers <= 0:
+        num_workers = os.cpu_count() or 1
+    try:
+        pool = ShardedScoringPool(candidate_encoder, num_shards, num_workers)
+    except Exception as e:
+        print(f"{log_prefix}Sharded scoring disabled ({e}). Scoring in process.")
+        return None
+    print(f"{log_prefix}Sharded scoring ready: {len(pool.shards)} shards over {pool.num_workers} "
+          f"worker processes ({num_rows} restaurants).")
+    return pool
+
+
+# Standalone check (food_sharded_scoring.py)
+if __name__ == '__main__':
+    import time
+    import joblib
+    from food_model import FoodPreferenceModel
+    from food_data_generator import load_csv_to_dataframe
+    from food_features import PrecomputedCandidateEncoder
+    from food_scoring import FactorizedScoringEngine, batched_top_k, high_pref_scores_for_contexts
+    from food_serving_model import script_and_freeze
+    from food_model import fold_batchnorm
+    from food_quantization import probe_user_contexts
+
+    restaurants_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
+    restaurants_df.rename(columns={'id': 'restaurant_id', 'rating': 'rating_biz'}, inplace=True)
+    encoder = PrecomputedCandidateEncoder(joblib.load(config.PREPROCESSOR_SAVE_PATH), restaurants_df)
+    contexts = probe_user_contexts(encoder)
+
+    def random_model(seed):
+        torch.manual_seed(seed)  # Random-init weights give unsaturated scores, so ranking differences would show
+        model = FoodPreferenceModel(input_dim=encoder.num_features)
+        with torch.no_grad():
+            model.bn1.running_mean.uniform_(-0.5, 0.5); model.bn1.running_var.uniform_(0.5, 2.0)
+        return model.eval()
+
+    for num_shards, num_workers in ((1, 1), (7, 3), (16, 4)):
+        pool = ShardedScoringPool(encoder, num_shards, num_workers)
+        # Two models in turn on the same workers: eager, then the frozen TorchScript serving graph
+        for seed, to_serving in ((0, lambda model: model), (1, lambda model: script_and_freeze(fold_batchnorm(model)))):
+            engine = FactorizedScoringEngine(to_serving(random_model(seed)), encoder)
+            previous = None if seed == 0 else sharded
+            sharded = pool.load_model(engine)
+            reference_scores, _ = high_pref_scores_for_contexts(engine, None, None, None, contexts)
+            reference = batched_top_k(reference_scores, [20] * len(contexts))
+            start = time.perf_counter()
+            top_scores, top_rows = sharded.top_k(contexts, 20)
+            elapsed = time.perf_counter() - start
+            for (ref_scores, ref_rows), scores, rows in zip(reference, top_scores, top_rows):
+                torch.testing.assert_close(scores, ref_scores, rtol=1e-5, atol=1e-5)
+                assert set(rows.tolist()) == set(ref_rows.tolist()), "Sharded top-20 differs from in-process top-20."
+            excluded = np.zeros(len(engine.restaurant_ids_order), dtype=bool)
+            excluded[reference[0][1].numpy()] = True  # The first context's top-20 are left out for it alone
+            top_scores, top_rows = sharded.top_k(contexts, 20, [excluded] + [None] * (len(contexts) - 1))
+            assert not excluded[top_rows[0].numpy()].any() and torch.isfinite(top_scores[0]).all()
+            assert set(top_rows[1].tolist()) == set(reference[1][1].tolist())
+            # One context alone: its excluded rows (here also all of shard 0) are never scored by the workers
+            if len(pool.shards) > 1:
+                excluded[slice(*pool.shards[0])] = True
+            kept = np.flatnonzero(~excluded)
+            kept_scores, _ = high_pref_scores_for_contexts(engine, None, None, None, contexts[:1], rows=kept)
+            ref_scores, ref_indices = batched_top_k(kept_scores, [20])[0]
+            top_scores, top_rows = sharded.top_k(contexts[:1], 20, [excluded])
+            torch.testing.assert_close(top_scores[0], ref_scores, rtol=1e-5, atol=1e-5)
+            assert set(top_rows[0].tolist()) == set(kept[ref_indices.numpy()].tolist())
+            if previous is not None:
+                try:
+                    previous.top_k(contexts, 20)
+                    raise AssertionError("A replaced model must not be scored with the new weights.")
+                except RuntimeError:
+                    pass
+        assert [future.result() for future in [p.submit(_ping) for p in pool.pools]] == pool.worker_pids, \
+            "Loading a model must reuse the worker processes."
+        pool.close()
+        print(f"{num_shards} shards / {num_workers} workers: top-20 matches in-process scoring for two models "
+              f"on the same workers, {len(contexts)} contexts ({elapsed * 1000:.1f}ms).")
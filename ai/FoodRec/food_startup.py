@@ -0,0 +1,75 @@
+# food_startup.py
+# Cold-start accounting for inference_api: how long each import and load phase took before the server was ready.
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def seconds_since_process_start():
+    """Age of this process from /proc (Linux; 10ms resolution), so interpreter startup is counted too. None elsewhere."""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupReport:
+    """Wall-clock duration of each named startup phase, and when milestones ('listening', 'ready') were reached.
+
+    Times are relative to the report's creation, which should be the first thing the server module does.
+    Phases are only recorded until 'ready', so later hot reloads don't add to the startup budget.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.before_start = seconds_since_process_start()  # Interpreter startup, before the module ran
+        self.phases = []  # (name, seconds) in completion order
+        self.milestones = {}  # name -> seconds since start
+        self.error = None  # Why loading failed, if it did
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if 'ready' not in self.milestones:
+                    self.phases.append((name, time.perf_counter() - phase_start))
+
+    def mark(self, milestone):
+        with self._lock:
+            self.milestones.setdefault(milestone, time.perf_counter() - self.start)
+
+    def fail(self, error):
+        with self._lock:
+            self.error = str(error)
+            self.milestones.setdefault('failed', time.perf_counter() - self.start)
+
+    def as_dict(self):
+        with self._lock:
+            return {"interpreter_startup_s": self.before_start,
+                    "phases_s": [[name, round(seconds, 4)] for name, seconds in self.phases],
+                    "milestones_s": {name: round(seconds, 4) for name, seconds in self.milestones.items()},
+                    "error": self.error}
+
+    def print_report(self, log_prefix=""):
+        with self._lock:
+            phases, milestones = list(self.phases), dict(self.milestones)
+        lines = [f"{log_prefix}--- Startup report ---"]
+        if self.before_start is not None:
+            lines.append(f"  {'interpreter startup':<34}{self.before_start * 1000:9.1f} ms")
+        for name, seconds in phases:
+            lines.append(f"  {name:<34}{seconds * 1000:9.1f} ms")
+        for name, seconds in sorted(milestones.items(), key=lambda item: item[1]):
+            total = seconds + (self.before_start or 0.0)
+            lines.append(f"  {'-> ' + name:<34}{total * 1000:9.1f} ms after process start")
+        if self.error is not None:
+            lines.append(f"  Loading failed: {self.error}")
+        print("\n".join(lines))
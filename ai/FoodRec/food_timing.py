@@ -0,0 +1,123 @@
+# food_timing.py
+# Per-request phase timings of the recommendation routes (filters, context defaulting, feature building,
+# preprocessor transform, forward pass, top-k, serialization), sent back as a Server-Timing header.
+# Scoring code calls timed(name) without a timer being passed down: the route's timer is found through a
+# context variable, and outside a request the call is a no-op.
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+_current_timer = ContextVar('food_request_timer', default=None)
+
+
+class RequestTimer:
+    """time.perf_counter() durations per named phase of one request; a phase entered twice adds up."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}  # name -> seconds, in first-entered order
+        self.notes = {}  # name -> description, for outcomes without a duration (cache=hit)
+
+    @contextmanager
+    def phase(self, name):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - phase_start)
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def merge(self, phases):
+        for name, seconds in phases.items():
+            self.add(name, seconds)
+
+    def as_dict(self):
+        """{phase: milliseconds, ..., 'total': milliseconds since the timer started, note: description}."""
+        timings = {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()}
+        timings['total'] = round((time.perf_counter() - self.start) * 1000, 3)
+        timings.update(self.notes)
+        return timings
+
+    def header_value(self):
+        """Server-Timing value, e.g. 'filter;dur=0.112, ..., total;dur=4.310, cache;desc="miss"' (milliseconds)."""
+        entries = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.phases.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.3f}")
+        entries.extend(f'{name};desc="{description}"' for name, description in self.notes.items())
+        return ", ".join(entries)
+
+
+@contextmanager
+def request_timer(enabled=True):
+    """Makes a new RequestTimer current until the block exits and yields it (None when not enabled)."""
+    if not enabled:
+        yield None
+        return
+    timer = RequestTimer()
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+def timed(name):
+    """Context manager timing its block into the current request's timer, if there is one."""
+    timer = _current_timer.get()
+    return nullcontext() if timer is None else timer.phase(name)
+
+
+def note(name, description):
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.notes[name] = description
+
+
+def add_server_timing(response, timer, debug_field=False):
+    """Sets the response's Server-Timing header from timer (a no-op for None).
+
+    debug_field also adds the timings to a JSON object body as "server_timing"; that re-encodes the
+    body, so it is meant for debugging, not for every request.
+    """
+    if timer is None:
+        return response
+    if debug_field and response.is_json:
+        body = response.get_json()
+        if isinstance(body, dict):
+            body['server_timing'] = timer.as_dict()
+            response.set_data(json.dumps(body, ensure_ascii=False) + "\n")
+    response.headers['Server-Timing'] = timer.header_value()
+    return response
+
+
+# Standalone check (food_timing.py)
+if __name__ == '__main__':
+    import threading
+
+    def score():
+        with timed('forward'):
+            time.sleep(0.01)
+
+    score()  # No current timer: nothing is recorded, nothing fails
+    with request_timer() as timer:
+        score()
+        score()
+        with timed('topk'):
+            time.sleep(0.002)
+        note('cache', 'miss')
+        other = []
+        thread = threading.Thread(target=lambda: other.append(current_timer()))
+        thread.start()
+        thread.join()
+    assert list(timer.phases) == ['forward', 'topk'] and timer.phases['forward'] >= 0.02, timer.phases
+    assert other == [None], "A timer must not leak into other threads."
+    assert current_timer() is None
+    with request_timer(enabled=False) as disabled:
+        assert disabled is None and current_timer() is None
+    print(f"Server-Timing: {timer.header_value()}")
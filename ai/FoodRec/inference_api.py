@@ -1,99 +1,296 @@
 # api_server.py
-import pandas as pd
-import numpy as np
-import torch
-import os
-import json
-import joblib
-import random # For default values if needed, though user provides context
-
-from flask import Flask, request, jsonify
-
-# Assuming these files are in the same directory or configured in PYTHONPATH
-import federated_config as config
-from food_model import FoodPreferenceModel
-from food_data_generator import load_csv_to_dataframe # Use adapted loader
-from food_client import process_features_for_recommendation
+# Cold start: only what answering /ready needs is imported here. pandas, scipy, torch and sklearn (and the
+# modules built on them) are imported by load_resources/load_model_snapshot, behind the readiness probe.
+from food_startup import StartupReport
+startup_report = StartupReport() # Phase timings, printed with --startup-report
+
+with startup_report.phase("import stdlib + flask"):
+    import os
+    import json
+    import threading
+    import traceback
+    import time
+    import argparse
+
+    from flask import Flask, request, jsonify
+
+with startup_report.phase("import serving modules"):
+    # Assuming these files are in the same directory or configured in PYTHONPATH
+    import federated_config as config
+    from food_reco_output import (recommendations_response, batch_recommendations_response,
+                                  grouped_recommendations_response, with_server_timing)
+    from food_timing import timed
+    from food_reco_cache import RecommendationCache, cached_response_parts
+    from food_hot_reload import FileChangeWatcher, file_signature, file_sha256
+    from food_prefork import serve_preforked, share_engine_arrays, shared_memory_dir
 
 # --- Global Variables for Loaded Resources ---
-all_restaurants_df_global = None
-inference_model_global = None
-preprocessor_global = None
-input_dim_global = -1
+catalog_global = None # RestaurantCatalog: codes/float32 scoring columns + packed display store
+catalog_index_global = None # adname/cuisine/business_area -> rows, sorted cost; for request "filters"
+record_store_global = None # Response records from the catalog's display store
+snapshot_global = None # ModelSnapshot being served; replaced as a whole by hot reload
+result_cache_global = RecommendationCache() # /recommend responses for the current snapshot version
+reload_watcher_global = None # FileChangeWatcher over the model/preprocessor files
+reload_lock = threading.Lock() # One snapshot build at a time
+reload_status_global = {"reloads": 0, "last_reload_error": None}
 
 app = Flask(__name__)
 app.config['JSON_AS_ASCII'] = False # Explicitly set this globally if needed
 
 def infer_input_dim_from_model(state_dict):
-    if 'fc1.weight' in state_dict: return state_dict['fc1.weight'].shape[1]
-    print("Warning: Could not infer input_dim from model state_dict."); return -1
+    from food_reco_engine import infer_input_dim
+    input_dim = infer_input_dim(state_dict)
+    if input_dim <= 0: print("Warning: Could not infer input_dim from model state_dict.")
+    return input_dim
 
-def load_resources():
-    """Loads all necessary resources once at server startup."""
-    global all_restaurants_df_global, inference_model_global, preprocessor_global, input_dim_global
 
-    print("--- Loading Resources for Inference API ---")
+class ModelSnapshot:
+    """A versioned RecommendationEngine (model, preprocessor and everything derived), built off the request path.
+
+    Requests read snapshot_global once and use that object throughout, so a hot reload
+    that swaps in a new snapshot never mixes old and new state within one request.
+    """
+    def __init__(self, version, info, engine):
+        self.version = version
+        self.info = info # Reported by /version
+        self.engine = engine
+
+    @property
+    def ready(self):
+        return self.engine is not None and self.engine.ready
 
-    # 1. Load Restaurant Data
-    all_restaurants_df_global = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
-    if all_restaurants_df_global.empty:
-        print("CRITICAL: No Shanghai restaurant data. Exiting.")
-        exit(1) # Critical failure
-    if 'id' in all_restaurants_df_global.columns:
-        all_restaurants_df_global.rename(columns={'id': 'restaurant_id'}, inplace=True)
-    if 'rating' in all_restaurants_df_global.columns:
-        all_restaurants_df_global.rename(columns={'rating': 'rating_biz'}, inplace=True)
-    print(f"Loaded {len(all_restaurants_df_global)} Shanghai restaurants.")
+
+def serving_artifact_paths():
+    """Files a snapshot is built from; the hot-reload watcher polls these."""
+    from food_reco_engine import default_backend
+    if default_backend() == 'numpy':
+        paths = [config.NUMPY_BUNDLE_SAVE_PATH]
+    elif default_backend() == 'bundle':
+        paths = [config.SERVING_BUNDLE_SAVE_PATH]
+    else:
+        paths = [config.GLOBAL_MODEL_SAVE_PATH, config.PREPROCESSOR_SAVE_PATH]
+    return paths + [config.MODEL_VERSION_FILE]
+
+
+def _artifact_info(path, digest=True):
+    stat = os.stat(path)
+    info = {"path": os.path.basename(path),
+            "modified": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(stat.st_mtime))}
+    if digest:
+        info["sha256"] = file_sha256(path)
+    return info
+
+
+def load_model_snapshot(version):
+    """Loads model + preprocessor (or the NumPy or serving bundle) and builds the derived caches. Raises on failure."""
+    from food_reco_engine import RecommendationEngine, default_backend
+    backend = default_backend()
+    info = {"version": version, "backend": backend,
+            "loaded_at": time.strftime('%Y-%m-%dT%H:%M:%S')}
+    if os.path.exists(config.MODEL_VERSION_FILE):
+        with open(config.MODEL_VERSION_FILE, encoding='utf-8') as f:
+            info["model_version_file"] = f.read().strip()
+
+    if backend == 'numpy':
+        # Folded weights and preprocessor statistics from one .npz; no torch model or sklearn preprocessor
+        with startup_report.phase("load numpy bundle + engine"):
+            engine = RecommendationEngine(catalog_global, backend='numpy')
+        info.update(bundle=_artifact_info(config.NUMPY_BUNDLE_SAVE_PATH), input_dim=engine.input_dim,
+                    serving_model=engine.serving_model_name)
+        return ModelSnapshot(version, info, engine)
+
+    if backend == 'bundle':
+        # Catalog encoding, IDs, preprocessor statistics and folded weights mapped from one file. It is not
+        # hashed here (that would read it all); its header records the hashes of the files it was built from.
+        with startup_report.phase("map serving bundle + engine"):
+            engine = RecommendationEngine(catalog_global, backend='bundle',
+                                          catalog_path=config.SHANGHAI_RESTAURANTS_FILE)
+        bundle = engine.numpy_engine.bundle
+        info.update(bundle=dict(_artifact_info(bundle.path, digest=False), bundle_version=bundle.version,
+                                created_at=bundle.metadata.get('created_at'), sources=bundle.metadata.get('sources')),
+                    input_dim=engine.input_dim, serving_model=engine.serving_model_name)
+        return ModelSnapshot(version, info, engine)
 
     # 2. Load Model
     if not os.path.exists(config.GLOBAL_MODEL_SAVE_PATH):
-        print(f"CRITICAL: Model {config.GLOBAL_MODEL_SAVE_PATH} not found. Train first. Exiting.")
-        exit(1)
+        raise RuntimeError(f"Model {config.GLOBAL_MODEL_SAVE_PATH} not found. Train first.")
+    with startup_report.phase("import torch"):
+        import torch
+        from food_reco_engine import load_reco_model
     try:
-        model_state_dict = torch.load(config.GLOBAL_MODEL_SAVE_PATH, map_location=torch.device('cpu'))
+        with startup_report.phase("load model weights"):
+            model_state_dict = torch.load(config.GLOBAL_MODEL_SAVE_PATH, map_location=torch.device('cpu'))
         print("Global model state_dict loaded.")
     except Exception as e:
-        print(f"CRITICAL: Error loading model: {e}. Exiting.")
-        exit(1)
+        raise RuntimeError(f"Error loading model: {e}.")
 
-    input_dim_global = config.INPUT_DIM
-    if input_dim_global == -1:
-        input_dim_global = infer_input_dim_from_model(model_state_dict)
-    if input_dim_global <= 0:
-        print(f"CRITICAL: Invalid INPUT_DIM ({input_dim_global}). Exiting.")
-        exit(1)
-    print(f"Using INPUT_DIM: {input_dim_global} for model.")
-    config.INPUT_DIM = input_dim_global # Ensure config is updated if inferred
+    # Inferred from every loaded model, not kept in config: a reload may bring a different one-hot width
+    input_dim = infer_input_dim_from_model(model_state_dict)
+    if input_dim <= 0:
+        raise RuntimeError(f"Invalid INPUT_DIM ({input_dim}).")
+    print(f"Using INPUT_DIM: {input_dim} for model.")
 
     try:
-        inference_model_global = FoodPreferenceModel(input_dim=input_dim_global)
-        inference_model_global.load_state_dict(model_state_dict)
-        inference_model_global.eval() # Set to evaluation mode
+        inference_model = load_reco_model(model_state_dict, input_dim)
         print("Global model weights loaded into inference instance.")
     except Exception as e:
-        print(f"CRITICAL: Error initializing/loading model: {e}. Exiting.")
-        exit(1)
+        raise RuntimeError(f"Error initializing/loading model: {e}.")
 
     # 3. Load Preprocessor
     if not os.path.exists(config.PREPROCESSOR_SAVE_PATH):
-        print(f"CRITICAL: Preprocessor {config.PREPROCESSOR_SAVE_PATH} not found. Train first. Exiting.")
-        exit(1)
+        raise RuntimeError(f"Preprocessor {config.PREPROCESSOR_SAVE_PATH} not found. Train first.")
     try:
-        preprocessor_global = joblib.load(config.PREPROCESSOR_SAVE_PATH)
+        with startup_report.phase("load preprocessor (imports sklearn)"):
+            import joblib
+            from food_features import preprocessor_output_width
+            preprocessor = joblib.load(config.PREPROCESSOR_SAVE_PATH)
+            preprocessor_width = preprocessor_output_width(preprocessor)
         print("Loaded saved preprocessor.")
     except Exception as e:
-        print(f"CRITICAL: Error loading preprocessor: {e}. Exiting.")
+        raise RuntimeError(f"Error loading preprocessor: {e}.")
+    if preprocessor_width != input_dim:
+        raise RuntimeError(f"Preprocessor outputs {preprocessor_width} features but the model expects {input_dim}; "
+                           f"the model and preprocessor files are not from the same training run.")
+
+    # 4. Restaurant-side features encoded once, serving model and factorized cache (see RecommendationEngine)
+    with startup_report.phase("build engine"):
+        engine = RecommendationEngine(catalog_global, preprocessor, inference_model, backend,
+                                      source_model_path=config.GLOBAL_MODEL_SAVE_PATH)
+    info.update(model=_artifact_info(config.GLOBAL_MODEL_SAVE_PATH),
+                preprocessor=_artifact_info(config.PREPROCESSOR_SAVE_PATH), input_dim=input_dim,
+                serving_model=engine.serving_model_name)
+    return ModelSnapshot(version, info, engine)
+
+
+def install_snapshot(snapshot):
+    """Swaps in a new snapshot; in-flight requests finish on the one they already hold."""
+    global snapshot_global
+    snapshot_global = snapshot
+    result_cache_global.set_version(snapshot.version) # Cached results of the old model are dropped
+
+
+def reload_model_snapshot():
+    """Builds a new snapshot from the current files and swaps it in. Returns True on success."""
+    with reload_lock:
+        current = snapshot_global
+        try:
+            snapshot = load_model_snapshot((current.version if current else 0) + 1)
+        except Exception as e:
+            reload_status_global["last_reload_error"] = str(e)
+            print(f"Hot reload failed: {e} Still serving version {current.version if current else None}.")
+            return False
+        install_snapshot(snapshot)
+        reload_status_global["reloads"] += 1
+        reload_status_global["last_reload_error"] = None
+        print(f"--- Hot reload complete: now serving version {snapshot.version} ---")
+        return True
+
+
+def load_resources(start_watcher=True):
+    """Loads all necessary resources once at server startup.
+
+    start_watcher=False only creates the hot-reload watcher; pre-forked workers start their own.
+    """
+    global catalog_global, catalog_index_global, record_store_global, reload_watcher_global
+
+    print("--- Loading Resources for Inference API ---")
+    with startup_report.phase("import catalog + engine modules"):
+        from food_data_generator import load_csv_to_dataframe # Use adapted loader
+        from food_catalog import RestaurantCatalog
+        from food_catalog_index import build_catalog_index
+        from food_reco_output import RecommendationRecordStore
+        import food_reco_engine # torch-free until a torch backend engine is built
+
+    # 1. Load Restaurant Data
+    with startup_report.phase("load catalog CSV"):
+        restaurants_df = load_csv_to_dataframe(config.SHANGHAI_RESTAURANTS_FILE)
+    if restaurants_df.empty:
+        print("CRITICAL: No Shanghai restaurant data. Exiting.")
+        exit(1) # Critical failure
+    if 'id' in restaurants_df.columns:
+        restaurants_df.rename(columns={'id': 'restaurant_id'}, inplace=True)
+    if 'rating' in restaurants_df.columns:
+        restaurants_df.rename(columns={'rating': 'rating_biz'}, inplace=True)
+    print(f"Loaded {len(restaurants_df)} Shanghai restaurants.")
+    with startup_report.phase("build restaurant catalog"):
+        catalog = RestaurantCatalog(restaurants_df)
+    del restaurants_df # Only the compact catalog is kept
+    with startup_report.phase("build catalog index"):
+        catalog_index_global = build_catalog_index(catalog)
+    record_store_global = RecommendationRecordStore(catalog)
+    catalog_global = catalog
+
+    # 2-4. Model, preprocessor and derived caches
+    watched_signature = file_signature(serving_artifact_paths()) # Taken before loading, so later writes are seen
+    try:
+        snapshot = load_model_snapshot((snapshot_global.version if snapshot_global else 0) + 1)
+    except Exception as e:
+        print(f"CRITICAL: {e} Exiting.")
         exit(1)
-    
-    print("--- All resources loaded successfully ---")
+    install_snapshot(snapshot)
+    startup_report.mark("ready")
+
+    if config.INFERENCE_HOT_RELOAD_INTERVAL_SECONDS > 0 and reload_watcher_global is None:
+        reload_watcher_global = FileChangeWatcher(
+            serving_artifact_paths(), reload_model_snapshot, config.INFERENCE_HOT_RELOAD_INTERVAL_SECONDS)
+        reload_watcher_global.loaded_signature = watched_signature
+        if start_watcher:
+            reload_watcher_global.start()
+        print(f"Hot reload: watching {[os.path.basename(p) for p in reload_watcher_global.paths]} "
+              f"every {config.INFERENCE_HOT_RELOAD_INTERVAL_SECONDS}s.")
+
+    print(f"--- All resources loaded successfully ({snapshot.info['backend']} backend, version {snapshot.version}) ---")
+    catalog_index_global.geo.tree # Off the readiness path, but before the first geo-filtered request needs it
+
+
+def load_resources_in_background(on_ready=None):
+    """load_resources on a thread, so the server is listening (and answering /ready with 503) meanwhile.
+
+    A failed load exits the process, as a failed foreground load does, so it gets restarted instead of
+    answering 503 forever; the error is recorded in the startup report first. on_ready also runs then.
+    """
+    def run():
+        try:
+            load_resources()
+        except BaseException as e:
+            if not isinstance(e, SystemExit):
+                traceback.print_exc()
+            startup_report.fail(e if not isinstance(e, SystemExit) else f"exit({e.code})")
+            if on_ready is not None:
+                on_ready()
+            os._exit(1)
+        if on_ready is not None:
+            on_ready()
+    loader = threading.Thread(target=run, name="resource-loader", daemon=True)
+    loader.start()
+    return loader
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: 200 once the catalog and a model snapshot are loaded, 503 while still loading."""
+    snapshot = snapshot_global
+    is_ready = snapshot is not None and snapshot.ready
+    body = {"ready": is_ready, "version": snapshot.version if snapshot else None, "startup": startup_report.as_dict()}
+    return jsonify(body), 200 if is_ready else 503
+
+
+@app.route('/version', methods=['GET'])
+def version():
+    """What is being served: snapshot version, backend, artifact hashes/mtimes and reload status."""
+    snapshot = snapshot_global
+    if snapshot is None:
+        return jsonify({"error": "Server resources not loaded yet, see /ready."}), 503
+    return jsonify(dict(snapshot.info, **reload_status_global,
+                        hot_reload_interval_seconds=config.INFERENCE_HOT_RELOAD_INTERVAL_SECONDS))
 
 
 @app.route('/recommend', methods=['POST'])
+@with_server_timing
 def recommend():
-    global all_restaurants_df_global, inference_model_global, preprocessor_global, input_dim_global
-
-    if not all_restaurants_df_global.size or not inference_model_global or not preprocessor_global:
-        return jsonify({"error": "Server resources not loaded properly."}), 500
+    snapshot = snapshot_global # Held for the whole request, see ModelSnapshot
+    if catalog_global is None or not len(catalog_global) or snapshot is None or not snapshot.ready:
+        return jsonify({"error": "Server resources not loaded yet, see /ready."}), 503
 
     user_context = request.get_json()
     if not user_context:
@@ -102,94 +299,195 @@ def recommend():
     print(f"\n--- Received recommendation request for user context: ---")
     print(json.dumps(user_context, ensure_ascii=False, indent=2))
 
+    # Optional ?fields=name,cuisine,... projects the returned records (restaurant_id and score are always kept)
+    fields, error_msg = record_store_global.parse_fields(request.args.get('fields'))
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    # Optional ?group_by=cuisine|adname&per_group=5: the best per_group restaurants of every group
+    from food_catalog_index import parse_group_args
+    group, error_msg = parse_group_args(catalog_index_global, request.args.get('group_by'),
+                                        request.args.get('per_group'))
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+
+    # Identical contexts share one cached response (near-identical ones too with RECO_CACHE_QUANTIZE)
+    user_context = result_cache_global.quantize(user_context)
+    cache_key = result_cache_global.make_key(user_context, fields, group and [group[0], group[2]],
+                                             version=snapshot.version)
+    body, status, mimetype = result_cache_global.get_or_compute(
+        cache_key,
+        lambda: cached_response_parts(
+            app.make_response(recommend_for_context(snapshot, user_context, fields, group))))
+    return app.response_class(body, status=status, mimetype=mimetype)
+
+
+def recommend_for_context(snapshot, user_context, fields, group=None):
+    """Scores one user context (quantized with RECO_CACHE_QUANTIZE) with the given snapshot; cached by recommend()."""
+    from food_catalog_index import pop_filter_rows, excluded_rows_mask # Imported by load_resources already
+    # Optional "filters" key restricts the scored candidates, see CatalogIndex.rows_for_filters
+    with timed('filter'):
+        candidate_rows, error_msg = pop_filter_rows(catalog_index_global, user_context)
+        excluded = excluded_rows_mask(catalog_index_global, user_context)
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    if candidate_rows is not None and len(candidate_rows) == 0:
+        return jsonify({"message": "No restaurants match the filters.", "recommendations": []})
+
     # Ensure all expected user-side columns are present in the received context
-    # This mirrors the placeholder logic from the original script for robustness
-    all_user_side_features_expected = [
-        col for col in config.CATEGORY_COLS + config.NUMERIC_COLS 
-        if col not in all_restaurants_df_global.columns # Only consider user-side features
-    ]
-    
-    missing_features = []
-    for col in all_user_side_features_expected:
-        if col not in user_context:
-            missing_features.append(col)
-            # Add a very basic placeholder; ideally, client sends complete context
-            # For this API, we might prefer to return an error if critical features are missing
-            # For now, maintaining behavior of original script:
-            print(f"Warning (API Request): User feature '{col}' missing. Adding default placeholder.")
-            user_context[col] = "Unknown" if col in config.CATEGORY_COLS else 0.0
-    
+    # For this API, we might prefer to return an error if critical features are missing
+    # For now, maintaining behavior of original script: default them
+    engine = snapshot.engine
+    with timed('defaults'):
+        missing_features = engine.fill_missing_features(user_context)
     if missing_features:
         print(f"API Warning: The following user features were missing and defaulted: {missing_features}")
 
-
     try:
-        features_tensor, restaurant_ids_order, num_feat_proc = process_features_for_recommendation(
-            preprocessor_global, user_context, all_restaurants_df_global
-        )
+        if group is not None:
+            group_by, group_segments, per_group = group
+            groups = engine.top_k_per_group(user_context, per_group, group_segments, rows=candidate_rows,
+                                             excluded=excluded)
+            print(f"\n--- Sending Top {per_group} per {group_by} for {len(groups)} groups "
+                  f"({engine.serving_model_name}) ---")
+            return grouped_recommendations_response(record_store_global, group_by, groups, fields)
+        top_scores, catalog_rows = engine.top_k(user_context, config.RECO_TOP_N, rows=candidate_rows,
+                                               excluded=excluded)
     except Exception as e:
         print(f"Error during feature processing: {e}")
         return jsonify({"error": f"Error during feature processing: {str(e)}"}), 500
+    if not catalog_rows:
+        print("No high preference scores generated.")
+        return jsonify({"message": "No high preference scores generated.", "recommendations": []})
 
-    recommendations_output = []
-    
-    if features_tensor.nelement() == 0:
-        print("No features processed for recommendation.")
-        return jsonify({"message": "No features could be processed for recommendation.", "recommendations": []})
-    elif num_feat_proc != input_dim_global:
-        error_msg = f"FATAL: Feature mismatch! Model expects {input_dim_global}, Preprocessor generated: {num_feat_proc}."
-        print(error_msg)
-        return jsonify({"error": error_msg}), 500
-    else:
-        inference_model_global.eval() # Ensure it's in eval mode
-        with torch.no_grad():
-            logits = inference_model_global(features_tensor)
-            probs = torch.softmax(logits, dim=1) # Probabilities for [low, medium, high]
-            high_pref_scores = probs[:, 2]       # Assuming index 2 is 'high preference'
-
-            if high_pref_scores.numel() > 0:
-                k = min(20, len(restaurant_ids_order)) # Get top 20 or fewer if not enough options
-                
-                # Ensure k is not greater than the number of scores available
-                if high_pref_scores.numel() < k:
-                    k = high_pref_scores.numel()
-                
-                if k == 0: # No scores to pick from
-                    return jsonify({"message": "No recommendations could be generated based on scores.", "recommendations": []})
-
-                top_scores_t, top_indices_t = torch.topk(high_pref_scores, k=k)
-                
-                rec_ids = [restaurant_ids_order[i] for i in top_indices_t.tolist()] # .tolist() for safety
-                
-                # Filter all_restaurants_df for these IDs and add score
-                top_recs_df = all_restaurants_df_global[all_restaurants_df_global['restaurant_id'].isin(rec_ids)].copy()
-                
-                id_score_map_inf = dict(zip(rec_ids, top_scores_t.tolist()))
-                top_recs_df['recommendation_score'] = top_recs_df['restaurant_id'].map(id_score_map_inf)
-                
-                # Sort by score and prepare for JSON output
-                top_recs_df = top_recs_df.sort_values(by='recommendation_score', ascending=False).reset_index(drop=True)
-                
-                # Convert DataFrame to list of dicts for JSON response
-                # Fill NaN values for robustness, e.g., if some restaurant details are missing
-                recommendations_output = top_recs_df.fillna('N/A').to_dict(orient='records')
-            else:
-                 print("No high preference scores generated.")
-                 return jsonify({"message": "No high preference scores generated.", "recommendations": []})
-
-
-    if recommendations_output:
-        print(f"\n--- Sending Top {len(recommendations_output)} Recommended Restaurants ---")
-        # for rec in recommendations_output:
-        #     print(f"  - {rec.get('name','N/A')} (ID: {rec.get('restaurant_id')}) Score: {rec.get('recommendation_score'):.4f}")
-    else:
-        print("\nNo recommendations could be made for the given context.")
-        return jsonify({"message": "No recommendations could be made for the given context.", "recommendations": []})
+    # Records are pre-rendered per catalog row at load time; only the score is formatted here
+    print(f"\n--- Sending Top {len(catalog_rows)} Recommended Restaurants ({engine.serving_model_name}) ---")
+    return recommendations_response(record_store_global, catalog_rows, top_scores, fields)
+
+
+@app.route('/recommend/cache_stats', methods=['GET'])
+def recommend_cache_stats():
+    """Hit/miss counters of the /recommend result cache, for tuning RECO_CACHE_NUMERIC_BUCKETS."""
+    return jsonify(result_cache_global.stats())
+
+
+@app.route('/recommend_batch', methods=['POST'])
+@with_server_timing
+def recommend_batch():
+    """Scores many user contexts in one (users x restaurants) pass; results keep request order."""
+    from food_features import parse_batch_entries
+    from food_catalog_index import pop_batch_filter_rows, excluded_rows_mask
+    snapshot = snapshot_global
+    if catalog_global is None or snapshot is None or not snapshot.ready:
+        return jsonify({"error": "Server resources not loaded yet, see /ready."}), 503
+
+    user_contexts, top_ns, error_msg = parse_batch_entries(
+        request.get_json(silent=True), config.RECO_BATCH_MAX_CONTEXTS)
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    fields, error_msg = record_store_global.parse_fields(request.args.get('fields'))
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    with timed('filter'):
+        rows_per_entry, error_msg = pop_batch_filter_rows(catalog_index_global, user_contexts)
+        excluded_per_entry = [excluded_rows_mask(catalog_index_global, user_context) for user_context in user_contexts]
+    if error_msg:
+        return jsonify({"error": error_msg}), 400
+    engine = snapshot.engine
+    with timed('defaults'):
+        for user_context in user_contexts:
+            engine.fill_missing_features(user_context)
+    print(f"\n--- Received batch recommendation request for {len(user_contexts)} user contexts ---")
+
+    try:
+        results = engine.top_k_batch(user_contexts, top_ns, rows_per_entry, excluded_per_entry)
+    except Exception as e:
+        print(f"Error during batch scoring: {e}")
+        return jsonify({"error": f"Error during batch scoring: {str(e)}"}), 500
+
+    return batch_recommendations_response(
+        record_store_global, [(catalog_rows, top_scores) for top_scores, catalog_rows in results], fields)
+
+def start_worker_watcher():
+    # Runs in each pre-forked worker; a snapshot reloaded there is private to that worker.
+    if reload_watcher_global is not None:
+        reload_watcher_global.start()
+
+
+def check_reload_with_new_width():
+    """Hot-reloads onto a model/preprocessor pair of another one-hot width, refuses a mismatched pair, and
+    reloads the original files again (--check-reload; torch backends)."""
+    import tempfile
+    import joblib
+    import numpy as np
+    import torch
+    from food_client import create_preprocessor
+    from food_features import build_recommendation_frame, preprocessor_output_width
+    from food_model import FoodPreferenceModel
+
+    load_resources(start_watcher=False)
+    original_dim = snapshot_global.info['input_dim']
+    user_context = {'gender': '女', 'age': 31, 'daily_food_budget_cny': 120}
+    fit_context = dict(user_context)
+    snapshot_global.engine.fill_missing_features(fit_context)
+    # Fitted on part of the catalog, so the restaurant one-hot columns (cuisine, adname, ...) are fewer
+    frame, _ = build_recommendation_frame(fit_context, catalog_global.feature_frame(
+        np.arange(min(200, len(catalog_global)))), config.CATEGORY_COLS, config.NUMERIC_COLS)
+    preprocessor = create_preprocessor().fit(frame)
+    new_dim = preprocessor_output_width(preprocessor)
+    assert new_dim != original_dim, (new_dim, original_dim)
+    original_paths = (config.GLOBAL_MODEL_SAVE_PATH, config.PREPROCESSOR_SAVE_PATH)
+    client = app.test_client()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config.GLOBAL_MODEL_SAVE_PATH = os.path.join(tmp_dir, 'model.pth')
+        config.PREPROCESSOR_SAVE_PATH = os.path.join(tmp_dir, 'preprocessor.joblib')
+        torch.save(FoodPreferenceModel(new_dim).state_dict(), config.GLOBAL_MODEL_SAVE_PATH)
+        joblib.dump(preprocessor, config.PREPROCESSOR_SAVE_PATH)
+        try:
+            assert reload_model_snapshot() and snapshot_global.info['input_dim'] == new_dim
+            assert client.post('/recommend', json=dict(user_context)).status_code == 200
+            config.PREPROCESSOR_SAVE_PATH = original_paths[1] # New model, old preprocessor: refused
+            assert not reload_model_snapshot() and snapshot_global.info['input_dim'] == new_dim
+            assert "not from the same training run" in reload_status_global["last_reload_error"]
+        finally:
+            config.GLOBAL_MODEL_SAVE_PATH, config.PREPROCESSOR_SAVE_PATH = original_paths
+    assert reload_model_snapshot() and snapshot_global.info['input_dim'] == original_dim
+    assert client.post('/recommend', json=dict(user_context)).status_code == 200
+    print(f"Reload check passed: input_dim {original_dim} -> {new_dim} -> {original_dim} "
+          f"(version {snapshot_global.version}); a mismatched model/preprocessor pair was refused.")
 
-    return jsonify({"recommendations": recommendations_output})
 
 if __name__ == "__main__":
-    load_resources() # Load all models, data, preprocessors
-    print("--- Starting Flask Development Server ---")
-    # Make sure your federated_config.py, food_model.py, etc. are accessible
-    app.run(host='0.0.0.0', port=5001, debug=True) # Using port 5001 to avoid common conflicts
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="GodFood recommendation inference API")
+    parser.add_argument('--workers', type=int, default=config.INFERENCE_WORKERS,
+                        help="Pre-forked worker processes sharing one loaded copy (1 = Flask dev server)")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="Print the time spent in each import and load phase once the server is ready")
+    parser.add_argument('--check-reload', action='store_true',
+                        help="Check hot reload onto a model/preprocessor pair of another input width, then exit")
+    args = parser.parse_args()
+
+    if args.check_reload:
+        check_reload_with_new_width()
+        raise SystemExit(0)
+
+    if args.workers > 1:
+        load_resources(start_watcher=False) # Loaded once here, shared copy-on-write by the workers
+        if args.startup_report:
+            startup_report.print_report()
+        shared_dir = shared_memory_dir()
+        share_engine_arrays(snapshot_global.engine, shared_dir)
+        print(f"--- Starting {args.workers} pre-forked workers ---")
+        serve_preforked(app, '0.0.0.0', 5001, args.workers, on_worker_start=start_worker_watcher,
+                        shared_dir=shared_dir)
+    else:
+        # Models, data and preprocessors load while the server already answers /ready (503 until loaded)
+        load_resources_in_background(on_ready=startup_report.print_report if args.startup_report else None)
+        print("--- Starting Flask Development Server ---")
+        # Make sure your federated_config.py, food_model.py, etc. are accessible
+        # Served like app.run(debug=True) without the reloader (it re-executes this script in a child process,
+        # paying the whole cold start twice); the socket is bound by make_server, so "listening" is recorded then
+        from werkzeug.serving import make_server
+        app.debug = True
+        server = make_server('0.0.0.0', 5001, app, threaded=True) # Using port 5001 to avoid common conflicts
+        startup_report.mark("listening")
+        server.serve_forever()
\ No newline at end of file
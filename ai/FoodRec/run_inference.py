@@ -8,13 +8,13 @@ import joblib
 import random # For generating sample user context
 
 import federated_config as config
-from food_model import FoodPreferenceModel
 from food_data_generator import load_csv_to_dataframe # Use adapted loader
-from food_client import process_features_for_recommendation
+from food_reco_engine import RecommendationEngine, infer_input_dim, load_reco_model
 
 def infer_input_dim_from_model(state_dict):
-    if 'fc1.weight' in state_dict: return state_dict['fc1.weight'].shape[1]
-    print("Warning: Could not infer input_dim from model state_dict."); return -1
+    input_dim = infer_input_dim(state_dict)
+    if input_dim <= 0: print("Warning: Could not infer input_dim from model state_dict.")
+    return input_dim
 
 def main():
     print("--- Running Standalone Inference for Shanghai Data ---")
@@ -39,9 +39,7 @@ def main():
     config.INPUT_DIM = input_dim # Ensure config is updated if inferred
 
     try:
-        inference_model = FoodPreferenceModel(input_dim=input_dim)
-        inference_model.load_state_dict(model_state_dict)
-        inference_model.eval()
+        inference_model = load_reco_model(model_state_dict, input_dim)
         print("Global model weights loaded into inference instance.")
     except Exception as e: print(f"CRITICAL: Error initializing/loading model: {e}. Exiting."); return
 
@@ -107,25 +105,11 @@ def main():
     print(f"\n--- Making Top 10 Recommendation for User Context ---")
     # print(f"User Context: {user_context}") # Can be very verbose
 
-    features_tensor, restaurant_ids_order, num_feat_proc = process_features_for_recommendation(
-        preprocessor, user_context, all_restaurants_df
-    )
     top_recs_df = pd.DataFrame()
-    if features_tensor.nelement() == 0: print("No features processed for recommendation.")
-    elif num_feat_proc != input_dim: print(f"FATAL: Feature mismatch! Model expects {input_dim}, Preproc: {num_feat_proc}.")
-    else:
-        inference_model.eval()
-        with torch.no_grad():
-            logits = inference_model(features_tensor); probs = torch.softmax(logits, dim=1)
-            high_pref_scores = probs[:, 2]
-            if high_pref_scores.numel() > 0:
-                k = min(20, len(restaurant_ids_order))
-                top_scores_t, top_indices_t = torch.topk(high_pref_scores, k=k)
-                rec_ids = [restaurant_ids_order[i] for i in top_indices_t]
-                top_recs_df = all_restaurants_df[all_restaurants_df['restaurant_id'].isin(rec_ids)].copy()
-                id_score_map_inf = dict(zip(rec_ids, top_scores_t.tolist()))
-                top_recs_df['recommendation_score'] = top_recs_df['restaurant_id'].map(id_score_map_inf)
-                top_recs_df = top_recs_df.sort_values(by='recommendation_score', ascending=False).reset_index(drop=True)
+    try:
+        engine = RecommendationEngine(all_restaurants_df, preprocessor, inference_model, backend='torch')
+        top_recs_df, _ = engine.recommendations_frame(user_context, 20)
+    except Exception as e: print(f"FATAL: Recommendation failed: {e}")
 
     if not top_recs_df.empty:
         print("\n--- Top 20 Recommended Restaurants ---")
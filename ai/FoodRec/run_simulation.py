@@ -7,6 +7,7 @@ import os
 import federated_config as config
 from food_data_generator import get_shanghai_data_for_simulation
 from food_client import Client # CATEGORY_COLS, NUMERIC_COLS not directly needed here
+from food_catalog import RestaurantCatalog
 
 client_instances_map = {}
 active_clients_count = 0
@@ -23,7 +24,7 @@ def load_user_profiles_for_demo():
     else:
         print(f"Warning: User profiles {config.USER_ENHANCED_DATASET_FILE} not found. Reco demo limited.")
 
-def run_client_process(client_idx_num, client_review_data, all_restaurants_df, server_url):
+def run_client_process(client_idx_num, client_review_data, restaurant_catalog, server_url):
     global active_clients_count
     if client_review_data.empty: print(f"INFO: Client {client_idx_num} no review data. Skipping."); return
 
@@ -41,7 +42,7 @@ def run_client_process(client_idx_num, client_review_data, all_restaurants_df, s
     try:
         client_instance = Client(client_id=client_id_str,
                                  reviews_df_for_client=client_review_data,
-                                 all_restaurants_df=all_restaurants_df,
+                                 all_restaurants_df=restaurant_catalog,
                                  server_url=server_url,
                                  user_enhanced_profile_series=user_profile_series_for_client)
     except Exception as e_init:
@@ -82,13 +83,14 @@ if __name__ == '__main__':
     if not all_client_review_dfs: print("CRITICAL: No client review data. Exiting."); exit()
     # config.NUM_USERS is updated by get_shanghai_data_for_simulation
     print(f"INFO: Simulating with {config.NUM_USERS} clients based on review files found.")
+    restaurant_catalog = RestaurantCatalog(all_restaurants_df_global) # Built once, shared by every client thread
 
     client_threads = []
     # Iterate up to the potentially adjusted config.NUM_USERS
     for i in range(config.NUM_USERS):
         if i < len(all_client_review_dfs) and not all_client_review_dfs[i].empty:
             thread = threading.Thread(target=run_client_process,
-                                      args=(i, all_client_review_dfs[i], all_restaurants_df_global, server_url))
+                                      args=(i, all_client_review_dfs[i], restaurant_catalog, server_url))
             client_threads.append(thread)
     if not client_threads: print("CRITICAL: No client threads prepared. Exiting."); exit()
 
@@ -10,6 +10,7 @@ import requests # For informing server about NUM_USERS (optional, see notes)
 import federated_config as config
 from food_data_generator import get_shanghai_data_for_simulation # To load all data initially
 from food_client import Client # The core client logic
+from food_catalog import RestaurantCatalog
 
 # --- Configuration for Single Client Test ---
 # Choose which client's data to use (e.g., the first one found)
@@ -47,6 +48,7 @@ def main():
     if not all_client_review_dfs:
         print("CRITICAL (SingleClient): No client review data prepared. Exiting.")
         return
+    restaurant_catalog = RestaurantCatalog(all_restaurants_df_global) # What Client scores and merges against
 
     if CLIENT_INDEX_TO_TEST >= len(all_client_review_dfs):
         print(f"CRITICAL (SingleClient): CLIENT_INDEX_TO_TEST ({CLIENT_INDEX_TO_TEST}) is out of bounds. "
@@ -95,7 +97,7 @@ def main():
     try:
         client_instance = Client(client_id=client_id_str,
                                  reviews_df_for_client=single_client_review_data,
-                                 all_restaurants_df=all_restaurants_df_global,
+                                 all_restaurants_df=restaurant_catalog,
                                  server_url=server_url,
                                  user_enhanced_profile_series=user_profile_series_for_this_client) # Pass profile for reco demo later
     except Exception as e_init:
@@ -15,9 +15,11 @@ import federated_config as config
 from food_model import FoodPreferenceModel # Needed if Client doesn't fully encapsulate model
 from food_data_generator import load_csv_to_dataframe, get_shanghai_data_for_simulation # For loading all_restaurants
 from food_client import Client
+from food_catalog import RestaurantCatalog
 
 # --- Global Variables for Loaded Resources ---
 all_restaurants_df_global = None
+restaurant_catalog_global = None # RestaurantCatalog of all_restaurants_df_global, shared by every request's Client
 # Preprocessor is typically handled by the Client instance itself or loaded from server
 # INPUT_DIM is also managed by Client interaction with server or initial fitting
 
@@ -35,7 +37,7 @@ def csv_string_to_dataframe(csv_string):
 
 def load_global_resources():
     """Loads resources needed by all API calls, primarily restaurant data."""
-    global all_restaurants_df_global
+    global all_restaurants_df_global, restaurant_catalog_global
     print("--- Loading Global Resources for Training API ---")
 
     # 1. Load All Restaurant Data (essential for feature processing)
@@ -53,6 +55,7 @@ def load_global_resources():
         print(f"CRITICAL: Could not load restaurant data from {config.SHANGHAI_RESTAURANTS_FILE}. Exiting.")
         exit(1)
     all_restaurants_df_global = temp_restaurants_df
+    restaurant_catalog_global = RestaurantCatalog(all_restaurants_df_global)
     print(f"Loaded {len(all_restaurants_df_global)} Shanghai restaurants globally.")
 
     # Ensure config.INPUT_DIM is initialized (e.g. from a saved preprocessor or model if needed)
@@ -136,7 +139,7 @@ def train_user_model_api():
         # 3. Initialize its self.model structure (e.g., FoodPreferenceModel(input_dim))
         client_instance = Client(client_id=client_id_str,
                                  reviews_df_for_client=client_review_data.copy(), # Pass a copy
-                                 all_restaurants_df=all_restaurants_df_global,
+                                 all_restaurants_df=restaurant_catalog_global,
                                  server_url=server_url,
                                  user_enhanced_profile_series=user_profile_series_for_client)
     except Exception as e_init: